@@ -53,13 +53,9 @@ export class History {
 
   fetch() {
     this.fetching = true;
-    this.authService.get(CONFIG.API_URL + 'meetings/')
+    this.authService.get(CONFIG.API_URL + 'meetings/?page_size=10')
       .map(res => res.json())
-      .map((res) => {
-        return res.sort((a, b) => {
-          return b.id - a.id;
-        }).slice(0, 10);
-      })
+      .map(res => res.results)
       .toPromise()
       .then((data) => {
         this.list = data;
@@ -0,0 +1,103 @@
+"""
+Collect the push messages sent during a transaction, to send them in as few requests as possible.
+
+Within `collect_messages`, messages sent to users are not sent right away. Once the transaction commits, recipients of
+identical messages are grouped and each message is sent once to all of them, in bulk. Nothing is sent if the
+transaction is rolled back. Messages which cannot be sent then are logged, the changes they are about are committed
+already.
+
+When `USE_OUTBOX` is set in `FCM_SETTINGS`, grouped messages are written to the outbox at the end of the block
+instead, still inside the transaction.
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from pyfcm.errors import FCMError
+from requests import RequestException
+
+from device.models import Device
+
+__author__ = "agent <agent@local>"
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class MessageCollector:
+    """Keeps the recipients of each distinct message."""
+
+    def __init__(self):
+        """Create an empty collector."""
+        self.messages = OrderedDict()
+
+    def add(self, user_ids, **message):
+        """
+        Add recipients to a message.
+
+        :param user_ids: ids of the users to which to send the message
+        :param message: arguments of the message, see `Device.send_message`
+        """
+        key = json.dumps(message, sort_keys=True)
+        self.messages.setdefault(key, (message, []))[1].extend(user_ids)
+
+    def flush(self):
+        """Send each message to all its recipients at once."""
+        messages, self.messages = self.messages, OrderedDict()
+        for message, user_ids in messages.values():
+            Device.objects.filter(user_id__in=user_ids).send_message(**message)
+
+    def flush_committed(self):
+        """
+        Send each message to all its recipients at once, once the transaction committed.
+
+        The request which sent the messages succeeded, failures to send them are thus logged rather than raised, and do
+        not prevent the other messages from being sent.
+        """
+        messages, self.messages = self.messages, OrderedDict()
+        for message, user_ids in messages.values():
+            try:
+                Device.objects.filter(user_id__in=user_ids).send_message(**message)
+            except (FCMError, RequestException):
+                logger.exception("Could not send push to %d users", len(user_ids))
+
+
+def get_collector():
+    """
+    Get the collector of the current thread.
+
+    :return: a `MessageCollector`, or None if messages are not collected
+    """
+    return getattr(_local, "collector", None)
+
+
+@contextmanager
+def collect_messages():
+    """
+    Run a block atomically, collecting the messages sent to users meanwhile.
+
+    This can also be used as a decorator. Nested blocks join the collection of the outermost one.
+    """
+    if get_collector() is not None:
+        with transaction.atomic():
+            yield
+        return
+
+    collector = _local.collector = MessageCollector()
+    use_outbox = settings.FCM_SETTINGS.get("USE_OUTBOX", False)
+    try:
+        with transaction.atomic():
+            yield
+            if use_outbox:
+                collector.flush()
+    finally:
+        _local.collector = None
+
+    if not use_outbox:
+        transaction.on_commit(collector.flush_committed)
@@ -3,10 +3,272 @@ Utilities to send FCM messages.
 
 Based on xtrinch/fcm-django (https://github.com/xtrinch/fcm-django)
 Use lucurious/PyFCM (https://github.com/olucurious/PyFCM)
+
+All messages go through a single client per process, configured by the `FCM_SETTINGS` setting:
+
+    - FCM_SERVER_KEY: the FCM server key
+    - FCM_END_POINT: url to which to send messages, defaults to the FCM one
+    - FCM_POOL_SIZE: maximum number of connections kept alive to FCM
+    - FCM_CONNECT_TIMEOUT, FCM_READ_TIMEOUT: timeouts in seconds for requests made to FCM
+    - FCM_CHUNK_SIZE: maximum number of registration ids sent in a single request, at most 1000
+    - FCM_FANOUT_WORKERS: number of threads sending the chunks of a bulk message concurrently
+    - FCM_MAX_RETRIES: number of times a transient failure is retried
+    - FCM_RETRY_DELAY: delay in seconds before the first retry, doubled on each retry and jittered
+    - FCM_BREAKER_THRESHOLD: number of consecutive failed requests after which requests are not even attempted
+    - FCM_BREAKER_TIMEOUT: seconds after which a request is attempted again once the breaker opened
+    - FCM_IID_END_POINT: url of the instance id service managing topic subscriptions, defaults to the Google one
+    - METRICS_FLUSH_INTERVAL: seconds between two writes of the push metrics to the database, see `device.metrics`
+
+FCM answers with a result for each registration id, see `is_dead`, `is_transient` and `get_canonical_id`.
 """
 
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
 from django.conf import settings
 from pyfcm import FCMNotification
+from pyfcm.errors import FCMServerError
+from requests import RequestException
+from requests.adapters import HTTPAdapter
+
+from device.metrics import get_message_type, push_metrics
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_FANOUT_WORKERS = 4
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_DELAY = 0.5
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_TIMEOUT = 30
+
+DEFAULT_IID_END_POINT = "https://iid.googleapis.com/iid/v1"
+
+# the registration id will never be valid again
+DEAD_TOKEN_ERRORS = frozenset(("NotRegistered", "InvalidRegistration", "MismatchSenderId", "MissingRegistration"))
+
+# sending again later may succeed
+TRANSIENT_ERRORS = frozenset(("Unavailable", "InternalServerError", "DeviceMessageRateExceeded"))
+
+logger = logging.getLogger(__name__)
+
+
+def is_dead(result):
+    """Check whether the FCM result for a registration id tells it will never be valid again."""
+    return "error" in result and result["error"] in DEAD_TOKEN_ERRORS
+
+
+def is_transient(result):
+    """Check whether the FCM result for a registration id tells sending again later may succeed."""
+    return "error" in result and result["error"] in TRANSIENT_ERRORS
+
+
+def get_canonical_id(result):
+    """Get the new registration id to use for a device, given its FCM result, or None if it did not change."""
+    return result["registration_id"] if "registration_id" in result and "error" not in result else None
+
+
+class CircuitOpenError(FCMServerError):
+    """Raised instead of sending requests to FCM while it keeps failing."""
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to FCM once it failed too many times in a row.
+
+    Once opened, a single request is let through every `timeout` seconds to check whether FCM recovered.
+    """
+
+    def __init__(self, threshold=DEFAULT_BREAKER_THRESHOLD, timeout=DEFAULT_BREAKER_TIMEOUT):
+        """
+        Create a new closed circuit breaker.
+
+        :param threshold: number of consecutive failures after which the breaker opens
+        :param timeout: seconds to wait before letting a request through once opened
+        """
+        self.threshold = threshold
+        self.timeout = timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        """
+        Check a request can be sent.
+
+        :raise CircuitOpenError: if the breaker is open
+        """
+        with self.lock:
+            if self.opened_at is not None:
+                if time.monotonic() - self.opened_at < self.timeout:
+                    raise CircuitOpenError("FCM failed {} times in a row, not sending".format(self.failures))
+                # let this request through, and wait again before the next one if it fails as well
+                self.opened_at = time.monotonic()
+
+    def record_success(self):
+        """Close the breaker after a successful request."""
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """Count a failed request, opening the breaker if there were too many in a row."""
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class PooledFCMNotification(FCMNotification):
+    """
+    Extends `FCMNotification` to reuse HTTP connections between pushes.
+
+    pyfcm opens a new connection, with its TLS handshake, for every request it makes. This keeps a `requests.Session`
+    with a bounded pool of keep-alive connections instead. Responses are kept per thread, which allows to share a
+    single instance between all threads of a process.
+    """
+
+    def __init__(self, api_key=None, end_point=None, pool_size=DEFAULT_POOL_SIZE, timeout=None,
+                 breaker=None):  # pylint: disable=too-many-arguments
+        """
+        Create a new pooled client.
+
+        :param api_key: FCM server key
+        :param end_point: url to which to send the messages, defaults to the FCM one
+        :param pool_size: maximum number of connections kept alive, threads block when all are in use
+        :param timeout: `requests` timeout, either a number of seconds or a (connect, read) tuple
+        :param breaker: `CircuitBreaker` guarding requests sent with retries, a default one is created if None
+        """
+        self._local = threading.local()
+        super().__init__(api_key=api_key)
+
+        if end_point is not None:
+            self.FCM_END_POINT = end_point
+
+        self.timeout = timeout
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.session = requests.Session()
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @property
+    def send_request_responses(self):
+        """Get the responses received by the current thread."""
+        return getattr(self._local, "responses", [])
+
+    @send_request_responses.setter
+    def send_request_responses(self, responses):
+        self._local.responses = responses
+
+    def send_request(self, payloads=None):
+        """
+        Send the payloads to FCM, using the connections of the pool.
+
+        :param payloads: list of json payloads to send
+        """
+        self.send_request_responses = [
+            self.session.post(
+                self.FCM_END_POINT,
+                headers=self.request_headers(),
+                data=payload,
+                proxies=getattr(self, "FCM_REQ_PROXIES", None),
+                timeout=self.timeout,
+            )
+            for payload in payloads
+        ]
+
+    def close(self):
+        """Close all connections kept alive."""
+        self.session.close()
+
+
+_push_service = None
+_push_service_pid = None
+_push_service_lock = threading.Lock()
+_fanout_executor = None
+
+
+def get_push_service():
+    """
+    Get the client shared by the whole process to send messages to FCM.
+
+    The client is created lazily, and again in each process forked after its creation (as uWSGI does with its
+    workers), as connections cannot be shared between processes.
+
+    :return: a `PooledFCMNotification` instance
+    """
+    global _push_service, _push_service_pid, _fanout_executor  # pylint: disable=global-statement
+
+    service = _push_service
+    if service is not None and _push_service_pid == os.getpid():
+        return service
+
+    with _push_service_lock:
+        if _push_service is None or _push_service_pid != os.getpid():
+            fcm_settings = settings.FCM_SETTINGS
+            _push_service = PooledFCMNotification(
+                api_key=fcm_settings.get("FCM_SERVER_KEY"),
+                end_point=fcm_settings.get("FCM_END_POINT"),
+                pool_size=fcm_settings.get("FCM_POOL_SIZE", DEFAULT_POOL_SIZE),
+                timeout=(
+                    fcm_settings.get("FCM_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT),
+                    fcm_settings.get("FCM_READ_TIMEOUT", DEFAULT_READ_TIMEOUT),
+                ),
+                breaker=CircuitBreaker(
+                    threshold=fcm_settings.get("FCM_BREAKER_THRESHOLD", DEFAULT_BREAKER_THRESHOLD),
+                    timeout=fcm_settings.get("FCM_BREAKER_TIMEOUT", DEFAULT_BREAKER_TIMEOUT),
+                ),
+            )
+            _push_service_pid = os.getpid()
+            _fanout_executor = None
+
+        return _push_service
+
+
+def get_fanout_executor():
+    """
+    Get the thread pool shared by the process to send chunks of bulk messages concurrently.
+
+    :return: a `ThreadPoolExecutor` instance
+    """
+    global _fanout_executor  # pylint: disable=global-statement
+
+    # creating the push service first ensures both belong to the current process
+    get_push_service()
+
+    with _push_service_lock:
+        if _fanout_executor is None:
+            _fanout_executor = ThreadPoolExecutor(
+                max_workers=settings.FCM_SETTINGS.get("FCM_FANOUT_WORKERS", DEFAULT_FANOUT_WORKERS)
+            )
+        return _fanout_executor
+
+
+def close_push_service():
+    """Close the client and thread pool shared by the process, new ones will be created on the next push."""
+    global _push_service, _fanout_executor  # pylint: disable=global-statement
+
+    with _push_service_lock:
+        if _push_service_pid == os.getpid():
+            if _push_service is not None:
+                _push_service.close()
+            if _fanout_executor is not None:
+                _fanout_executor.shutdown()
+        _push_service = None
+        _fanout_executor = None
+
+
+atexit.register(close_push_service)
 
 
 def send_fcm_message(registration_id,
@@ -17,17 +279,14 @@ def send_fcm_message(registration_id,
                      sound=None,
                      badge=None, **kwargs):
     """Send a push notification with FCM to a device."""
-    api_key = settings.FCM_SETTINGS.get("FCM_SERVER_KEY")
-    push_service = FCMNotification(api_key=api_key)
-
-    return push_service.notify_single_device(registration_id=registration_id,
-                                             message_title=title,
-                                             message_body=body,
-                                             message_icon=icon,
-                                             data_message=data,
-                                             sound=sound,
-                                             badge=badge,
-                                             **kwargs)
+    return get_push_service().notify_single_device(registration_id=registration_id,
+                                                   message_title=title,
+                                                   message_body=body,
+                                                   message_icon=icon,
+                                                   data_message=data,
+                                                   sound=sound,
+                                                   badge=badge,
+                                                   **kwargs)
 
 
 def send_fcm_bulk_message(registration_ids,
@@ -38,14 +297,232 @@ def send_fcm_bulk_message(registration_ids,
                           sound=None,
                           badge=None, **kwargs):
     """Send a push notification with FCM to multiple devices."""
-    api_key = settings.FCM_SETTINGS.get("FCM_SERVER_KEY")
-    push_service = FCMNotification(api_key=api_key)
-
-    return push_service.notify_multiple_devices(registration_ids=registration_ids,
-                                                message_title=title,
-                                                message_body=body,
-                                                message_icon=icon,
-                                                data_message=data,
-                                                sound=sound,
-                                                badge=badge,
-                                                **kwargs)
+    return get_push_service().notify_multiple_devices(registration_ids=registration_ids,
+                                                      message_title=title,
+                                                      message_body=body,
+                                                      message_icon=icon,
+                                                      data_message=data,
+                                                      sound=sound,
+                                                      badge=badge,
+                                                      **kwargs)
+
+
+def send_fcm_topic_message(topic,
+                           title=None,
+                           body=None,
+                           icon=None,
+                           data=None,
+                           sound=None,
+                           badge=None, **kwargs):
+    """Send a push notification with FCM to every device subscribed to a topic, retrying transient failures."""
+    def send(topics, **message):
+        return [get_push_service().notify_topic_subscribers(topic_name=topics[0], **message)]
+
+    result = send_with_retries(send, [topic],
+                               message_title=title,
+                               message_body=body,
+                               message_icon=icon,
+                               data_message=data,
+                               sound=sound,
+                               badge=badge,
+                               **kwargs)[0]
+    push_metrics.maybe_flush()
+    return result
+
+
+def _manage_topic_subscriptions(action, topic, registration_ids):
+    """
+    Add or remove devices to a topic, with the instance id service.
+
+    :param action: either "batchAdd" or "batchRemove"
+    :param topic: name of the topic
+    :param registration_ids: list of FCM registration ids of the devices
+    :return: the result for each registration id, in order
+    """
+    service = get_push_service()
+    end_point = "{}:{}".format(settings.FCM_SETTINGS.get("FCM_IID_END_POINT", DEFAULT_IID_END_POINT), action)
+
+    results = []
+    for start in range(0, len(registration_ids), FCMNotification.FCM_MAX_RECIPIENTS):
+        response = service.session.post(
+            end_point,
+            headers=service.request_headers(),
+            data=json.dumps(dict(
+                to="/topics/{}".format(topic),
+                registration_tokens=registration_ids[start:start + FCMNotification.FCM_MAX_RECIPIENTS],
+            )),
+            timeout=service.timeout,
+        )
+        response.raise_for_status()
+        results.extend(response.json().get("results", []))
+    return results
+
+
+def subscribe_to_topic(topic, registration_ids):
+    """
+    Subscribe devices to a topic.
+
+    :param topic: name of the topic
+    :param registration_ids: list of FCM registration ids of the devices to subscribe
+    :return: the result for each registration id, in order
+    """
+    return _manage_topic_subscriptions("batchAdd", topic, registration_ids)
+
+
+def unsubscribe_from_topic(topic, registration_ids):
+    """
+    Unsubscribe devices from a topic.
+
+    :param topic: name of the topic
+    :param registration_ids: list of FCM registration ids of the devices to unsubscribe
+    :return: the result for each registration id, in order
+    """
+    return _manage_topic_subscriptions("batchRemove", topic, registration_ids)
+
+
+def _record_outcome(message_type, results):
+    """Record the outcome of sending a message in the push metrics."""
+    push_metrics.record_outcome(
+        message_type,
+        success=sum(1 for result in results if "error" not in result),
+        failure=sum(1 for result in results if "error" in result),
+        deactivated=sum(1 for result in results if is_dead(result)),
+    )
+
+
+def send_with_retries(send, registration_ids, **kwargs):
+    """
+    Send a message with FCM, retrying transient failures.
+
+    Failed requests, and registration ids with a transient error, are sent again after a jittered exponential delay,
+    until they succeed or `FCM_MAX_RETRIES` is reached. Requests are guarded by the circuit breaker of the push service.
+
+    :param send: function sending the message to a list of registration ids, returning the pyfcm responses
+    :param registration_ids: list of FCM registration ids to which to send the message
+    :param kwargs: arguments given to `send`
+    :return: the FCM result for each registration id, in order
+    """
+    fcm_settings = settings.FCM_SETTINGS
+    max_retries = fcm_settings.get("FCM_MAX_RETRIES", DEFAULT_MAX_RETRIES)
+    delay = fcm_settings.get("FCM_RETRY_DELAY", DEFAULT_RETRY_DELAY)
+    breaker = get_push_service().breaker
+
+    message_type = get_message_type(kwargs.get("data", kwargs.get("data_message")))
+    results = [dict() for _ in registration_ids]
+    pending = list(range(len(registration_ids)))
+
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            time.sleep(delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+        breaker.before_request()
+        start = time.perf_counter()
+        try:
+            responses = send([registration_ids[index] for index in pending], **kwargs)
+        except (FCMServerError, RequestException):
+            push_metrics.record_request(message_type, len(pending), time.perf_counter() - start)
+            breaker.record_failure()
+            if attempt == max_retries:
+                _record_outcome(message_type, [
+                    dict(error="Unavailable") if index in pending else result for index, result in enumerate(results)
+                ])
+                raise
+            continue
+        push_metrics.record_request(message_type, len(pending), time.perf_counter() - start)
+        breaker.record_success()
+
+        for index, result in zip(pending, (result for response in responses for result in response.get("results", []))):
+            results[index] = result
+
+        pending = [index for index in pending if is_transient(results[index])]
+        if not pending:
+            break
+
+    if pending:
+        logger.warning("Could not send push to %d devices after %d retries", len(pending), max_retries)
+
+    _record_outcome(message_type, results)
+
+    return results
+
+
+def send_fcm_single(registration_id, **kwargs):
+    """
+    Send a push notification with FCM to a device, retrying transient failures.
+
+    See `send_fcm_message` for the accepted parameters.
+
+    :return: the FCM result for the device
+    """
+    def send(registration_ids, **message):
+        return [send_fcm_message(registration_ids[0], **message)]
+
+    result = send_with_retries(send, [registration_id], **kwargs)[0]
+    push_metrics.maybe_flush()
+    return result
+
+
+def get_chunk_size():
+    """Get the maximum number of registration ids sent in a single request, see `FCM_CHUNK_SIZE`."""
+    return min(
+        settings.FCM_SETTINGS.get("FCM_CHUNK_SIZE", FCMNotification.FCM_MAX_RECIPIENTS),
+        FCMNotification.FCM_MAX_RECIPIENTS
+    )
+
+
+def send_fcm_fanout(registration_ids, **kwargs):
+    """
+    Send a push notification with FCM to any number of devices.
+
+    Registration ids are split in chunks of at most `FCM_CHUNK_SIZE` ids, which are sent concurrently on the shared
+    thread pool, with retries (see `send_with_retries`). The results of every chunk are then merged back, in the order
+    of the given registration ids. A chunk which could not be sent at all gets an "Unavailable" error for each of its
+    registration ids, the results of the other chunks being kept, and the error is only raised when no chunk was sent.
+
+    See `send_fcm_bulk_message` for the accepted parameters.
+
+    :param registration_ids: list of FCM registration ids to which to send the message
+    :return: a dict with the total `success`, `failure` and `canonical_ids` counts, the `results` for each
+             registration id and the time `elapsed` to send everything, in seconds
+    """
+    chunk_size = get_chunk_size()
+    chunks = [registration_ids[i:i + chunk_size] for i in range(0, len(registration_ids), chunk_size)]
+
+    start = time.perf_counter()
+
+    if len(chunks) == 1:
+        chunk_results = [send_with_retries(send_fcm_bulk_message, chunks[0], **kwargs)]
+    else:
+        executor = get_fanout_executor()
+        futures = [executor.submit(send_with_retries, send_fcm_bulk_message, chunk, **kwargs) for chunk in chunks]
+        # wait for every chunk before raising, so that no request is left running in the background
+        errors = [future.exception() for future in futures]
+        if all(error is not None for error in errors):
+            raise errors[0]
+
+        chunk_results = []
+        for chunk, future, error in zip(chunks, futures, errors):
+            if error is None:
+                chunk_results.append(future.result())
+            else:
+                logger.warning("Could not send push to a chunk of %d devices: %r", len(chunk), error)
+                chunk_results.append([dict(error="Unavailable") for _ in chunk])
+
+    elapsed = time.perf_counter() - start
+
+    results = [result for results in chunk_results for result in results]
+    result = dict(
+        success=sum(1 for result in results if "error" not in result),
+        failure=sum(1 for result in results if "error" in result),
+        canonical_ids=sum(1 for result in results if get_canonical_id(result) is not None),
+        results=results,
+        elapsed=elapsed,
+    )
+
+    logger.info(
+        "Sent push to %d devices in %d chunks in %.3fs (%.0f pushes/s)",
+        len(registration_ids), len(chunks), elapsed, len(registration_ids) / elapsed if elapsed else 0
+    )
+    push_metrics.maybe_flush()
+
+    return result
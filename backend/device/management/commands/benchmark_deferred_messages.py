@@ -0,0 +1,120 @@
+"""Benchmark the queries made on a large deferred messages table."""
+
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from device.models import DeferredMessage
+
+__author__ = "agent <agent@local>"
+
+
+class Command(BaseCommand):
+    """
+    Time the replay and cancel-cleanup queries against a table filled with synthetic messages.
+
+    Everything is created in a transaction which is rolled back at the end, the database is left untouched.
+    """
+
+    help = "Time deferred messages replay and cleanup queries on a large synthetic table."
+
+    def add_arguments(self, parser):
+        """Add the size of the synthetic data set and the number of measures as arguments."""
+        parser.add_argument("--rows", type=int, default=1000000, help="number of deferred messages to create")
+        parser.add_argument("--users", type=int, default=100000, help="number of users to spread the messages over")
+        parser.add_argument("--meetings", type=int, default=50000, help="number of meetings messages relate to")
+        parser.add_argument("--queries", type=int, default=200, help="number of times each query is timed")
+
+    def handle(self, *args, **options):
+        """Fill the table, run the benchmark and print the results."""
+        class Rollback(Exception):
+            """Raised to discard the synthetic data."""
+
+        try:
+            with transaction.atomic():
+                user_ids = self.populate(options["rows"], options["users"], options["meetings"])
+                self.benchmark(user_ids, options["meetings"], options["queries"])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def populate(self, rows, users, meetings):
+        """
+        Create `users` users, and `rows` messages related to `meetings` meetings spread over them.
+
+        Half of the messages are already expired.
+
+        :return: the ids of the created users
+        """
+        start = time.perf_counter()
+
+        get_user_model().objects.bulk_create(
+            get_user_model()(username="benchmark-{}".format(i), email="benchmark-{}@rady.test".format(i))
+            for i in range(users)
+        )
+        user_ids = list(
+            get_user_model().objects.filter(username__startswith="benchmark-").values_list("id", flat=True)
+        )
+
+        now = timezone.now()
+        batch_size = 10000
+        for offset in range(0, rows, batch_size):
+            DeferredMessage.objects.bulk_create(
+                DeferredMessage(
+                    user_id=user_ids[i % users],
+                    title="title",
+                    data=dict(type="benchmark", meeting=i % meetings),
+                    related_type="meeting",
+                    related_id=i % meetings,
+                    expires_at=now + timedelta(days=1 if i % 2 else -1),
+                )
+                for i in range(offset, min(offset + batch_size, rows))
+            )
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE {}".format(DeferredMessage._meta.db_table))
+
+        self.stdout.write("Created {} messages in {:.1f}s".format(rows, time.perf_counter() - start))
+        return user_ids
+
+    def benchmark(self, user_ids, meetings, queries):
+        """Time the replay and cleanup queries for spread out users and meetings."""
+        def replay(i):
+            list(DeferredMessage.objects.filter(user_id=user_ids[i * 7919 % len(user_ids)]).pending().order_by("id"))
+
+        def cleanup(i):
+            DeferredMessage.objects.filter(related_type="meeting", related_id=i * 7919 % meetings).delete()
+
+        for name, query in (("replay", replay), ("cancel cleanup", cleanup)):
+            self.report(name, self.measure(query, queries))
+
+    @staticmethod
+    def measure(query, queries):
+        """
+        Time each call to `query`.
+
+        :param query: function running the query, given the index of the measure
+        :param queries: number of measures to make
+        :return: sorted list of latencies, in milliseconds
+        """
+        latencies = []
+        for i in range(queries):
+            start = time.perf_counter()
+            query(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+        return sorted(latencies)
+
+    def report(self, name, latencies):
+        """Print a summary of the given latencies."""
+        self.stdout.write("{:<20} mean={:.3f}ms p50={:.3f}ms p99={:.3f}ms".format(
+            name,
+            statistics.mean(latencies),
+            latencies[len(latencies) // 2],
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        ))
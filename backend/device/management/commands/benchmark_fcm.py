@@ -0,0 +1,70 @@
+"""Benchmark the latency of single pushes against a local FCM stand-in."""
+
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from pyfcm import FCMNotification
+
+from device.fcm import PooledFCMNotification
+from device.stub import FCMStubServer
+
+__author__ = "agent <agent@local>"
+
+
+class Command(BaseCommand):
+    """
+    Compare the per-push latency of a new `FCMNotification` per push with the pooled client.
+
+    No message leaves the machine, every push is sent to a local FCM stand-in.
+    """
+
+    help = "Compare per-push latency of a fresh FCM client per push against the pooled client."
+
+    def add_arguments(self, parser):
+        """Add the number of pushes to send as argument."""
+        parser.add_argument("--pushes", type=int, default=500, help="number of pushes to send with each client")
+
+    def handle(self, *args, **options):
+        """Run the benchmark and print the results."""
+        with FCMStubServer() as server:
+            def fresh_client_push():
+                push_service = FCMNotification(api_key="benchmark")
+                push_service.FCM_END_POINT = server.url
+                push_service.notify_single_device(registration_id="benchmark", data_message=dict(type="benchmark"))
+
+            pooled = PooledFCMNotification(api_key="benchmark", end_point=server.url)
+
+            def pooled_client_push():
+                pooled.notify_single_device(registration_id="benchmark", data_message=dict(type="benchmark"))
+
+            try:
+                for name, push in (("new client per push", fresh_client_push), ("pooled client", pooled_client_push)):
+                    self.report(name, self.measure(push, options["pushes"]))
+            finally:
+                pooled.close()
+
+    @staticmethod
+    def measure(push, pushes):
+        """
+        Time each call to `push`.
+
+        :param push: function sending a single push
+        :param pushes: number of pushes to send
+        :return: sorted list of latencies, in milliseconds
+        """
+        latencies = []
+        for _ in range(pushes):
+            start = time.perf_counter()
+            push()
+            latencies.append((time.perf_counter() - start) * 1000)
+        return sorted(latencies)
+
+    def report(self, name, latencies):
+        """Print a summary of the given latencies."""
+        self.stdout.write("{:<20} mean={:.3f}ms p50={:.3f}ms p99={:.3f}ms".format(
+            name,
+            statistics.mean(latencies),
+            latencies[len(latencies) // 2],
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        ))
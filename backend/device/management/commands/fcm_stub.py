@@ -0,0 +1,62 @@
+"""Run a local stand-in for the FCM HTTP server."""
+
+from django.core.management.base import BaseCommand
+
+from device.stub import accept, FCMStubServer
+
+__author__ = "agent <agent@local>"
+
+
+DEAD_SUFFIX = "-dead"
+MOVED_SUFFIX = "-moved"
+
+
+def suffix_result(registration_id):
+    """
+    Get the result for a registration id, according to its suffix.
+
+    Registration ids ending with "-dead" are not registered anymore, those ending with "-moved" are given a new
+    canonical id, without the suffix. Any other is accepted.
+    """
+    if registration_id.endswith(DEAD_SUFFIX):
+        return dict(error="NotRegistered")
+    if registration_id.endswith(MOVED_SUFFIX):
+        return dict(accept(registration_id), registration_id=registration_id[:-len(MOVED_SUFFIX)])
+    return accept(registration_id)
+
+
+class Command(BaseCommand):
+    """
+    Serve the FCM legacy send end point locally, to point `FCM_SETTINGS["FCM_END_POINT"]` to.
+
+    Registration ids ending with "-dead" are rejected and those ending with "-moved" get a canonical id.
+    """
+
+    help = "Run a local FCM stand-in, with configurable latency and error rate."
+
+    def add_arguments(self, parser):
+        """Add the address, latency and error rate of the server as arguments."""
+        parser.add_argument("--host", default="127.0.0.1", help="address on which to listen")
+        parser.add_argument("--port", type=int, default=8001, help="port on which to listen")
+        parser.add_argument("--latency", type=float, default=0, help="milliseconds to wait before each response")
+        parser.add_argument("--error-rate", type=float, default=0, help="share of requests failing, from 0 to 1")
+
+    def handle(self, *args, **options):
+        """Serve requests until interrupted."""
+        server = FCMStubServer(
+            host=options["host"],
+            port=options["port"],
+            result_for=suffix_result,
+            latency=options["latency"] / 1000,
+            error_rate=options["error_rate"],
+        )
+        self.stdout.write("FCM stand-in listening on {}".format(server.url))
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write("Handled {} requests on {} connections, {} failed".format(
+            server.requests, server.connections, server.errors
+        ))
@@ -0,0 +1,165 @@
+"""Measure the throughput and latency of the push path against a local FCM stand-in."""
+
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from pyfcm.errors import FCMError
+from requests import RequestException
+
+from device.fcm import close_push_service
+from device.management.commands.fcm_stub import DEAD_SUFFIX, suffix_result
+from device.models import Device
+from device.stub import FCMStubServer
+
+__author__ = "agent <agent@local>"
+
+
+USERNAME_PREFIX = "load-test-"
+
+
+class Command(BaseCommand):
+    """
+    Send pushes through the real `send_message` paths, from concurrent threads, and report throughput and latency.
+
+    Pushes go to a local FCM stand-in, either started by the command or given by `--end-point` (see `fcm_stub`).
+    The users and devices needed are created for the run, and deleted at the end.
+    """
+
+    help = "Load test the push path against a local FCM stand-in, reporting pushes/s and p50/p99 latencies."
+
+    def add_arguments(self, parser):
+        """Add the size of the load, and the behaviour of the FCM stand-in, as arguments."""
+        parser.add_argument("--devices", type=int, default=1000, help="number of devices to create")
+        parser.add_argument("--messages", type=int, default=1000, help="number of messages to send")
+        parser.add_argument("--recipients", type=int, default=1,
+                            help="devices per message, 1 uses Device.send_message, more the queryset one")
+        parser.add_argument("--concurrency", type=int, default=8, help="number of threads sending messages")
+        parser.add_argument("--dead-ratio", type=float, default=0, help="share of devices which are not registered")
+        parser.add_argument("--latency", type=float, default=0, help="milliseconds the stand-in waits before answers")
+        parser.add_argument("--error-rate", type=float, default=0, help="share of requests the stand-in fails")
+        parser.add_argument("--end-point", help="url of an already running stand-in to use instead")
+
+    def handle(self, *args, **options):
+        """Create the devices, run the load test and print the results."""
+        server = None
+        end_point = options["end_point"]
+        if end_point is None:
+            server = FCMStubServer(
+                result_for=suffix_result, latency=options["latency"] / 1000, error_rate=options["error_rate"],
+            ).start()
+            end_point = server.url
+
+        fcm_settings = dict(settings.FCM_SETTINGS, FCM_SERVER_KEY="load-test", FCM_END_POINT=end_point,
+                            USE_OUTBOX=False)
+
+        try:
+            with override_settings(FCM_SETTINGS=fcm_settings):
+                close_push_service()
+                devices = self.create_devices(options["devices"], options["dead_ratio"])
+                self.report(options, *self.run(devices, options["messages"], options["recipients"],
+                                               options["concurrency"]))
+        finally:
+            close_push_service()
+            get_user_model().objects.filter(username__startswith=USERNAME_PREFIX).delete()
+            if server is not None:
+                self.stdout.write("stand-in: {} requests on {} connections, {} failed".format(
+                    server.requests, server.connections, server.errors
+                ))
+                server.stop()
+
+    @staticmethod
+    def create_devices(number, dead_ratio):
+        """
+        Create users with a device each.
+
+        :param number: number of devices to create
+        :param dead_ratio: share of devices whose registration id is not registered anymore
+        :return: list of the created devices
+        """
+        get_user_model().objects.bulk_create(
+            get_user_model()(
+                username="{}{}".format(USERNAME_PREFIX, i), email="{}{}@rady.test".format(USERNAME_PREFIX, i)
+            )
+            for i in range(number)
+        )
+        dead_every = int(1 / dead_ratio) if dead_ratio else 0
+        Device.objects.bulk_create(
+            Device(user_id=user_id, registration_id="load-test-{}{}".format(
+                user_id, DEAD_SUFFIX if dead_every and user_id % dead_every == 0 else ""
+            ))
+            for user_id in get_user_model().objects.filter(
+                username__startswith=USERNAME_PREFIX
+            ).values_list("id", flat=True)
+        )
+        return list(Device.objects.filter(user__username__startswith=USERNAME_PREFIX).order_by("id"))
+
+    @staticmethod
+    def run(devices, messages, recipients, concurrency):
+        """
+        Send the messages from concurrent threads.
+
+        :return: the sorted latencies of every message in milliseconds, the number of failed messages and the total
+                 time taken in seconds
+        """
+        lock = threading.Lock()
+        remaining = iter(range(messages))
+        latencies = []
+        errors = []
+
+        def send(index):
+            if recipients == 1:
+                devices[index % len(devices)].send_message(title="load test", data=dict(type="load-test"))
+            else:
+                start = index * recipients % len(devices)
+                ids = [devices[(start + i) % len(devices)].id for i in range(recipients)]
+                Device.objects.filter(id__in=ids).send_message(title="load test", data=dict(type="load-test"))
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        index = next(remaining, None)
+                    if index is None:
+                        return
+
+                    start = time.perf_counter()
+                    try:
+                        send(index)
+                    except (FCMError, RequestException):
+                        with lock:
+                            errors.append(index)
+                    latency = (time.perf_counter() - start) * 1000
+                    with lock:
+                        latencies.append(latency)
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return sorted(latencies), len(errors), time.perf_counter() - start
+
+    def report(self, options, latencies, errors, elapsed):
+        """Print a summary of the load test."""
+        pushes = len(latencies) * options["recipients"]
+        self.stdout.write("{} messages to {} devices each, {} threads, in {:.2f}s".format(
+            len(latencies), options["recipients"], options["concurrency"], elapsed
+        ))
+        self.stdout.write("throughput: {:.0f} pushes/s, {:.0f} messages/s, {} failed messages".format(
+            pushes / elapsed, len(latencies) / elapsed, errors
+        ))
+        self.stdout.write("latency:    mean={:.3f}ms p50={:.3f}ms p99={:.3f}ms".format(
+            statistics.mean(latencies),
+            latencies[len(latencies) // 2],
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        ))
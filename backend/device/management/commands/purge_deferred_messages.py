@@ -0,0 +1,36 @@
+"""Delete the deferred messages which are not worth delivering anymore."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from device.models import DeferredMessage
+
+__author__ = "agent <agent@local>"
+
+
+class Command(BaseCommand):
+    """
+    Purge expired deferred messages, in batches.
+
+    Each batch is deleted in its own transaction, so that rows are never locked for long.
+    """
+
+    help = "Delete expired deferred messages, in small transactions."
+
+    def add_arguments(self, parser):
+        """Add the batch size and pause between batches as arguments."""
+        parser.add_argument("--batch-size", type=int, default=1000, help="number of messages deleted at once")
+        parser.add_argument("--pause", type=float, default=0, help="seconds to wait between two batches")
+
+    def handle(self, *args, **options):
+        """Delete batches of expired messages until there is none left."""
+        total = 0
+        while True:
+            deleted = DeferredMessage.objects.purge_expired(options["batch_size"])
+            total += deleted
+            if deleted < options["batch_size"]:
+                break
+            time.sleep(options["pause"])
+
+        self.stdout.write("Purged {} expired deferred messages".format(total))
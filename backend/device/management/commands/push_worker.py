@@ -0,0 +1,41 @@
+"""Send the push messages waiting in the outbox."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from device.metrics import push_metrics
+from device.models import OutboxMessage
+
+__author__ = "agent <agent@local>"
+
+
+class Command(BaseCommand):
+    """
+    Drain the push messages outbox, in batches.
+
+    Several workers can run at once on PostgreSQL, each of them claiming different messages.
+    """
+
+    help = "Send the push messages waiting in the outbox."
+
+    def add_arguments(self, parser):
+        """Add the batch size, polling interval and one-shot mode as arguments."""
+        parser.add_argument("--batch-size", type=int, default=50, help="number of messages claimed at once")
+        parser.add_argument("--interval", type=float, default=1, help="seconds to wait when the outbox is empty")
+        parser.add_argument("--once", action="store_true", help="exit once no message is ready to be sent")
+
+    def handle(self, *args, **options):
+        """Send messages until interrupted, or until the outbox is drained with `--once`."""
+        try:
+            while True:
+                handled = OutboxMessage.objects.dispatch(options["batch_size"])
+                push_metrics.maybe_flush()
+                if handled == 0:
+                    if options["once"]:
+                        return
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            push_metrics.flush()
@@ -0,0 +1,104 @@
+"""
+Instrumentation of the push path.
+
+Every request made to FCM is recorded with its latency and the number of registration ids it targeted, along with the
+outcome for each of them: delivered, failed, or failed for good in which case the device is deactivated. Messages
+deferred as they could not be delivered are counted as well. Everything is broken down by type of message, that is the
+"type" of its data payload.
+
+Metrics are kept in memory by each process and are regularly added to `stats.PushStatisticsInDay`, so that the metrics
+of every uWSGI worker are aggregated in the database. They are written at most every `METRICS_FLUSH_INTERVAL` seconds, a
+setting of `FCM_SETTINGS` defaulting to 60, and never from within a transaction, which could still be rolled back.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, DatabaseError
+
+from stats.models import LATENCY_BUCKETS, merge_histograms, PushStatisticsInDay
+
+__author__ = "agent <agent@local>"
+
+
+DEFAULT_FLUSH_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+
+def get_message_type(data):
+    """
+    Get the type of a message.
+
+    :param data: data payload of the message
+    :return: the "type" of the payload, an empty string if there is none
+    """
+    return (data or {}).get("type", "")
+
+
+class PushMetrics:
+    """Metrics about the push notifications sent by the current process, which are not yet in the database."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(Counter)
+        self.histograms = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+        self.last_flush = time.monotonic()
+
+    def record_request(self, message_type, tokens, latency):
+        """
+        Record a request made to FCM.
+
+        :param message_type: type of the message sent
+        :param tokens: number of registration ids targeted by the request
+        :param latency: time the request took, in seconds
+        """
+        latency *= 1000
+        with self.lock:
+            self.counters[message_type].update(requests=1, tokens=tokens)
+            self.counters[message_type]["latency"] += latency
+            self.histograms[message_type][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def record_outcome(self, message_type, **counts):
+        """
+        Record what happened to messages.
+
+        :param message_type: type of the messages
+        :param counts: number of messages in `success`, `failure`, `deactivated` or `deferred`
+        """
+        with self.lock:
+            self.counters[message_type].update(counts)
+
+    def flush(self):
+        """Add the metrics recorded since the last flush to the database, keeping them for later if it fails."""
+        with self.lock:
+            counters, histograms = self.counters, self.histograms
+            self.counters, self.histograms = defaultdict(Counter), defaultdict(self.histograms.default_factory)
+            self.last_flush = time.monotonic()
+
+        message_types = list(counters)
+        for position, message_type in enumerate(message_types):
+            try:
+                PushStatisticsInDay.record(message_type, histograms.get(message_type, []), **counters[message_type])
+            except DatabaseError:
+                logger.exception("Could not save push metrics, keeping them for later")
+                with self.lock:
+                    for remaining in message_types[position:]:
+                        self.counters[remaining].update(counters[remaining])
+                        self.histograms[remaining] = merge_histograms(
+                            self.histograms[remaining], histograms.get(remaining, [])
+                        )
+                return
+
+    def maybe_flush(self):
+        """Flush the metrics if `METRICS_FLUSH_INTERVAL` elapsed since the last flush and no transaction is running."""
+        interval = settings.FCM_SETTINGS.get("METRICS_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)
+        if time.monotonic() - self.last_flush >= interval and not connection.in_atomic_block:
+            self.flush()
+
+
+push_metrics = PushMetrics()
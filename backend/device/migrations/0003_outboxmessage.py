@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 15:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('device', '0002_auto_20170110_2251'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('devices', jsonfield.fields.JSONField()),
+                ('title', models.TextField(null=True)),
+                ('body', models.TextField(null=True)),
+                ('data', jsonfield.fields.JSONField(null=True)),
+                ('deferred', models.BooleanField(default=True)),
+                ('related_type', models.CharField(max_length=16, null=True)),
+                ('related_id', models.PositiveIntegerField(null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('available_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
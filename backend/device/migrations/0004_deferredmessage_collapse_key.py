@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 15:23
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('device', '0003_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deferredmessage',
+            name='collapse_key',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='deferredmessage',
+            unique_together=set([('user', 'collapse_key')]),
+        ),
+    ]
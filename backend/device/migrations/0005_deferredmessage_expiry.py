@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 15:26
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('device', '0004_deferredmessage_collapse_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deferredmessage',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='deferredmessage',
+            index_together=set([('user', 'expires_at'), ('related_type', 'related_id')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 17:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('device', '0006_outboxmessage_topic'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='subscription',
+            field=models.CharField(choices=[('subscribe', 'subscribe'), ('unsubscribe', 'unsubscribe')], max_length=16, null=True),
+        ),
+    ]
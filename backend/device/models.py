@@ -1,14 +1,40 @@
 """Contains all models from the `device` module."""
 
-from django.db import models
+import json
+import logging
+import sqlite3
+from collections import OrderedDict
+from datetime import timedelta
+
 from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
 from jsonfield import JSONField
+from pyfcm.errors import FCMError
+from requests import RequestException
 
-from device.fcm import send_fcm_bulk_message, send_fcm_message
+from device.fcm import get_canonical_id, get_chunk_size, get_fanout_executor, is_dead, send_fcm_fanout, \
+    send_fcm_single, send_fcm_topic_message, subscribe_to_topic, unsubscribe_from_topic
+from device.metrics import get_message_type, push_metrics
 
 __author__ = "Damien Rochat <rochat.damien@gmail.com>"
 
 
+DEFAULT_DEFERRED_MESSAGE_TTL = 7 * 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def supports_upsert():
+    """Check whether the database supports `INSERT ... ON CONFLICT DO UPDATE`."""
+    if connection.vendor == "postgresql":
+        return connection.pg_version >= 90500
+    if connection.vendor == "sqlite":
+        return sqlite3.sqlite_version_info >= (3, 24, 0)
+    return False
+
+
 class DeviceManager(models.Manager):
     """Overrides the default Manager with our custom one."""
 
@@ -28,9 +54,13 @@ class DeviceQuerySet(models.query.QuerySet):
         """
         Send a push message to the devices, allowing the message to be deferred if sending failed.
 
-        Will mark the device as inactive if sending fails
+        Will mark the devices as inactive if their registration id is not valid anymore
         and won't try to send a message to an already inactive device.
 
+        When `USE_OUTBOX` is set in `FCM_SETTINGS`, the message is only stored in the outbox, as part of the current
+        transaction, and is sent later on by the `push_worker` command. It is stored once per chunk of devices sent in
+        a single request (see `FCM_CHUNK_SIZE`), a chunk which failed is thus retried without sending the others again.
+
         :param title: the title of the message
         :param body: the body of the message
         :param data: a Json object attached to the message
@@ -38,39 +68,206 @@ class DeviceQuerySet(models.query.QuerySet):
         :param related_type: define a type of object to which the message is attached
         :param related_id: define an id of object to which the message is attached
         """
-        if deferred is True:
-            for device in self.filter(is_active=False):
-                DeferredMessage(
-                    user_id=device.user_id,
+        if settings.FCM_SETTINGS.get("USE_OUTBOX", False):
+            devices = list(self.values_list("id", flat=True))
+            chunk_size = get_chunk_size()
+            OutboxMessage.objects.bulk_create(
+                OutboxMessage(
+                    devices=devices[i:i + chunk_size],
                     title=title,
                     body=body,
                     data=data,
+                    deferred=deferred,
                     related_type=related_type,
                     related_id=related_id,
-                ).save()
+                )
+                for i in range(0, len(devices), chunk_size)
+            )
+        else:
+            self.deliver_message(title, body, data, deferred, related_type, related_id)
+
+    def deliver_message(self, title=None, body=None, data=None, deferred=True, related_type=None, related_id=None):
+        """
+        Send a push message to the devices right away.
+
+        Large selections are split in chunks sent concurrently, see `send_fcm_fanout`. The message is deferred for
+        every device to which it could not be delivered, see `apply_fcm_results` for how devices are updated.
+        See `send_message` for more information.
+        """
+        devices = list(self.values_list("id", "user_id", "registration_id", "is_active"))
+        active_devices = [device for device in devices if device[3] is True]
+        users_to_defer = [user_id for _, user_id, _, is_active in devices if is_active is False]
+
+        if active_devices:
+            result = send_fcm_fanout(
+                registration_ids=[registration_id for _, _, registration_id, _ in active_devices],
+                title=title,
+                body=body,
+                data=data,
+                **fcm_options(data, related_type, related_id)
+            )
+
+            apply_fcm_results([device_id for device_id, _, _, _ in active_devices], result["results"])
+            users_to_defer.extend(
+                user_id for (_, user_id, _, _), device_result in zip(active_devices, result["results"])
+                if "error" in device_result
+            )
 
-        devices = list(self.filter(is_active=True).all())
-        if devices:
-            result = send_fcm_bulk_message(
-                registration_ids=[d.registration_id for d in devices],
+        if deferred is True and users_to_defer:
+            DeferredMessage.objects.create_for_users(
+                users_to_defer,
                 title=title,
                 body=body,
-                data=data
+                data=data,
+                related_type=related_type,
+                related_id=related_id,
             )
 
-            for (index, result) in enumerate(result[0]["results"]):
-                if "error" in result:
-                    self.filter(id=devices[index].id).update(is_active=False)
+    def subscribe(self, topic):
+        """
+        Subscribe the active devices to a topic, see `manage_subscriptions`.
+
+        :param topic: name of the topic
+        """
+        self.manage_subscriptions(OutboxMessage.SUBSCRIBE, topic)
+
+    def unsubscribe(self, topic):
+        """
+        Unsubscribe the active devices from a topic, see `manage_subscriptions`.
+
+        :param topic: name of the topic
+        """
+        self.manage_subscriptions(OutboxMessage.UNSUBSCRIBE, topic)
+
+    def manage_subscriptions(self, action, topic):
+        """
+        Subscribe or unsubscribe the active devices to or from a topic, once the current transaction is committed.
+
+        Nothing is done if the transaction is rolled back. Failures are only logged, the devices then keep receiving, or
+        never receive, messages sent to the topic.
+
+        When `USE_OUTBOX` is set in `FCM_SETTINGS`, the change is only stored in the outbox, as part of the current
+        transaction, and is made later on by the `push_worker` command, which retries it on failure.
+
+        :param action: either `OutboxMessage.SUBSCRIBE` or `OutboxMessage.UNSUBSCRIBE`
+        :param topic: name of the topic
+        """
+        devices = list(self.filter(is_active=True).values_list("id", flat=True))
+        if not devices:
+            return
 
-                    if deferred is True:
-                        DeferredMessage(
-                            user_id=devices[index].user_id,
-                            title=title,
-                            body=body,
-                            data=data,
-                            related_type=related_type,
-                            related_id=related_id,
-                        ).save()
+        if settings.FCM_SETTINGS.get("USE_OUTBOX", False):
+            OutboxMessage(devices=devices, topic=topic, subscription=action, deferred=False).save()
+            return
+
+        def apply():
+            try:
+                self.model.objects.filter(id__in=devices).apply_subscriptions(action, topic)
+            except (FCMError, RequestException):
+                logger.exception("Could not %s %d devices to topic %s", action, len(devices), topic)
+
+        transaction.on_commit(apply)
+
+    def apply_subscriptions(self, action, topic):
+        """
+        Subscribe or unsubscribe the active devices to or from a topic right away.
+
+        :param action: either `OutboxMessage.SUBSCRIBE` or `OutboxMessage.UNSUBSCRIBE`
+        :param topic: name of the topic
+        :raise FCMError, RequestException: when the subscriptions could not be changed
+        """
+        registration_ids = list(self.filter(is_active=True).values_list("registration_id", flat=True))
+        if registration_ids:
+            OutboxMessage.TOPIC_ACTIONS[action](topic, registration_ids)
+
+    def update_registration_ids(self, registration_ids):
+        """
+        Replace the registration ids of devices by their canonical ones, in a single query.
+
+        A device whose canonical registration id already belongs to another device is a duplicate, it is removed. So
+        are all but the oldest of the devices given the same canonical registration id.
+
+        :param registration_ids: dict mapping ids of devices to their new registration id
+        """
+        taken = set(
+            self.model.objects.filter(registration_id__in=registration_ids.values())
+            .values_list("registration_id", flat=True)
+        )
+        kept = {}
+        duplicates = []
+        for device_id, registration_id in sorted(registration_ids.items()):
+            if registration_id in taken or registration_id in kept:
+                duplicates.append(device_id)
+            else:
+                kept[registration_id] = device_id
+
+        if duplicates:
+            self.model.objects.filter(id__in=duplicates).delete()
+        if kept:
+            self.model.objects.filter(id__in=kept.values()).update(registration_id=Case(
+                *[When(id=device_id, then=Value(registration_id)) for registration_id, device_id in kept.items()],
+                output_field=models.TextField()
+            ))
+
+
+def send_topic_message(topic, title=None, body=None, data=None, related_type=None, related_id=None):
+    """
+    Send a push message to every device subscribed to a topic.
+
+    Such messages are never deferred, as FCM keeps them for subscribed devices that are offline. The message is sent
+    once the current transaction is committed, along with the subscriptions it made, failures being only logged. As
+    for devices, when `USE_OUTBOX` is set in `FCM_SETTINGS`, the message is only stored in the outbox.
+
+    :param topic: name of the topic
+    :param title: the title of the message
+    :param body: the body of the message
+    :param data: a Json object attached to the message
+    :param related_type: define a type of object to which the message is attached
+    :param related_id: define an id of object to which the message is attached
+    """
+    if settings.FCM_SETTINGS.get("USE_OUTBOX", False):
+        OutboxMessage(
+            topic=topic,
+            devices=[],
+            title=title,
+            body=body,
+            data=data,
+            deferred=False,
+            related_type=related_type,
+            related_id=related_id,
+        ).save()
+    else:
+        def send():
+            try:
+                send_fcm_topic_message(
+                    topic, title=title, body=body, data=data, **fcm_options(data, related_type, related_id)
+                )
+            except (FCMError, RequestException):
+                logger.exception("Could not send push to topic %s", topic)
+
+        transaction.on_commit(send)
+
+
+def apply_fcm_results(device_ids, results):
+    """
+    Update devices according to the result FCM gave when sending them a message.
+
+    Devices whose registration id will never be valid again are marked as inactive, and devices whose registration id
+    changed are given their canonical one. Transient failures, which were already retried, leave the device untouched.
+
+    :param device_ids: ids of the devices to which the message was sent
+    :param results: FCM result for each device, in the same order
+    """
+    dead = [device_id for device_id, result in zip(device_ids, results) if is_dead(result)]
+    if dead:
+        Device.objects.filter(id__in=dead).update(is_active=False)
+
+    canonical_ids = {
+        device_id: get_canonical_id(result)
+        for device_id, result in zip(device_ids, results) if get_canonical_id(result) is not None
+    }
+    if canonical_ids:
+        Device.objects.all().update_registration_ids(canonical_ids)
 
 
 class Device(models.Model):
@@ -92,7 +289,7 @@ class Device(models.Model):
         """
         Send a push message to the device, allowing the message to be deferred if sending failed.
 
-        Will mark the device as inactive if sending fails
+        Will mark the device as inactive if its registration id is not valid anymore
         and won't try to send a message to an already inactive device.
 
         :param title: the title of the message
@@ -101,39 +298,52 @@ class Device(models.Model):
         :param deferred: define if message can be deferred or not
         :param related_type: define a type of object to which the message is attached
         :param related_id: define an id of object to which the message is attached
-        :return: True if the message was successfully sent, False otherwise.
+        :return: True if the message was successfully sent (or stored in the outbox), False otherwise.
         """
         if self.is_active is False:
             if deferred is True:
-                DeferredMessage(
-                    user_id=self.user_id,
+                DeferredMessage.objects.create_for_users(
+                    [self.user_id],
                     title=title,
                     body=body,
                     data=data,
                     related_type=related_type,
                     related_id=related_id,
-                ).save()
+                )
             return False
 
+        elif settings.FCM_SETTINGS.get("USE_OUTBOX", False):
+            OutboxMessage(
+                devices=[self.id],
+                title=title,
+                body=body,
+                data=data,
+                deferred=deferred,
+                related_type=related_type,
+                related_id=related_id,
+            ).save()
+            return True
+
         else:
-            result = send_fcm_message(
+            result = send_fcm_single(
                 registration_id=self.registration_id,
                 title=title,
                 body=body,
-                data=data
+                data=data,
+                **fcm_options(data, related_type, related_id)
             )
-            if result["success"] == 0:
-                Device.objects.filter(id=self.id).update(is_active=False)
+            apply_fcm_results([self.id], [result])
 
+            if "error" in result:
                 if deferred is True:
-                    DeferredMessage(
-                        user_id=self.user_id,
+                    DeferredMessage.objects.create_for_users(
+                        [self.user_id],
                         title=title,
                         body=body,
                         data=data,
                         related_type=related_type,
                         related_id=related_id,
-                    ).save()
+                    )
                 return False
 
             return True
@@ -144,13 +354,210 @@ class Device(models.Model):
 
         If the message was successful sent, remove it from the database.
 
+        When using the outbox, the message is handed over to it and will be deferred again if it cannot be delivered.
+
         :return: True if the message was successfully sent, False otherwise.
         """
-        if self.send_message(message.title, message.body, message.data, False) is True:
+        deferred = settings.FCM_SETTINGS.get("USE_OUTBOX", False)
+        if self.send_message(message.title, message.body, message.data, deferred,
+                             message.related_type, message.related_id) is True:
             message.delete()
             return True
         return False
 
+    def send_deferred_messages(self, messages):
+        """
+        Replay deferred messages to the device, in as few provider calls as possible.
+
+        The backlog is loaded once. Messages related to the same object are merged into the most recent one and
+        identical messages are only sent once, the remaining ones being sent concurrently. Delivered and superseded
+        messages are then removed in a single statement, failed ones are kept for a later replay.
+
+        When using the outbox, every remaining message is handed over to it at once.
+
+        :param messages: queryset of `DeferredMessage` to replay
+        :return: True if every message was delivered (or stored in the outbox), False otherwise.
+        """
+        messages = list(messages.order_by("id"))
+        if not messages:
+            return True
+
+        latest = OrderedDict()
+        for message in messages:
+            key = (message.related_type, message.related_id) if message.related_type is not None else message.id
+            latest.pop(key, None)
+            latest[key] = message
+
+        to_send = OrderedDict()
+        for message in latest.values():
+            to_send.setdefault(json.dumps([message.title, message.body, message.data], sort_keys=True), message)
+        to_send = list(to_send.values())
+
+        failed = set()
+
+        if settings.FCM_SETTINGS.get("USE_OUTBOX", False):
+            OutboxMessage.objects.bulk_create(
+                OutboxMessage(
+                    devices=[self.id],
+                    title=message.title,
+                    body=message.body,
+                    data=message.data,
+                    related_type=message.related_type,
+                    related_id=message.related_id,
+                )
+                for message in to_send
+            )
+
+        elif self.is_active is False:
+            return False
+
+        else:
+            def send(message):
+                return send_fcm_single(
+                    registration_id=self.registration_id,
+                    title=message.title,
+                    body=message.body,
+                    data=message.data,
+                    **fcm_options(message.data, message.related_type, message.related_id)
+                )
+
+            if len(to_send) == 1:
+                results = [send(to_send[0])]
+            else:
+                results = list(get_fanout_executor().map(send, to_send))
+
+            apply_fcm_results([self.id] * len(results), results)
+            failed = {message.id for message, result in zip(to_send, results) if "error" in result}
+
+        DeferredMessage.objects.filter(id__in=[message.id for message in messages if message.id not in failed]).delete()
+        return not failed
+
+
+def get_collapse_key(data, related_type, related_id):
+    """
+    Get the key identifying messages superseding each others.
+
+    Only the latest message for the same event on the same object matters.
+
+    :param data: a Json object attached to the message, its `type` gives the event
+    :param related_type: type of object to which the message is attached
+    :param related_id: id of object to which the message is attached
+    :return: the collapse key, or None if the message cannot be collapsed
+    """
+    if related_type is None or related_id is None or not isinstance(data, dict) or "type" not in data:
+        return None
+    return "{}-{}-{}".format(related_type, related_id, data["type"])
+
+
+def fcm_options(data, related_type, related_id):
+    """
+    Get the additional FCM options to use when sending a message.
+
+    :return: a dict of keyword arguments for `send_fcm_message` and `send_fcm_bulk_message`
+    """
+    collapse_key = get_collapse_key(data, related_type, related_id)
+    return dict(collapse_key=collapse_key) if collapse_key is not None else dict()
+
+
+def get_expiry(data):
+    """
+    Get the date after which a message is not worth delivering anymore.
+
+    The time to live of a message depends on its type, as given by the `DEFERRED_MESSAGE_TTL` dict of `FCM_SETTINGS`,
+    mapping message types (and "default") to a number of seconds.
+
+    :param data: a Json object attached to the message, its `type` gives the type of the message
+    :return: the expiry date of the message
+    """
+    time_to_live = settings.FCM_SETTINGS.get("DEFERRED_MESSAGE_TTL", {})
+    message_type = data.get("type") if isinstance(data, dict) else None
+    seconds = time_to_live.get(message_type, time_to_live.get("default", DEFAULT_DEFERRED_MESSAGE_TTL))
+    return timezone.now() + timedelta(seconds=seconds)
+
+
+class DeferredMessageQuerySet(models.QuerySet):
+    """Extends the default QuerySet to select messages according to their expiry."""
+
+    def pending(self):
+        """Get the messages which are still worth delivering."""
+        return self.exclude(expires_at__lte=timezone.now())
+
+    def expired(self):
+        """Get the messages which are not worth delivering anymore."""
+        return self.filter(expires_at__lte=timezone.now())
+
+
+class DeferredMessageManager(models.Manager.from_queryset(DeferredMessageQuerySet)):
+    """Extends the default Manager to store messages for many users at once, and purge expired ones."""
+
+    def create_for_users(self, user_ids, **message):
+        """
+        Store the same message for every given user, in a single statement.
+
+        A message replaces, in place, the one stored for the same user with the same collapse key.
+
+        :param user_ids: ids of the users for which to defer the message
+        :param message: title, body, data, related_type and related_id of the message
+        """
+        message["collapse_key"] = get_collapse_key(
+            message.get("data"), message.get("related_type"), message.get("related_id")
+        )
+        message["expires_at"] = get_expiry(message.get("data"))
+        messages = [DeferredMessage(user_id=user_id, **message) for user_id in OrderedDict.fromkeys(user_ids)]
+        push_metrics.record_outcome(get_message_type(message.get("data")), deferred=len(messages))
+
+        if message["collapse_key"] is None:
+            self.bulk_create(messages)
+        elif supports_upsert():
+            self._upsert(messages)
+        else:
+            with transaction.atomic():
+                existing = self.filter(user_id__in=[m.user_id for m in messages], collapse_key=message["collapse_key"])
+                replaced = set(existing.values_list("user_id", flat=True))
+                existing.update(**message)
+                self.bulk_create(m for m in messages if m.user_id not in replaced)
+
+    def purge_expired(self, batch_size):
+        """
+        Delete a batch of expired messages, in its own short transaction.
+
+        :param batch_size: maximum number of messages to delete
+        :return: the number of deleted messages
+        """
+        with transaction.atomic():
+            ids = list(self.expired().order_by("expires_at").values_list("id", flat=True)[:batch_size])
+            if ids:
+                self.filter(id__in=ids).delete()
+        return len(ids)
+
+    def _upsert(self, messages):
+        """Insert the messages, replacing existing ones with the same user and collapse key."""
+        quote = connection.ops.quote_name
+        fields = [field for field in self.model._meta.concrete_fields if not field.primary_key]
+        columns = [field.column for field in fields]
+        updates = [column for column in columns if column not in ("user_id", "collapse_key")]
+
+        with connection.cursor() as cursor:
+            batch_size = max(connection.ops.bulk_batch_size(fields, messages), 1)
+            for start in range(0, len(messages), batch_size):
+                batch = messages[start:start + batch_size]
+                cursor.execute(
+                    "INSERT INTO {table} ({columns}) VALUES {values} "
+                    "ON CONFLICT ({user}, {collapse_key}) DO UPDATE SET {updates}".format(
+                        table=quote(self.model._meta.db_table),
+                        columns=", ".join(quote(column) for column in columns),
+                        values=", ".join(["({})".format(", ".join(["%s"] * len(fields)))] * len(batch)),
+                        user=quote("user_id"),
+                        collapse_key=quote("collapse_key"),
+                        updates=", ".join("{0} = EXCLUDED.{0}".format(quote(column)) for column in updates),
+                    ),
+                    [
+                        field.get_db_prep_save(field.pre_save(message, True), connection)
+                        for message in batch
+                        for field in fields
+                    ]
+                )
+
 
 class DeferredMessage(models.Model):
     """Extends `Model` to keep information about messages which could not be sent."""
@@ -161,3 +568,164 @@ class DeferredMessage(models.Model):
     data = JSONField(null=True)
     related_type = models.CharField(max_length=16, null=True)
     related_id = models.PositiveIntegerField(null=True)
+    collapse_key = models.CharField(max_length=64, null=True)
+    expires_at = models.DateTimeField(null=True, db_index=True)
+
+    objects = DeferredMessageManager()
+
+    class Meta:
+        """Metaclass for the `DeferredMessage` model."""
+
+        unique_together = ("user", "collapse_key")
+        index_together = [
+            ("user", "expires_at"),
+            ("related_type", "related_id"),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Save the message, computing its expiry date from its type if needed."""
+        if self.expires_at is None:
+            self.expires_at = get_expiry(self.data)
+        super().save(*args, **kwargs)
+
+
+class OutboxMessageManager(models.Manager):
+    """Extends the default Manager to claim and dispatch messages waiting in the outbox."""
+
+    def claim(self, batch_size):
+        """
+        Lock and return the next messages ready to be sent.
+
+        On PostgreSQL, rows locked by other workers are skipped, which allows to run several workers at once.
+        This must be called inside a transaction, the rows staying locked until its end, see `dispatch`.
+
+        :param batch_size: maximum number of messages to claim
+        :return: list of `OutboxMessage`
+        """
+        now = timezone.now()
+
+        if connection.vendor == "postgresql":
+            return list(self.raw(
+                "SELECT * FROM {table} WHERE available_at <= %s ORDER BY available_at, id LIMIT %s "
+                "FOR UPDATE SKIP LOCKED".format(table=connection.ops.quote_name(self.model._meta.db_table)),
+                [now, batch_size]
+            ))
+
+        return list(self.filter(available_at__lte=now).order_by("available_at", "id").select_for_update()[:batch_size])
+
+    def dispatch(self, batch_size):
+        """
+        Send a batch of messages from the outbox.
+
+        Messages are claimed in a short transaction, which makes them unavailable to other workers for
+        `OUTBOX_CLAIM_TIMEOUT` seconds of `FCM_SETTINGS`, and are only sent once it is committed, no row staying locked
+        during the requests to FCM. Messages that were delivered are then removed, the others are scheduled to be
+        retried later, whatever the error was. Messages claimed by a worker which stopped before handling them are sent
+        once their claim expired.
+
+        Attempts are counted when messages are claimed, a message which keeps stopping workers is thus given up as well
+        after `OUTBOX_MAX_ATTEMPTS` attempts, see `OutboxMessage.give_up`.
+
+        :param batch_size: maximum number of messages to send
+        :return: the number of messages handled
+        """
+        with transaction.atomic():
+            messages = self.claim(batch_size)
+            if messages:
+                timeout = settings.FCM_SETTINGS.get("OUTBOX_CLAIM_TIMEOUT", 60)
+                self.filter(id__in=[message.id for message in messages])\
+                    .update(attempts=F("attempts") + 1, available_at=timezone.now() + timedelta(seconds=timeout))
+
+        max_attempts = settings.FCM_SETTINGS.get("OUTBOX_MAX_ATTEMPTS", 5)
+        for message in messages:
+            message.attempts += 1
+            if message.attempts > max_attempts:
+                # its last attempt did not complete
+                message.give_up()
+                continue
+
+            try:
+                if message.subscription is not None:
+                    Device.objects.filter(id__in=message.devices).apply_subscriptions(
+                        message.subscription, message.topic
+                    )
+                elif message.topic is not None:
+                    send_fcm_topic_message(
+                        message.topic, title=message.title, body=message.body, data=message.data,
+                        **fcm_options(message.data, message.related_type, message.related_id)
+                    )
+                else:
+                    Device.objects.filter(id__in=message.devices).deliver_message(
+                        message.title, message.body, message.data, message.deferred,
+                        message.related_type, message.related_id,
+                    )
+            except (FCMError, RequestException):
+                message.retry_later()
+            except Exception:
+                logger.exception("Could not send outbox message %d, attempt %d", message.id, message.attempts)
+                message.retry_later()
+            else:
+                message.delete()
+
+        return len(messages)
+
+
+class OutboxMessage(models.Model):
+    """
+    Extends `Model` to keep push messages waiting to be sent.
+
+    Messages are written in the same transaction as the change that triggered them and are sent by the `push_worker`
+    management command, outside of the request/response cycle. Each message is sent in a single request to FCM.
+    """
+
+    SUBSCRIBE = "subscribe"
+    UNSUBSCRIBE = "unsubscribe"
+
+    TOPIC_ACTIONS = {SUBSCRIBE: subscribe_to_topic, UNSUBSCRIBE: unsubscribe_from_topic}
+
+    devices = JSONField()
+    topic = models.CharField(max_length=64, null=True)
+    # set for changes of the subscriptions of the devices to the topic, which are made instead of sending a message
+    subscription = models.CharField(
+        choices=((SUBSCRIBE, SUBSCRIBE), (UNSUBSCRIBE, UNSUBSCRIBE)), max_length=16, null=True
+    )
+    title = models.TextField(null=True)
+    body = models.TextField(null=True)
+    data = JSONField(null=True)
+    deferred = models.BooleanField(default=True)
+    related_type = models.CharField(max_length=16, null=True)
+    related_id = models.PositiveIntegerField(null=True)
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = OutboxMessageManager()
+
+    def retry_later(self):
+        """
+        Schedule the message to be sent again, with an exponential backoff.
+
+        The attempt which failed is already counted, see `OutboxMessageManager.dispatch`. Once the maximum number of
+        attempts is reached, the message is given up.
+        """
+        if self.attempts >= settings.FCM_SETTINGS.get("OUTBOX_MAX_ATTEMPTS", 5):
+            self.give_up()
+            return
+
+        delay = settings.FCM_SETTINGS.get("OUTBOX_RETRY_DELAY", 5) * 2 ** (self.attempts - 1)
+        self.available_at = timezone.now() + timedelta(seconds=delay)
+        self.save(update_fields=("available_at",))
+
+    def give_up(self):
+        """Remove the message from the outbox, deferring it to its recipients if it allows it."""
+        logger.warning("Giving up outbox message %d after %d attempts", self.id, self.attempts)
+        if self.deferred is True:
+            DeferredMessage.objects.create_for_users(
+                Device.objects.filter(id__in=self.devices).values_list("user_id", flat=True),
+                title=self.title,
+                body=self.body,
+                data=self.data,
+                related_type=self.related_type,
+                related_id=self.related_id,
+            )
+        self.delete()
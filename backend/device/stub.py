@@ -0,0 +1,255 @@
+"""
+Local stand-in for the FCM HTTP server.
+
+This allows to exercise the push path without any network access, for benchmarks and load tests. The server emulates
+the legacy send end point:
+
+    - the result for each registration id is given by a function, see `accept`, `reject`, `canonical` and `respond_with`
+    - a latency can be added to every response
+    - a share of requests can fail with a server error, as FCM does when it is unavailable
+    - received requests can be captured, to check what was sent
+
+Messages to topics, and the instance id service batchAdd and batchRemove end points managing topic subscriptions, are
+emulated as well.
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+__author__ = "agent <agent@local>"
+
+
+def accept(registration_id):  # pylint: disable=unused-argument
+    """Get a successful result for any registration id."""
+    return dict(message_id="0:{}".format(uuid.uuid4().hex))
+
+
+def reject(error="NotRegistered"):
+    """
+    Get a result function failing for any registration id.
+
+    :param error: FCM error to return, such as "NotRegistered", "InvalidRegistration" or "Unavailable"
+    """
+    def result_for(registration_id):  # pylint: disable=unused-argument
+        return dict(error=error)
+    return result_for
+
+
+def canonical(new_registration_id):
+    """
+    Get a result function telling that the registration id of the device changed.
+
+    :param new_registration_id: canonical registration id to give back
+    """
+    def result_for(registration_id):
+        return dict(accept(registration_id), registration_id=new_registration_id)
+    return result_for
+
+
+def respond_with(results, default=accept):
+    """
+    Get a result function giving a specific result for some registration ids.
+
+    :param results: dict mapping registration ids to result functions
+    :param default: result function to use for any other registration id
+    """
+    def result_for(registration_id):
+        return results.get(registration_id, default)(registration_id)
+    return result_for
+
+
+class FCMStubRequestHandler(BaseHTTPRequestHandler):
+    """Answers to FCM legacy send requests, with the result the server gives for each registration id."""
+
+    # keep-alive connections are only supported with HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    # headers and body are written separately, which would wait for delayed ACKs on kept alive connections
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        """Count every new connection made to the server."""
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):  # noqa pylint: disable=invalid-name
+        """Handle a send request."""
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf8"))
+
+        with self.server.lock:
+            self.server.requests += 1
+            if self.server.capture:
+                self.server.captured.append(payload)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            with self.server.lock:
+                self.server.errors += 1
+            self.send_json(dict(error="Unavailable"), status=503)
+            return
+
+        if self.path.endswith(":batchAdd") or self.path.endswith(":batchRemove"):
+            self.manage_subscriptions(payload)
+            return
+
+        if str(payload.get("to")).startswith("/topics/"):
+            self.send_json(dict(message_id=uuid.uuid4().int >> 64))
+            return
+
+        registration_ids = payload.get("registration_ids") or [payload.get("to")]
+        results = [self.server.result_for(registration_id) for registration_id in registration_ids]
+
+        self.send_json(dict(
+            multicast_id=uuid.uuid4().int >> 64,
+            success=sum(1 for result in results if "error" not in result),
+            failure=sum(1 for result in results if "error" in result),
+            canonical_ids=sum(1 for result in results if "registration_id" in result),
+            results=results,
+        ))
+
+    def manage_subscriptions(self, payload):
+        """Handle an instance id service request adding or removing devices to a topic."""
+        topic = payload["to"][len("/topics/"):]
+        with self.server.lock:
+            subscribers = self.server.topics.setdefault(topic, set())
+            if self.path.endswith(":batchAdd"):
+                subscribers.update(payload["registration_tokens"])
+            else:
+                subscribers.difference_update(payload["registration_tokens"])
+
+        self.send_json(dict(results=[dict() for _ in payload["registration_tokens"]]))
+
+    def send_json(self, data, status=200):
+        """
+        Send the given data as a json response.
+
+        :param data: object to serialize
+        :param status: HTTP status code of the response
+        """
+        content = json.dumps(data).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Silence the default logging on stderr."""
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling each connection in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.captured = []
+        self.topics = {}
+        self.result_for = accept
+        self.latency = 0
+        self.error_rate = 0
+        self.capture = False
+
+
+class FCMStubServer:
+    """
+    Runs a local FCM stand-in in a background thread.
+
+    This can be used as a context manager:
+
+        with FCMStubServer() as server:
+            settings.FCM_SETTINGS["FCM_END_POINT"] = server.url
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, handler=FCMStubRequestHandler, result_for=accept,
+                 latency=0, error_rate=0, capture=False):  # pylint: disable=too-many-arguments
+        """
+        Create a new server. It will only accept connections once started.
+
+        :param host: address on which to listen
+        :param port: port on which to listen, 0 picks a free one
+        :param handler: request handler class to use
+        :param result_for: function giving the FCM result (as a dict) for a registration id
+        :param latency: seconds to wait before answering each request
+        :param error_rate: share of requests, between 0 and 1, answered with a server error
+        :param capture: whether to keep the payload of every request, see `captured`
+        """
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.result_for = result_for
+        self.server.latency = latency
+        self.server.error_rate = error_rate
+        self.server.capture = capture
+        self.thread = None
+
+    @property
+    def url(self):
+        """Get the url to use as FCM end point."""
+        return "http://{}:{}/fcm/send".format(*self.server.server_address[:2])
+
+    @property
+    def iid_url(self):
+        """Get the url to use as instance id service end point."""
+        return "http://{}:{}/iid/v1".format(*self.server.server_address[:2])
+
+    @property
+    def topics(self):
+        """Get the registration ids subscribed to each topic."""
+        return self.server.topics
+
+    @property
+    def connections(self):
+        """Get the number of connections opened to the server."""
+        return self.server.connections
+
+    @property
+    def requests(self):
+        """Get the number of send requests handled by the server."""
+        return self.server.requests
+
+    @property
+    def errors(self):
+        """Get the number of requests answered with a server error."""
+        return self.server.errors
+
+    @property
+    def captured(self):
+        """Get the payloads of the requests received, if captured."""
+        return self.server.captured
+
+    def start(self):
+        """Start serving requests in a background thread."""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve requests in the current thread, until interrupted."""
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def stop(self):
+        """Stop the server and close its socket."""
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -3,6 +3,7 @@ from unittest.mock import patch
 
 import pyfcm
 
+from device.fcm import close_push_service
 from device.models import Device
 
 
@@ -27,9 +28,12 @@ class MockFcmMessagesMixin:
     def setUp(self):
         super().setUp()
 
+        # the shared client must be created once FCMNotification is patched
+        close_push_service()
+
         # prevent initialisation of the FCMNotification module who try to get the FCM token
-        self.patcher_fcmnotification_init = patch.object(pyfcm.FCMNotification, "__init__", return_value=None).start()
-        self.patcher_fcmnotification_init.return_value = None
+        self.patcher_fcmnotification_init = patch.object(pyfcm.FCMNotification, "__init__", return_value=None)
+        self.patcher_fcmnotification_init.start()
 
         self.patcher_send_fcm_message = patch.object(pyfcm.FCMNotification, "notify_single_device")
         self.patcher_send_fcm_bulk_message = patch.object(pyfcm.FCMNotification, "notify_multiple_devices")
@@ -41,5 +45,6 @@ class MockFcmMessagesMixin:
         self.patcher_send_fcm_bulk_message.stop()
 
         self.patcher_fcmnotification_init.stop()
+        close_push_service()
 
         super().tearDown()
@@ -27,19 +27,54 @@ class BulkMessagesTestCase(MockFcmMessagesMixin, TestCase):
         self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 1)
 
     def test_successful_message_keep_devices_as_active(self,):
-        self.mocked_send_fcm_bulk_message.return_value = [dict(results=[dict(), dict(), dict(error="error"), dict()])]
+        self.mocked_send_fcm_bulk_message.return_value = [
+            dict(results=[dict(), dict(), dict(error="NotRegistered"), dict()])
+        ]
         Device.objects.all().send_message()
 
         self.assertEqual(Device.objects.filter(is_active=True).count(), 3)
 
     def test_failed_message_set_devices_as_inactive(self,):
-        self.mocked_send_fcm_bulk_message.return_value = [dict(results=[dict(), dict(), dict(error="error"), dict()])]
+        self.mocked_send_fcm_bulk_message.return_value = [
+            dict(results=[dict(), dict(), dict(error="NotRegistered"), dict()])
+        ]
         Device.objects.all().send_message()
 
         self.assertEqual(Device.objects.filter(id=3, is_active=False).count(), 1)
 
     def test_failed_message_add_deferred_message(self):
-        self.mocked_send_fcm_bulk_message.return_value = [dict(results=[dict(), dict(), dict(error="error"), dict()])]
+        self.mocked_send_fcm_bulk_message.return_value = [
+            dict(results=[dict(), dict(), dict(error="NotRegistered"), dict()])
+        ]
         Device.objects.all().send_message()
 
         self.assertEqual(DeferredMessage.objects.count(), 1)
+
+    def test_send_bulk_message_with_failures_uses_constant_number_of_queries(self):
+        Device.objects.filter(id=Device.objects.first().id).update(is_active=False)
+        self.mocked_send_fcm_bulk_message.return_value = [
+            dict(results=[dict(error="NotRegistered"), dict(), dict(error="InvalidRegistration")])
+        ]
+
+        # select devices, deactivate failed ones, defer message for inactive and failed ones
+        with self.assertNumQueries(3):
+            Device.objects.all().send_message()
+
+        self.assertEqual(Device.objects.filter(is_active=False).count(), 3)
+        self.assertEqual(DeferredMessage.objects.count(), 3)
+
+    def test_send_bulk_message_without_failures_uses_single_query(self):
+        self.mocked_send_fcm_bulk_message.return_value = [dict(results=[dict(), dict(), dict(), dict()])]
+
+        with self.assertNumQueries(1):
+            Device.objects.all().send_message()
+
+    def test_non_deferred_bulk_message_do_not_add_deferred_message(self):
+        self.mocked_send_fcm_bulk_message.return_value = [
+            dict(results=[dict(), dict(), dict(error="NotRegistered"), dict()])
+        ]
+
+        with self.assertNumQueries(2):
+            Device.objects.all().send_message(deferred=False)
+
+        self.assertEqual(DeferredMessage.objects.count(), 0)
@@ -0,0 +1,101 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from device.collector import collect_messages
+from device.fcm import CircuitOpenError
+from device.models import OutboxMessage
+from device.tests import create_device, MockFcmMessagesMixin
+from test_utils import run_commit_hooks
+
+__author__ = "agent <agent@local>"
+
+
+class MessageCollectorTestCase(MockFcmMessagesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        for i in range(5):
+            create_device(get_user_model().objects.create_user(
+                username="user-{}".format(i), email="email-{}@test.com".format(i)
+            ))
+        self.users = list(get_user_model().objects.all())
+
+    def test_identical_messages_are_sent_once_on_commit(self):
+        with collect_messages():
+            for user in self.users:
+                user.send_message(title="title", body="body")
+
+        self.assertEqual(self.mocked_send_fcm_message.call_count, 0)
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 0)
+
+        run_commit_hooks()
+
+        self.assertEqual(self.mocked_send_fcm_message.call_count, 0)
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 1)
+        self.assertEqual(
+            len(self.mocked_send_fcm_bulk_message.call_args[1]["registration_ids"]), len(self.users)
+        )
+
+    def test_distinct_messages_are_sent_separately(self):
+        with collect_messages():
+            self.users[0].send_message(title="first")
+            get_user_model().objects.exclude(id=self.users[0].id).send_message(title="second")
+            self.users[1].send_message(title="first")
+
+        run_commit_hooks()
+
+        self.assertEqual(
+            sorted(
+                (kwargs["message_title"], len(kwargs["registration_ids"]))
+                for _, kwargs in self.mocked_send_fcm_bulk_message.call_args_list
+            ),
+            [("first", 2), ("second", len(self.users) - 1)]
+        )
+
+    def test_nothing_is_sent_on_rollback(self):
+        with self.assertRaises(ValueError):
+            with collect_messages():
+                self.users[0].send_message(title="title")
+                raise ValueError()
+
+        run_commit_hooks()
+
+        self.assertEqual(self.mocked_send_fcm_message.call_count, 0)
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 0)
+
+    def test_nested_blocks_are_sent_with_outermost_one(self):
+        with collect_messages():
+            self.users[0].send_message(title="title")
+            with collect_messages():
+                self.users[1].send_message(title="title")
+
+        run_commit_hooks()
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 1)
+
+    @override_settings(FCM_SETTINGS=dict(FCM_SERVER_KEY="", USE_OUTBOX=True))
+    def test_messages_are_grouped_in_outbox_within_transaction(self):
+        with collect_messages():
+            for user in self.users:
+                user.send_message(title="title")
+            self.assertEqual(OutboxMessage.objects.count(), 0)
+
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+        self.assertEqual(len(OutboxMessage.objects.get().devices), len(self.users))
+
+    def test_failure_after_commit_is_logged(self):
+        def send(message_title, **kwargs):
+            if message_title == "first":
+                raise CircuitOpenError("open")
+            return {}
+
+        self.mocked_send_fcm_bulk_message.side_effect = send
+        with collect_messages():
+            self.users[0].send_message(title="first")
+            self.users[1].send_message(title="second")
+
+        with self.assertLogs("device.collector", "ERROR"):
+            run_commit_hooks()
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_args[1]["message_title"], "second")
@@ -1,7 +1,12 @@
+from datetime import timedelta
+from io import StringIO
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
 
-from device.models import DeferredMessage, Device
+from device.models import DeferredMessage, Device, OutboxMessage
 from device.tests import create_device, MockFcmMessagesMixin
 
 __author__ = "Damien Rochat <rochat.damien@gmail.com>"
@@ -36,7 +41,7 @@ class DeferredMessagesTestCase(MockFcmMessagesMixin, TestCase):
         self.assertEqual(message.related_id, 1)
 
     def test_successful_deferred_message_remove_it_from_db(self):
-        self.mocked_send_fcm_message.return_value = dict(success=0)
+        self.mocked_send_fcm_message.return_value = dict(success=0, results=[dict(error="NotRegistered")])
         self.device.send_message(title="title", body="body")
 
         self.mocked_send_fcm_message.return_value = dict(success=1)
@@ -46,9 +51,180 @@ class DeferredMessagesTestCase(MockFcmMessagesMixin, TestCase):
         self.assertEqual(DeferredMessage.objects.filter(user=self.user).count(), 0)
 
     def test_failed_deferred_message_update_it_in_db(self):
-        self.mocked_send_fcm_message.return_value = dict(success=0)
+        self.mocked_send_fcm_message.return_value = dict(success=0, results=[dict(error="NotRegistered")])
         self.device.send_message(title="title", body="body")
 
         self.device.send_deferred_message(DeferredMessage.objects.last())
 
         self.assertEqual(DeferredMessage.objects.filter(user=self.user).count(), 1)
+
+
+class DeferredMessagesReplayTestCase(MockFcmMessagesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = get_user_model().objects.create_user(username="user", email="u@tdd.com")
+        self.device = create_device(self.user)
+
+        for i in range(3):
+            self.defer(title="meeting-{}".format(i), related_type="meeting", related_id=1)
+        self.defer(title="other meeting", related_type="meeting", related_id=2)
+        self.defer(title="unrelated")
+        self.defer(title="unrelated")
+
+        self.mocked_send_fcm_message.reset_mock()
+        self.mocked_send_fcm_message.return_value = dict(success=1)
+
+    def defer(self, **kwargs):
+        DeferredMessage(user=self.user, **kwargs).save()
+
+    def sent_titles(self):
+        return sorted(c[1]["message_title"] for c in self.mocked_send_fcm_message.call_args_list)
+
+    def test_replay_merges_messages_related_to_same_object(self):
+        self.user.send_deferred_messages()
+
+        self.assertEqual(self.sent_titles(), ["meeting-2", "other meeting", "unrelated"])
+
+    def test_replay_removes_all_delivered_messages(self):
+        # select the backlog and delete it
+        with self.assertNumQueries(2):
+            self.assertTrue(self.device.send_deferred_messages(DeferredMessage.objects.filter(user=self.user)))
+
+        self.assertEqual(DeferredMessage.objects.count(), 0)
+
+    def test_replay_keeps_failed_messages(self):
+        self.mocked_send_fcm_message.side_effect = lambda **kwargs: dict(
+            results=[dict(error="NotRegistered") if kwargs["message_title"] == "other meeting" else dict()]
+        )
+
+        self.assertFalse(self.device.send_deferred_messages(DeferredMessage.objects.filter(user=self.user)))
+
+        self.assertEqual(list(DeferredMessage.objects.values_list("title", flat=True)), ["other meeting"])
+        self.assertFalse(Device.objects.get(id=self.device.id).is_active)
+
+    def test_replay_to_inactive_device_keeps_messages(self):
+        Device.objects.filter(id=self.device.id).update(is_active=False)
+
+        self.user.send_deferred_messages()
+
+        self.assertEqual(self.mocked_send_fcm_message.call_count, 0)
+        self.assertEqual(DeferredMessage.objects.count(), 6)
+
+    def test_replay_with_outbox_hands_over_messages(self):
+        with self.settings(FCM_SETTINGS=dict(FCM_SERVER_KEY="", USE_OUTBOX=True)):
+            self.user.send_deferred_messages()
+
+        self.assertEqual(self.mocked_send_fcm_message.call_count, 0)
+        self.assertEqual(OutboxMessage.objects.count(), 3)
+        self.assertTrue(all(message.deferred for message in OutboxMessage.objects.all()))
+        self.assertEqual(DeferredMessage.objects.count(), 0)
+
+
+class DeferredMessagesCollapseTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.users = [
+            get_user_model().objects.create_user(username="user-{}".format(i), email="u-{}@tdd.com".format(i))
+            for i in range(3)
+        ]
+        self.user_ids = [user.id for user in self.users]
+
+    def defer(self, title, data=None, related_id=1):
+        DeferredMessage.objects.create_for_users(
+            self.user_ids,
+            title=title,
+            data=data if data is not None else dict(type="meeting-accepted", meeting=related_id),
+            related_type="meeting",
+            related_id=related_id,
+        )
+
+    def test_collapse_key_identifies_event_on_object(self):
+        self.defer("title")
+
+        self.assertEqual(
+            set(DeferredMessage.objects.values_list("collapse_key", flat=True)),
+            {"meeting-1-meeting-accepted"}
+        )
+
+    def test_newer_message_replaces_older_one(self):
+        self.defer("first")
+        ids = set(DeferredMessage.objects.values_list("id", flat=True))
+        self.defer("second")
+
+        self.assertEqual(DeferredMessage.objects.count(), len(self.users))
+        self.assertEqual(set(DeferredMessage.objects.values_list("id", flat=True)), ids)
+        self.assertEqual(set(DeferredMessage.objects.values_list("title", flat=True)), {"second"})
+
+    def test_different_events_are_kept(self):
+        self.defer("accepted")
+        self.defer("ended", data=dict(type="meeting-ended", meeting=1))
+        self.defer("other meeting", related_id=2)
+
+        self.assertEqual(DeferredMessage.objects.count(), 3 * len(self.users))
+
+    def test_messages_without_collapse_key_are_all_kept(self):
+        for _ in range(2):
+            DeferredMessage.objects.create_for_users(self.user_ids, title="title")
+
+        self.assertEqual(DeferredMessage.objects.count(), 2 * len(self.users))
+
+    def test_only_existing_messages_are_replaced(self):
+        DeferredMessage.objects.create_for_users(
+            self.user_ids[:1], title="first", data=dict(type="meeting-accepted", meeting=1),
+            related_type="meeting", related_id=1,
+        )
+        self.defer("second")
+
+        self.assertEqual(DeferredMessage.objects.count(), len(self.users))
+        self.assertEqual(set(DeferredMessage.objects.values_list("title", flat=True)), {"second"})
+
+    def test_upsert_is_a_single_query(self):
+        self.defer("first")
+
+        with self.assertNumQueries(1):
+            self.defer("second")
+
+
+@override_settings(FCM_SETTINGS=dict(FCM_SERVER_KEY="", DEFERRED_MESSAGE_TTL={"default": 60, "short": 1}))
+class DeferredMessagesExpiryTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.user = get_user_model().objects.create_user(username="user", email="u@tdd.com")
+
+    def test_expiry_depends_on_message_type(self):
+        now = timezone.now()
+        DeferredMessage.objects.create_for_users([self.user.id], title="short", data=dict(type="short"))
+        DeferredMessage.objects.create_for_users([self.user.id], title="other", data=dict(type="other"))
+
+        expiries = dict(DeferredMessage.objects.values_list("title", "expires_at"))
+        self.assertAlmostEqual((expiries["short"] - now).total_seconds(), 1, delta=1)
+        self.assertAlmostEqual((expiries["other"] - now).total_seconds(), 60, delta=1)
+
+    def test_saved_message_gets_an_expiry(self):
+        DeferredMessage(user=self.user, title="title").save()
+
+        self.assertIsNotNone(DeferredMessage.objects.get().expires_at)
+
+    def test_expired_messages_are_not_pending(self):
+        DeferredMessage.objects.create_for_users([self.user.id], title="pending")
+        DeferredMessage.objects.create_for_users([self.user.id], title="expired")
+        DeferredMessage.objects.filter(title="expired").update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(list(DeferredMessage.objects.pending().values_list("title", flat=True)), ["pending"])
+
+    def test_purge_deletes_expired_messages_in_batches(self):
+        DeferredMessage.objects.create_for_users([self.user.id], title="pending")
+        for _ in range(5):
+            DeferredMessage.objects.create_for_users([self.user.id], title="expired")
+        DeferredMessage.objects.filter(title="expired").update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        with self.assertNumQueries(3 * 4):  # 3 batches, each in its own transaction
+            call_command("purge_deferred_messages", batch_size=2, stdout=StringIO())
+
+        self.assertEqual(list(DeferredMessage.objects.values_list("title", flat=True)), ["pending"])
@@ -0,0 +1,106 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from pyfcm.errors import FCMServerError
+
+from device.fcm import close_push_service, send_fcm_fanout
+from device.models import DeferredMessage, Device
+from device.stub import accept, FCMStubServer
+
+__author__ = "agent <agent@local>"
+
+
+def reject_dead_tokens(registration_id):
+    if registration_id.endswith("-dead"):
+        return dict(error="NotRegistered")
+    return accept(registration_id)
+
+
+class FanOutTestCase(TestCase):
+    number_of_devices = 10000
+
+    @classmethod
+    def setUpTestData(cls):
+        get_user_model().objects.bulk_create(
+            get_user_model()(username="user-{}".format(i), email="email-{}@test.com".format(i))
+            for i in range(cls.number_of_devices)
+        )
+        Device.objects.bulk_create(
+            Device(user=user, registration_id="{}{}".format(user.id, "-dead" if user.id % 7 == 0 else ""))
+            for user in get_user_model().objects.all()
+        )
+
+    def setUp(self):
+        super().setUp()
+
+        self.server = FCMStubServer(result_for=reject_dead_tokens).start()
+        self.fcm_settings = override_settings(FCM_SETTINGS=dict(
+            FCM_SERVER_KEY="key", FCM_END_POINT=self.server.url, FCM_FANOUT_WORKERS=4,
+        ))
+        self.fcm_settings.enable()
+        close_push_service()
+
+    def tearDown(self):
+        close_push_service()
+        self.fcm_settings.disable()
+        self.server.stop()
+        super().tearDown()
+
+    def test_recipients_are_sent_in_chunks(self):
+        Device.objects.all().send_message(title="title")
+
+        self.assertEqual(self.server.requests, self.number_of_devices // 1000)
+
+    def test_results_are_merged_back_to_the_right_devices(self):
+        Device.objects.all().send_message(title="title")
+
+        dead = Device.objects.filter(registration_id__endswith="-dead")
+        self.assertEqual(Device.objects.filter(is_active=False).count(), dead.count())
+        self.assertEqual(dead.filter(is_active=True).count(), 0)
+        self.assertEqual(
+            sorted(DeferredMessage.objects.values_list("user_id", flat=True)),
+            sorted(dead.values_list("user_id", flat=True))
+        )
+
+    def test_fanout_reports_totals(self):
+        registration_ids = list(Device.objects.values_list("registration_id", flat=True))
+        result = send_fcm_fanout(registration_ids)
+
+        self.assertEqual(len(result["results"]), self.number_of_devices)
+        self.assertEqual(result["failure"], sum(1 for r in registration_ids if r.endswith("-dead")))
+        self.assertEqual(result["success"] + result["failure"], self.number_of_devices)
+        self.assertGreater(result["elapsed"], 0)
+
+    @override_settings(FCM_SETTINGS=dict(FCM_SERVER_KEY="key", FCM_CHUNK_SIZE=5000))
+    def test_chunks_never_exceed_provider_limit(self):
+        with patch("device.fcm.send_fcm_bulk_message", return_value=[dict(results=[])]) as send_fcm_bulk_message:
+            send_fcm_fanout(list(Device.objects.values_list("registration_id", flat=True)))
+
+        self.assertEqual(send_fcm_bulk_message.call_count, self.number_of_devices // 1000)
+
+    def test_failed_chunk_does_not_discard_the_others(self):
+        registration_ids = list(Device.objects.order_by("id").values_list("registration_id", flat=True))
+        failing = set(registration_ids[:1000])
+
+        def send(registration_ids, **kwargs):
+            if failing.intersection(registration_ids):
+                raise FCMServerError()
+            return [dict(results=[reject_dead_tokens(registration_id) for registration_id in registration_ids])]
+
+        with patch("device.fcm.send_fcm_bulk_message", side_effect=send), self.assertLogs("device.fcm", "WARNING"):
+            result = send_fcm_fanout(registration_ids)
+
+        errors = [device_result.get("error") for device_result in result["results"]]
+        self.assertEqual(errors[:1000], ["Unavailable"] * 1000)
+        self.assertEqual(
+            errors[1000:],
+            ["NotRegistered" if r.endswith("-dead") else None for r in registration_ids[1000:]]
+        )
+        self.assertEqual(result["failure"], 1000 + sum(1 for r in registration_ids[1000:] if r.endswith("-dead")))
+
+    def test_error_is_raised_when_no_chunk_was_sent(self):
+        with patch("device.fcm.send_fcm_bulk_message", side_effect=FCMServerError()):
+            with self.assertRaises(FCMServerError), self.assertLogs("device.fcm", "WARNING"):
+                send_fcm_fanout(list(Device.objects.values_list("registration_id", flat=True)))
@@ -0,0 +1,188 @@
+from collections import Counter
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from pyfcm.errors import FCMServerError
+
+from device.fcm import CircuitBreaker, CircuitOpenError, close_push_service, get_canonical_id, get_push_service, \
+    is_dead, is_transient, PooledFCMNotification, send_fcm_fanout
+from device.models import Device
+from device.stub import accept, canonical, FCMStubServer
+
+__author__ = "agent <agent@local>"
+
+
+@override_settings(FCM_SETTINGS=dict(FCM_SERVER_KEY="key", FCM_POOL_SIZE=3, FCM_READ_TIMEOUT=4))
+class PushServiceTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        close_push_service()
+
+    def tearDown(self):
+        close_push_service()
+        super().tearDown()
+
+    def test_push_service_is_reused(self):
+        self.assertIs(get_push_service(), get_push_service())
+
+    def test_push_service_is_configured_from_settings(self):
+        service = get_push_service()
+
+        self.assertEqual(service.timeout[1], 4)
+        self.assertEqual(service.session.get_adapter(service.FCM_END_POINT)._pool_maxsize, 3)
+
+    def test_closed_push_service_is_recreated(self):
+        service = get_push_service()
+        close_push_service()
+
+        self.assertIsNot(get_push_service(), service)
+
+    def test_push_service_is_recreated_in_forked_process(self):
+        service = get_push_service()
+
+        with patch("device.fcm.os.getpid", return_value=-1):
+            self.assertIsNot(get_push_service(), service)
+
+
+class PooledFCMNotificationTestCase(TestCase):
+
+    def test_connections_are_kept_alive(self):
+        with FCMStubServer() as server:
+            service = PooledFCMNotification(api_key="key", end_point=server.url)
+
+            for _ in range(3):
+                self.assertEqual(service.notify_single_device(registration_id="token")["success"], 1)
+            service.close()
+
+        self.assertEqual(server.connections, 1)
+
+    def test_bulk_message_reads_all_results(self):
+        with FCMStubServer() as server:
+            service = PooledFCMNotification(api_key="key", end_point=server.url)
+
+            result = service.notify_multiple_devices(registration_ids=["a", "b", "c"])
+            service.close()
+
+        self.assertEqual(len(result[0]["results"]), 3)
+
+
+class FCMErrorsTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.calls = Counter()
+        self.server = FCMStubServer(result_for=self.result_for).start()
+        self.fcm_settings = override_settings(FCM_SETTINGS=dict(
+            FCM_SERVER_KEY="key", FCM_END_POINT=self.server.url, FCM_RETRY_DELAY=0, FCM_MAX_RETRIES=2,
+            FCM_BREAKER_THRESHOLD=2,
+        ))
+        self.fcm_settings.enable()
+        close_push_service()
+
+        self.user = get_user_model().objects.create_user(username="user", email="user@test.com")
+
+    def tearDown(self):
+        close_push_service()
+        self.fcm_settings.disable()
+        self.server.stop()
+        super().tearDown()
+
+    def result_for(self, registration_id):
+        self.calls[registration_id] += 1
+        if registration_id == "flaky" and self.calls[registration_id] == 1:
+            return dict(error="Unavailable")
+        if registration_id == "unavailable":
+            return dict(error="Unavailable")
+        if registration_id == "dead":
+            return dict(error="NotRegistered")
+        if registration_id in ("old", "older"):
+            return canonical("new")(registration_id)
+        return accept(registration_id)
+
+    def test_results_are_classified(self):
+        self.assertTrue(is_dead(dict(error="NotRegistered")))
+        self.assertFalse(is_dead(dict(error="Unavailable")))
+        self.assertTrue(is_transient(dict(error="Unavailable")))
+        self.assertFalse(is_transient(dict(error="MessageTooBig")))
+        self.assertEqual(get_canonical_id(dict(message_id="1", registration_id="new")), "new")
+        self.assertIsNone(get_canonical_id(dict(message_id="1")))
+
+    def test_transient_errors_are_retried(self):
+        result = send_fcm_fanout(["flaky", "ok"])
+
+        self.assertEqual(result["success"], 2)
+        self.assertEqual(self.calls["flaky"], 2)
+        self.assertEqual(self.calls["ok"], 1)
+
+    def test_retries_are_bounded(self):
+        with self.assertLogs("device.fcm", "WARNING"):
+            result = send_fcm_fanout(["unavailable"])
+
+        self.assertEqual(result["failure"], 1)
+        self.assertEqual(self.calls["unavailable"], 3)
+
+    def test_transient_errors_do_not_deactivate_device(self):
+        device = Device.objects.create(user=self.user, registration_id="unavailable")
+
+        with self.assertLogs("device.fcm", "WARNING"):
+            self.assertFalse(device.send_message(title="title"))
+
+        self.assertTrue(Device.objects.get(id=device.id).is_active)
+
+    def test_dead_token_deactivates_device(self):
+        device = Device.objects.create(user=self.user, registration_id="dead")
+
+        Device.objects.all().send_message(title="title")
+
+        self.assertFalse(Device.objects.get(id=device.id).is_active)
+        self.assertEqual(self.calls["dead"], 1)
+
+    def test_canonical_id_replaces_registration_id(self):
+        device = Device.objects.create(user=self.user, registration_id="old")
+
+        self.assertTrue(device.send_message(title="title"))
+
+        device = Device.objects.get(id=device.id)
+        self.assertEqual(device.registration_id, "new")
+        self.assertTrue(device.is_active)
+
+    def test_duplicate_device_is_removed_on_canonical_id(self):
+        Device.objects.create(user=self.user, registration_id="new")
+        Device.objects.create(user=self.user, registration_id="old")
+
+        Device.objects.all().send_message(title="title")
+
+        self.assertEqual(list(Device.objects.values_list("registration_id", flat=True)), ["new"])
+
+    def test_devices_given_the_same_canonical_id_are_merged(self):
+        other = get_user_model().objects.create_user(username="other", email="other@test.com")
+        kept = Device.objects.create(user=self.user, registration_id="old")
+        Device.objects.create(user=other, registration_id="older")
+
+        Device.objects.all().send_message(title="title")
+
+        self.assertEqual(list(Device.objects.values_list("id", "registration_id")), [(kept.id, "new")])
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.server.server.error_rate = 1
+
+        for _ in range(2):
+            with self.assertRaises(FCMServerError):
+                send_fcm_fanout(["ok"])
+        requests = self.server.requests
+
+        with self.assertRaises(CircuitOpenError):
+            send_fcm_fanout(["ok"])
+        self.assertEqual(self.server.requests, requests)
+
+    def test_circuit_lets_a_request_through_after_timeout(self):
+        breaker = CircuitBreaker(threshold=1, timeout=0)
+        breaker.record_failure()
+
+        breaker.before_request()
+        breaker.record_success()
+
+        self.assertIsNone(breaker.opened_at)
@@ -29,7 +29,7 @@ class MessagesTestCase(MockFcmMessagesMixin, TestCase):
         self.assertTrue(Device.objects.get(id=self.device.id).is_active)
 
     def test_failed_message_set_device_as_inactive(self):
-        self.mocked_send_fcm_message.return_value = dict(success=0)
+        self.mocked_send_fcm_message.return_value = dict(success=0, results=[dict(error="NotRegistered")])
         self.device.send_message()
 
         self.assertFalse(Device.objects.get(id=self.device.id).is_active)
@@ -41,7 +41,7 @@ class MessagesTestCase(MockFcmMessagesMixin, TestCase):
         self.assertEqual(DeferredMessage.objects.count(), 0)
 
     def test_failed_message_add_deferred_message(self):
-        self.mocked_send_fcm_message.return_value = dict(success=0)
+        self.mocked_send_fcm_message.return_value = dict(success=0, results=[dict(error="NotRegistered")])
         self.device.send_message()
 
         self.assertEqual(DeferredMessage.objects.count(), 1)
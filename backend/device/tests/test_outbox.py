@@ -0,0 +1,153 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from pyfcm.errors import FCMServerError
+
+from device.models import DeferredMessage, Device, OutboxMessage
+from device.tests import create_device, MockFcmMessagesMixin
+
+__author__ = "agent <agent@local>"
+
+
+@override_settings(FCM_SETTINGS=dict(FCM_SERVER_KEY="", USE_OUTBOX=True, OUTBOX_MAX_ATTEMPTS=2, FCM_MAX_RETRIES=0))
+class OutboxTestCase(MockFcmMessagesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        for i in range(3):
+            user = get_user_model().objects.create_user(
+                username="user-{}".format(i),
+                email="email-{}@test.com".format(i),
+            )
+            create_device(user)
+
+        self.mocked_send_fcm_bulk_message.return_value = [dict(results=[dict(), dict(), dict()])]
+
+    def test_send_message_only_writes_to_outbox(self):
+        Device.objects.all().send_message(title="title")
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 0)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+        self.assertEqual(sorted(OutboxMessage.objects.get().devices), sorted(Device.objects.values_list("id", flat=True)))
+
+    def test_send_single_message_only_writes_to_outbox(self):
+        self.assertTrue(Device.objects.first().send_message(title="title"))
+
+        self.assertEqual(self.mocked_send_fcm_message.call_count, 0)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_worker_sends_and_removes_messages(self):
+        Device.objects.all().send_message(title="title")
+
+        call_command("push_worker", once=True)
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 1)
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+
+    def test_worker_applies_deactivation_rules(self):
+        self.mocked_send_fcm_bulk_message.return_value = [dict(results=[dict(), dict(error="NotRegistered"), dict()])]
+        Device.objects.all().send_message(title="title")
+
+        call_command("push_worker", once=True)
+
+        self.assertEqual(Device.objects.filter(is_active=False).count(), 1)
+        self.assertEqual(DeferredMessage.objects.count(), 1)
+
+    def test_worker_ignores_messages_not_yet_available(self):
+        Device.objects.all().send_message(title="title")
+        OutboxMessage.objects.update(available_at=timezone.now() + timedelta(minutes=1))
+
+        call_command("push_worker", once=True)
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 0)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_failed_message_is_retried_later(self):
+        self.mocked_send_fcm_bulk_message.side_effect = FCMServerError()
+        Device.objects.all().send_message(title="title")
+
+        call_command("push_worker", once=True)
+
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(message.available_at, timezone.now())
+
+    def test_message_is_deferred_after_too_many_attempts(self):
+        self.mocked_send_fcm_bulk_message.side_effect = FCMServerError()
+        Device.objects.all().send_message(title="title")
+
+        call_command("push_worker", once=True)
+        OutboxMessage.objects.update(available_at=timezone.now())
+        with self.assertLogs("device.models", "WARNING"):
+            call_command("push_worker", once=True)
+
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+        self.assertEqual(DeferredMessage.objects.count(), 3)
+        self.assertEqual(Device.objects.filter(is_active=True).count(), 3)
+
+    @override_settings(FCM_SETTINGS=dict(FCM_SERVER_KEY="", USE_OUTBOX=True, FCM_MAX_RETRIES=0, FCM_CHUNK_SIZE=2))
+    def test_message_is_stored_per_chunk(self):
+        Device.objects.all().send_message(title="title")
+
+        self.assertEqual(sorted(len(message.devices) for message in OutboxMessage.objects.all()), [1, 2])
+
+    @override_settings(FCM_SETTINGS=dict(FCM_SERVER_KEY="", USE_OUTBOX=True, FCM_MAX_RETRIES=0, FCM_CHUNK_SIZE=2))
+    def test_only_failed_chunk_is_retried(self):
+        self.mocked_send_fcm_bulk_message.side_effect = [[dict(results=[dict(), dict()])], FCMServerError()]
+        Device.objects.all().send_message(title="title")
+
+        call_command("push_worker", once=True)
+
+        message = OutboxMessage.objects.get()
+        self.assertEqual(len(message.devices), 1)
+        self.assertEqual(message.attempts, 1)
+
+        self.mocked_send_fcm_bulk_message.side_effect = None
+        OutboxMessage.objects.update(available_at=timezone.now())
+        call_command("push_worker", once=True)
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 3)
+        self.assertEqual(len(self.mocked_send_fcm_bulk_message.call_args[1]["registration_ids"]), 1)
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+
+    def test_messages_are_claimed_before_being_sent(self):
+        claimed = []
+
+        def send(*args, **kwargs):
+            claimed.append(OutboxMessage.objects.filter(available_at__gt=timezone.now()).exists())
+            return [dict(results=[dict(), dict(), dict()])]
+
+        self.mocked_send_fcm_bulk_message.side_effect = send
+        Device.objects.all().send_message(title="title")
+
+        OutboxMessage.objects.dispatch(10)
+
+        self.assertEqual(claimed, [True])
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+
+    def test_unexpected_error_is_retried_later(self):
+        self.mocked_send_fcm_bulk_message.side_effect = RuntimeError()
+        Device.objects.all().send_message(title="title")
+
+        with self.assertLogs("device.models", "ERROR"):
+            call_command("push_worker", once=True)
+
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(message.available_at, timezone.now())
+
+    def test_message_whose_last_attempt_did_not_complete_is_given_up(self):
+        Device.objects.all().send_message(title="title")
+        # as left by a worker which stopped while sending it for the last time
+        OutboxMessage.objects.update(attempts=2)
+
+        with self.assertLogs("device.models", "WARNING"):
+            call_command("push_worker", once=True)
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 0)
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+        self.assertEqual(DeferredMessage.objects.count(), 3)
@@ -0,0 +1,65 @@
+import time
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from pyfcm.errors import FCMServerError
+
+from device.fcm import PooledFCMNotification
+from device.models import Device
+from device.stub import canonical, FCMStubServer, reject, respond_with
+
+__author__ = "agent <agent@local>"
+
+
+class FCMStubServerTestCase(TransactionTestCase):
+
+    def notify(self, server, registration_ids):
+        service = PooledFCMNotification(api_key="key", end_point=server.url)
+        try:
+            return service.notify_multiple_devices(registration_ids=registration_ids)[0]
+        finally:
+            service.close()
+
+    def test_results_depend_on_registration_id(self):
+        result_for = respond_with(dict(dead=reject(), moved=canonical("new")))
+
+        with FCMStubServer(result_for=result_for) as server:
+            result = self.notify(server, ["dead", "moved", "other"])
+
+        self.assertEqual((result["success"], result["failure"], result["canonical_ids"]), (2, 1, 1))
+        self.assertEqual(result["results"][0], dict(error="NotRegistered"))
+        self.assertEqual(result["results"][1]["registration_id"], "new")
+        self.assertIn("message_id", result["results"][2])
+
+    def test_requests_are_captured(self):
+        with FCMStubServer(capture=True) as server:
+            self.notify(server, ["a", "b"])
+
+        self.assertEqual(len(server.captured), 1)
+        self.assertEqual(server.captured[0]["registration_ids"], ["a", "b"])
+
+    def test_errors_are_injected(self):
+        with FCMStubServer(error_rate=1) as server:
+            with self.assertRaises(FCMServerError):
+                self.notify(server, ["a"])
+
+        self.assertEqual(server.errors, 1)
+
+    def test_latency_is_injected(self):
+        with FCMStubServer(latency=0.05) as server:
+            start = time.perf_counter()
+            self.notify(server, ["a"])
+
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+
+    def test_load_test_reports_throughput(self):
+        out = StringIO()
+        call_command("load_test_push", devices=20, messages=40, recipients=5, concurrency=2, dead_ratio=0.1,
+                     stdout=out)
+
+        self.assertIn("pushes/s", out.getvalue())
+        self.assertIn("p99", out.getvalue())
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertFalse(Device.objects.exists())
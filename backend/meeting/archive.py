@@ -0,0 +1,94 @@
+"""
+Archival of meetings which are over.
+
+Meetings which ended or were canceled are only ever read again in the history of their participants, yet they would
+fill the tables every running meeting is looked up in. Once old enough, they are moved, with their participants and
+places, to tables of their own, `ArchivedMeeting`, `ArchivedParticipant` and `ArchivedPlace`, keeping their ids. Their
+positions and events, which only matter while a meeting runs, are deleted.
+
+Meetings are archived in batches, each in its own transaction, by the `archive_meetings` management command, which
+should run regularly. Views showing the history of users read both the hot and the archived tables, see
+`MeetingListView`, `MeetingDetailsView` and `PlaceListView`.
+"""
+
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from meeting.models import ArchivedMeeting, ArchivedParticipant, ArchivedPlace, Meeting, MeetingEvent, Participant, \
+    Place, Position
+
+__author__ = "agent <agent@local>"
+
+
+DEFAULT_AGE = timedelta(days=7)
+
+
+def _copy(source, destination, where, params):
+    """
+    Copy rows from a table to its archive, in a single query.
+
+    :param source: model of the hot table
+    :param destination: model of the archive table, with the same columns
+    :param where: SQL condition selecting the rows of the hot table to copy
+    :param params: parameters of the condition
+    """
+    quote = connection.ops.quote_name
+    columns = ", ".join(quote(field.column) for field in destination._meta.concrete_fields)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO {destination} ({columns}) SELECT {columns} FROM {source} WHERE {where}".format(
+                destination=quote(destination._meta.db_table), source=quote(source._meta.db_table),
+                columns=columns, where=where,
+            ),
+            params,
+        )
+
+
+def archive_batch(meeting_ids):
+    """
+    Move meetings to the archive, with their participants and places.
+
+    Places still used by meetings which are not archived are only copied.
+
+    :param meeting_ids: ids of meetings which ended or were canceled
+    """
+    quote = connection.ops.quote_name
+    placeholders = ", ".join(["%s"] * len(meeting_ids))
+    participants = "SELECT {place} FROM {participant} WHERE {meeting} IN ({ids}) AND {place} IS NOT NULL".format(
+        place=quote("place_id"), participant=quote(Participant._meta.db_table), meeting=quote("meeting_id"),
+        ids=placeholders,
+    )
+
+    with transaction.atomic():
+        _copy(Place, ArchivedPlace, "{id} IN ({participants}) AND {id} NOT IN (SELECT {id} FROM {archive})".format(
+            id=quote("id"), participants=participants, archive=quote(ArchivedPlace._meta.db_table),
+        ), meeting_ids)
+        _copy(Meeting, ArchivedMeeting, "{} IN ({})".format(quote("id"), placeholders), meeting_ids)
+        _copy(Participant, ArchivedParticipant, "{} IN ({})".format(quote("meeting_id"), placeholders), meeting_ids)
+
+        place_ids = list(Participant.objects.filter(meeting_id__in=meeting_ids, place__isnull=False)
+                         .values_list("place_id", flat=True).distinct())
+        MeetingEvent.objects.filter(meeting_id__in=meeting_ids).delete()
+        Position.objects.filter(meeting_id__in=meeting_ids).delete()
+        Participant.objects.filter(meeting_id__in=meeting_ids).delete()
+        Meeting.objects.filter(id__in=meeting_ids).delete()
+        Place.objects.filter(id__in=place_ids, participant__isnull=True).delete()
+
+
+def archivable_meetings(age=DEFAULT_AGE):
+    """
+    Get the meetings which ended or were canceled long enough ago to be archived.
+
+    Meetings without an end time, which were canceled before they started, are as old as their start time.
+
+    :param age: how long ago meetings must have ended to be archived
+    :return: QuerySet of the meetings, by id
+    """
+    return Meeting.objects\
+        .filter(status__in=(Meeting.STATUS_ENDED, Meeting.STATUS_CANCELED))\
+        .annotate(over_time=Coalesce("end_time", "start_time"))\
+        .filter(over_time__lt=timezone.now() - age)\
+        .order_by("id")
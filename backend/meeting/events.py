@@ -0,0 +1,81 @@
+"""
+Utilities to follow the events of meetings live.
+
+Every message sent about a meeting is logged as a `MeetingEvent`, which participants can follow with long polling, see
+`MeetingEventsView`. Participants following the events of a meeting are not sent push notifications about it, as long as
+they keep polling. This is configured by the `EVENT_SETTINGS` setting:
+
+    - MAX_WAIT: maximum number of seconds a request waits for new events
+    - POLL_INTERVAL: number of seconds between two checks for new events while waiting
+    - BATCH_SIZE: maximum number of events returned at once
+    - GRACE: number of seconds a participant is still considered to follow the events after his last request returned,
+      which leaves him the time to send the next one
+
+Which participants follow the events is kept in the default cache, which must be shared by all processes.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+__author__ = "agent <agent@local>"
+
+
+DEFAULT_MAX_WAIT = 25
+DEFAULT_POLL_INTERVAL = 1
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_GRACE = 10
+
+
+def _followers_key(meeting_id):
+    return "meeting-followers:{}".format(meeting_id)
+
+
+def follow_events(meeting_id, user_id, wait):
+    """
+    Record that a participant follows the events of a meeting, for the time of his request and the grace period.
+
+    Concurrent requests may lose each other's update, the participant is then sent push notifications until his next
+    request, which is harmless.
+
+    :param meeting_id: id of the meeting
+    :param user_id: id of the participant
+    :param wait: number of seconds the request of the participant waits for events
+    """
+    grace = getattr(settings, "EVENT_SETTINGS", {}).get("GRACE", DEFAULT_GRACE)
+    now = time.time()
+    followers = {
+        follower: deadline for follower, deadline in cache.get(_followers_key(meeting_id), {}).items() if deadline > now
+    }
+    followers[user_id] = now + wait + grace
+    cache.set(_followers_key(meeting_id), followers, max(followers.values()) - now)
+
+
+def get_followers(meeting_id):
+    """
+    Get the participants currently following the events of a meeting.
+
+    :param meeting_id: id of the meeting
+    :return: set of user ids
+    """
+    now = time.time()
+    return {follower for follower, deadline in cache.get(_followers_key(meeting_id), {}).items() if deadline > now}
+
+
+def wait_for_events(events, wait):
+    """
+    Wait until there are events to return.
+
+    :param events: QuerySet of the events to return
+    :param wait: maximum number of seconds to wait
+    :return: the list of events, which is empty if none came in time
+    """
+    interval = getattr(settings, "EVENT_SETTINGS", {}).get("POLL_INTERVAL", DEFAULT_POLL_INTERVAL)
+    deadline = time.monotonic() + wait
+    while True:
+        found = list(events.all())
+        remaining = deadline - time.monotonic()
+        if found or remaining <= 0:
+            return found
+        time.sleep(min(interval, remaining))
@@ -0,0 +1,142 @@
+"""
+Geohashes of positions, used to index places spatially.
+
+A geohash splits the world in 32 cells, each of them in 32 smaller cells, and so on, naming each cell with one more
+character than its parent. Positions close to each other thus share a prefix, and every position of a cell lies in a
+contiguous range of geohashes, which a regular B-tree index on SQLite and PostgreSQL alike finds quickly.
+
+Looking for positions around a point is done on the smallest cells covering the box around the circle in a few ranges,
+see `covering_ranges`.
+"""
+
+import numpy
+
+from meeting.meeting_point import bounding_box
+
+__author__ = "agent <agent@local>"
+
+
+ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# 9 characters are cells of about 5 meters, under the precision of a phone's GPS
+PRECISION = 9
+
+# maximum number of ranges of geohashes looked up around a point
+MAX_COVERING_CELLS = 16
+
+
+def _bits(precision):
+    """Get the number of bits used for latitudes and for longitudes by geohashes of a given length."""
+    bits = 5 * precision
+    return bits // 2, bits - bits // 2
+
+
+def _cells(latitudes, longitudes, precision):
+    """Get the row and column of positions in the grid of geohashes of a given length, with NumPy or plain numbers."""
+    latitude_bits, longitude_bits = _bits(precision)
+    # positions on the upper edge of the world belong to the last cell
+    rows = numpy.minimum(((latitudes + 90) / 180 * 2 ** latitude_bits) // 1, 2 ** latitude_bits - 1)
+    columns = numpy.minimum(((longitudes + 180) / 360 * 2 ** longitude_bits) // 1, 2 ** longitude_bits - 1)
+    return rows, columns
+
+
+def encode_many(latitudes, longitudes, precision=PRECISION):
+    """
+    Compute the geohashes of positions, all at once.
+
+    :param latitudes: latitudes of the positions, in degrees
+    :param longitudes: longitudes of the positions, in degrees
+    :param precision: number of characters of the geohashes
+    :return: list of geohashes
+    """
+    latitude_bits, longitude_bits = _bits(precision)
+    rows, columns = _cells(
+        numpy.asarray(latitudes, dtype=float), numpy.asarray(longitudes, dtype=float), precision
+    )
+    rows, columns = rows.astype(numpy.int64), columns.astype(numpy.int64)
+
+    # bits alternate, starting with the longitude, from the most significant one
+    hashes = numpy.zeros(len(rows), dtype=numpy.int64)
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            value = (columns >> (longitude_bits - 1 - bit // 2)) & 1
+        else:
+            value = (rows >> (latitude_bits - 1 - bit // 2)) & 1
+        hashes = (hashes << 1) | value
+
+    characters = numpy.array(list(ALPHABET))
+    digits = [characters[(hashes >> (5 * (precision - 1 - i))) & 31] for i in range(precision)]
+    return ["".join(geohash) for geohash in zip(*digits)]
+
+
+def _encode_cell(row, column, precision):
+    """Get the geohash of the cell at a given row and column of the grid of geohashes of a given length."""
+    latitude_bits, longitude_bits = _bits(precision)
+    value = 0
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            value = (value << 1) | ((column >> (longitude_bits - 1 - bit // 2)) & 1)
+        else:
+            value = (value << 1) | ((row >> (latitude_bits - 1 - bit // 2)) & 1)
+
+    return "".join(ALPHABET[(value >> (5 * (precision - 1 - i))) & 31] for i in range(precision))
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """
+    Compute the geohash of a position.
+
+    This is `encode_many` for a single position, without the cost of building arrays.
+
+    :param latitude: latitude of the position, in degrees
+    :param longitude: longitude of the position, in degrees
+    :param precision: number of characters of the geohash
+    :return: the geohash
+    """
+    row, column = (int(cell) for cell in _cells(float(latitude), float(longitude), precision))
+    return _encode_cell(row, column, precision)
+
+
+def _wrap(longitude):
+    """Bring a longitude back between -180 and 180 degrees."""
+    return (longitude + 180) % 360 - 180
+
+
+def covering_ranges(latitude, longitude, radius, precision=PRECISION):
+    """
+    Get ranges of geohashes containing every position within a distance of a point.
+
+    The ranges are those of the cells overlapping the bounding box of the circle around the point, at the longest length
+    for which there are at most `MAX_COVERING_CELLS` of them. Each range bounds geohashes of length `precision`, both
+    included.
+
+    :param latitude: latitude of the point, in degrees
+    :param longitude: longitude of the point, in degrees
+    :param radius: distance around the point, in meters
+    :param precision: length of the geohashes to bound
+    :return: set of (lowest, highest) geohashes, empty if the bounding box needs more cells at any length
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    height, width = bounding_box(latitude, longitude, radius)
+
+    for length in range(precision, 0, -1):
+        latitude_bits, longitude_bits = _bits(length)
+        lowest_row, lowest_column = _cells(max(-90, latitude - height), _wrap(longitude - width), length)
+        highest_row, highest_column = _cells(min(90, latitude + height), _wrap(longitude + width), length)
+        rows = range(int(lowest_row), int(highest_row) + 1)
+        if width >= 180:
+            columns = range(2 ** longitude_bits)
+        else:
+            # the box may cross the antimeridian, columns then wrap around
+            columns = range(int(lowest_column), int(highest_column) + 1 if highest_column >= lowest_column else
+                            int(highest_column) + 1 + 2 ** longitude_bits)
+
+        if len(rows) * len(columns) <= MAX_COVERING_CELLS:
+            prefixes = {
+                _encode_cell(row, column % 2 ** longitude_bits, length) for row in rows for column in columns
+            }
+            # geohashes only use the alphabet, whose last character is the highest in any collation
+            return {
+                (prefix.ljust(precision, ALPHABET[0]), prefix.ljust(precision, ALPHABET[-1])) for prefix in prefixes
+            }
+    return set()
@@ -0,0 +1,43 @@
+"""Move the meetings which are over to the archive."""
+
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from meeting.archive import archivable_meetings, archive_batch, DEFAULT_AGE
+
+__author__ = "agent <agent@local>"
+
+
+class Command(BaseCommand):
+    """
+    Archive meetings which ended or were canceled, in batches, see `meeting.archive`.
+
+    Each batch is moved in its own transaction, so that rows are never locked for long.
+    """
+
+    help = "Move meetings which are over to the archive tables, in small transactions."
+
+    def add_arguments(self, parser):
+        """Add the age of meetings to archive, the batch size and pause between batches as arguments."""
+        parser.add_argument("--days", type=float, default=DEFAULT_AGE.days,
+                            help="only archive meetings which ended at least this number of days ago")
+        parser.add_argument("--batch-size", type=int, default=500, help="number of meetings archived at once")
+        parser.add_argument("--pause", type=float, default=0, help="seconds to wait between two batches")
+
+    def handle(self, *args, **options):
+        """Archive batches of meetings until there is none left."""
+        meetings = archivable_meetings(timedelta(days=options["days"]))
+
+        total = 0
+        while True:
+            meeting_ids = list(meetings.values_list("id", flat=True)[:options["batch_size"]])
+            if meeting_ids:
+                archive_batch(meeting_ids)
+                total += len(meeting_ids)
+            if len(meeting_ids) < options["batch_size"]:
+                break
+            time.sleep(options["pause"])
+
+        self.stdout.write("Archived {} meetings".format(total))
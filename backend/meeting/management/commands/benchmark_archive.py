@@ -0,0 +1,149 @@
+"""Benchmark the queries of running meetings as the history grows, with and without archival."""
+
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from meeting.archive import archivable_meetings, archive_batch
+from meeting.models import Meeting, Participant
+
+__author__ = "agent <agent@local>"
+
+
+class Command(BaseCommand):
+    """
+    Time the queries made for running meetings, with `--history` finished meetings in the hot tables, then archived.
+
+    Every finished meeting has the same `--participants` users as the running ones, the worst case for queries looking
+    meetings up by participant. Everything is created in a transaction which is rolled back at the end, the database is
+    left untouched.
+    """
+
+    help = "Show that queries of running meetings do not slow down as the history grows once it is archived."
+
+    def add_arguments(self, parser):
+        """Add the size of the benchmark as arguments."""
+        parser.add_argument("--history", type=int, nargs="+", default=[0, 1000, 10000],
+                            help="numbers of finished meetings to compare")
+        parser.add_argument("--participants", type=int, default=5, help="number of participants in each meeting")
+        parser.add_argument("--active", type=int, default=3, help="number of running meetings")
+        parser.add_argument("--rounds", type=int, default=200, help="number of times each query is timed")
+
+    def handle(self, *args, **options):
+        """Create the users and running meetings, run the benchmark for each history size and print the results."""
+        class Rollback(Exception):
+            """Raised to discard the synthetic data."""
+
+        try:
+            with transaction.atomic():
+                users = self.create_users(options["participants"])
+                active = [self.create_meeting(users, Meeting.STATUS_PROGRESS) for _ in range(options["active"])]
+                for history in options["history"]:
+                    # each size starts again from the running meetings only
+                    try:
+                        with transaction.atomic():
+                            self.benchmark(users, active, history, options["rounds"])
+                            raise Rollback()
+                    except Rollback:
+                        pass
+                raise Rollback()
+        except Rollback:
+            pass
+
+    @staticmethod
+    def create_users(count):
+        """Create `count` users."""
+        get_user_model().objects.bulk_create(
+            get_user_model()(username="benchmark-{}".format(i), email="benchmark-{}@rady.test".format(i))
+            for i in range(count)
+        )
+        return list(get_user_model().objects.filter(username__startswith="benchmark-").order_by("id"))
+
+    @staticmethod
+    def create_meeting(users, status):
+        """Create a meeting accepted by every user."""
+        meeting = Meeting.objects.create(organiser=users[0], status=status, type=Meeting.TYPE_PLACE)
+        Participant.objects.bulk_create(Participant(meeting=meeting, user=user, accepted=True) for user in users)
+        return meeting
+
+    @staticmethod
+    def create_history(users, count, batch_size=1000):
+        """Create `count` meetings which ended a month ago, accepted by every user."""
+        for offset in range(0, count, batch_size):
+            size = min(batch_size, count - offset)
+            Meeting.objects.bulk_create(
+                Meeting(organiser=users[0], status=Meeting.STATUS_ENDED, type=Meeting.TYPE_PLACE) for _ in range(size)
+            )
+            meetings = Meeting.objects.filter(status=Meeting.STATUS_ENDED).order_by("-id")[:size]
+            Participant.objects.bulk_create(
+                Participant(meeting=meeting, user=user, accepted=True) for meeting in meetings for user in users
+            )
+        # the start time is set on creation, finished meetings are moved back in time afterwards
+        Meeting.objects.filter(status=Meeting.STATUS_ENDED).update(start_time=timezone.now() - timedelta(days=30))
+
+    def benchmark(self, users, active, history, rounds):
+        """Time the queries of running meetings with the history in the hot tables, then in the archive."""
+        user = users[-1]
+        meeting_ids = [meeting.id for meeting in active]
+
+        def active_meetings():
+            # what the application lists on its home page
+            return list(Meeting.objects.filter(
+                participant__user=user, status__in=(Meeting.STATUS_PENDING, Meeting.STATUS_PROGRESS)
+            ).with_details(user))
+
+        def position_lookup():
+            # what `record_positions` does for each posted position
+            return [Meeting.objects.filter(id=meeting_id, participant__user_id=user.id).first()
+                    for meeting_id in meeting_ids]
+
+        def participants():
+            # what the permission checks and meeting point updates do
+            return [
+                list(Participant.objects.filter(meeting_id=meeting_id, accepted=True)) for meeting_id in meeting_ids
+            ]
+
+        start = time.perf_counter()
+        self.create_history(users, history)
+        self.stdout.write("history of {} meetings created in {:.1f}s".format(history, time.perf_counter() - start))
+
+        for tables in ("hot", "archived"):
+            if tables == "archived":
+                start = time.perf_counter()
+                archive_batch(list(archivable_meetings().values_list("id", flat=True)))
+                self.stdout.write("history archived in {:.1f}s".format(time.perf_counter() - start))
+            for name, query in (("active meetings", active_meetings), ("position lookup", position_lookup),
+                                ("participants", participants)):
+                with CaptureQueriesContext(connection) as queries:
+                    latencies = self.measure(query, rounds)
+                self.report("{} {}".format(name, tables), latencies, len(queries) / rounds)
+
+    @staticmethod
+    def measure(query, rounds):
+        """
+        Time `rounds` calls to `query`.
+
+        :return: sorted list of latencies, in milliseconds
+        """
+        latencies = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            query()
+            latencies.append((time.perf_counter() - start) * 1000)
+        return sorted(latencies)
+
+    def report(self, name, latencies, queries):
+        """Print a summary of the given latencies, and of the number of queries made per round."""
+        self.stdout.write("{:<25} mean={:.3f}ms p50={:.3f}ms p99={:.3f}ms queries={:.0f}".format(
+            name,
+            statistics.mean(latencies),
+            latencies[len(latencies) // 2],
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            queries,
+        ))
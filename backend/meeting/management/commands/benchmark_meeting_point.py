@@ -0,0 +1,80 @@
+"""Benchmark the computation of meeting points for meetings of different sizes."""
+
+import statistics
+import time
+
+import numpy
+from django.core.management.base import BaseCommand
+
+from meeting import meeting_point
+
+__author__ = "agent <agent@local>"
+
+
+class Command(BaseCommand):
+    """
+    Time each kind of meeting point for participants spread around a city, from scratch and from the previous point.
+
+    Starting from the previous point is what happens as positions arrive: a participant moved a little, and the point
+    is computed again from where it was.
+    """
+
+    help = "Time the computation of meeting points for 2 to 500 participants."
+
+    def add_arguments(self, parser):
+        """Add the sizes of meetings and the number of rounds as arguments."""
+        parser.add_argument("--participants", type=int, nargs="+", default=[2, 5, 10, 50, 100, 500],
+                            help="numbers of participants to time")
+        parser.add_argument("--rounds", type=int, default=50, help="number of times each computation is timed")
+        parser.add_argument("--spread", type=float, default=0.05,
+                            help="standard deviation of the positions around the city, in degrees")
+
+    def handle(self, *args, **options):
+        """Run the benchmark for every size of meeting and print the results."""
+        random = numpy.random.RandomState(42)
+        for participants in options["participants"]:
+            latitudes = 46.52 + random.randn(participants) * options["spread"]
+            longitudes = 6.63 + random.randn(participants) * options["spread"]
+
+            for method in (meeting_point.MIDPOINT, meeting_point.MINIMAX, meeting_point.MEDIAN):
+                previous = meeting_point.meeting_point(latitudes, longitudes, method=method)
+
+                def moved(i):
+                    # one participant moved by about 10 meters since the previous point was computed
+                    moved_latitudes = latitudes.copy()
+                    moved_latitudes[i % participants] += 0.0001
+                    return moved_latitudes
+
+                self.report("{} {} cold".format(participants, method), self.measure(
+                    lambda i: meeting_point.meeting_point(moved(i), longitudes, method=method), options["rounds"]
+                ))
+                if method != meeting_point.MIDPOINT:
+                    self.report("{} {} warm".format(participants, method), self.measure(
+                        lambda i: meeting_point.meeting_point(moved(i), longitudes, method=method, start=previous),
+                        options["rounds"]
+                    ))
+
+    @staticmethod
+    def measure(compute, rounds):
+        """
+        Time each call to `compute`.
+
+        :param compute: function computing the meeting point, given the index of the round
+        :param rounds: number of measures to make
+        :return: sorted list of latencies, in milliseconds
+        """
+        latencies = []
+        for i in range(rounds):
+            start = time.perf_counter()
+            compute(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+        return sorted(latencies)
+
+    def report(self, name, latencies):
+        """Print a summary of the given latencies."""
+        self.stdout.write("{:<20} mean={:.3f}ms p50={:.3f}ms p99={:.3f}ms".format(
+            name,
+            statistics.mean(latencies),
+            latencies[len(latencies) // 2],
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        ))
@@ -0,0 +1,129 @@
+"""Benchmark looking for places around a position, with and without the geohash index."""
+
+import statistics
+import time
+
+import numpy
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from meeting import geohash, meeting_point
+from meeting.models import Place
+
+__author__ = "agent <agent@local>"
+
+
+class Command(BaseCommand):
+    """
+    Time `Place.objects.nearby` against a bounding box on the coordinates, which no index helps, on `--places` places.
+
+    Places are spread at random over a region of `--region` degrees around Lausanne, and looked for around random
+    positions of the same region. Everything is created in a transaction which is rolled back at the end, the database
+    is left untouched.
+    """
+
+    help = "Compare looking places up by geohash with scanning their coordinates."
+
+    def add_arguments(self, parser):
+        """Add the size of the benchmark as arguments."""
+        parser.add_argument("--places", type=int, default=1000000, help="number of places to create")
+        parser.add_argument("--region", type=float, default=4, help="size of the region of the places, in degrees")
+        parser.add_argument("--radius", type=float, default=1000, help="distance around positions, in meters")
+        parser.add_argument("--rounds", type=int, default=20, help="number of positions looked around")
+
+    def handle(self, *args, **options):
+        """Create the places, run the benchmark and print the results."""
+        class Rollback(Exception):
+            """Raised to discard the synthetic data."""
+
+        random = numpy.random.RandomState(42)
+        try:
+            with transaction.atomic():
+                start = time.perf_counter()
+                self.create_places(random, options["places"], options["region"])
+                self.stdout.write("created {} places in {:.1f}s".format(
+                    options["places"], time.perf_counter() - start
+                ))
+                self.benchmark(random, options["region"], options["radius"], options["rounds"])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    @staticmethod
+    def create_places(random, count, region, batch_size=10000):
+        """Create `count` places at random in the region."""
+        for offset in range(0, count, batch_size):
+            size = min(batch_size, count - offset)
+            latitudes = numpy.round(46.52 + (random.rand(size) - 0.5) * region, 6)
+            longitudes = numpy.round(6.63 + (random.rand(size) - 0.5) * region, 6)
+            # creating in bulk does not call `save`, the geohashes must be given
+            Place.objects.bulk_create(
+                Place(latitude=latitude, longitude=longitude, geohash=place_geohash)
+                for latitude, longitude, place_geohash in zip(
+                    latitudes, longitudes, geohash.encode_many(latitudes, longitudes)
+                )
+            )
+
+    def benchmark(self, random, region, radius, rounds):
+        """Time both ways of looking places up around random positions, and check that they agree."""
+        positions = [
+            (round(46.52 + (random.rand() - 0.5) * region, 6), round(6.63 + (random.rand() - 0.5) * region, 6))
+            for _ in range(rounds)
+        ]
+
+        def scan(latitude, longitude):
+            # the smallest box of coordinates containing the circle, then the same exact distance
+            height, width = meeting_point.bounding_box(latitude, longitude, radius)
+            places = list(Place.objects.filter(
+                latitude__range=(latitude - height, latitude + height),
+                longitude__range=(longitude - width, longitude + width),
+            ))
+            if not places:
+                return []
+            distances = meeting_point.haversine(
+                latitude, longitude, [place.latitude for place in places], [place.longitude for place in places]
+            )
+            return [places[index] for index in numpy.argsort(distances, kind="mergesort") if distances[index] <= radius]
+
+        def nearby(latitude, longitude):
+            return Place.objects.nearby(latitude, longitude, radius)
+
+        found = {}
+        for name, way in (("bounding box scan", scan), ("geohash index", nearby)):
+            with CaptureQueriesContext(connection) as queries:
+                latencies, found[name] = self.measure(way, positions)
+            self.report(name, latencies, len(queries) / rounds)
+
+        if found["bounding box scan"] != found["geohash index"]:
+            self.stderr.write("the two ways found different places")
+        self.stdout.write("{:.1f} places found on average".format(
+            statistics.mean(len(places) for places in found["geohash index"])
+        ))
+
+    @staticmethod
+    def measure(way, positions):
+        """
+        Time each call to `way`.
+
+        :param way: function looking places up, given a latitude and longitude
+        :param positions: positions around which to look
+        :return: sorted list of latencies, in milliseconds, and the list of ids found around each position
+        """
+        latencies, found = [], []
+        for latitude, longitude in positions:
+            start = time.perf_counter()
+            places = way(latitude, longitude)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append([place.id for place in places])
+        return sorted(latencies), found
+
+    def report(self, name, latencies, queries):
+        """Print a summary of the given latencies, and of the number of queries made per round."""
+        self.stdout.write("{:<20} mean={:.3f}ms p50={:.3f}ms p99={:.3f}ms queries={:.0f}".format(
+            name,
+            statistics.mean(latencies),
+            latencies[len(latencies) // 2],
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            queries,
+        ))
@@ -0,0 +1,145 @@
+"""Benchmark posting positions one by one against posting them in a batch."""
+
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from device.fcm import close_push_service
+from device.models import Device
+from device.stub import FCMStubServer
+from meeting.models import Meeting, Participant
+from meeting.views import PositionsBatchView, PositionsView
+
+__author__ = "agent <agent@local>"
+
+
+class Command(BaseCommand):
+    """
+    Time `--fixes` single position posts against a single batch of `--fixes` positions, through the views.
+
+    Pushes go to a local FCM stand-in. Everything is created in a transaction which is rolled back at the end, the
+    database is left untouched.
+    """
+
+    help = "Compare posting positions one by one with posting them in a single batch."
+
+    def add_arguments(self, parser):
+        """Add the size of the benchmark and the throttling of notifications as arguments."""
+        parser.add_argument("--fixes", type=int, default=100, help="number of positions posted in each round")
+        parser.add_argument("--participants", type=int, default=5, help="number of participants in the meeting")
+        parser.add_argument("--rounds", type=int, default=20, help="number of times each way is timed")
+        parser.add_argument("--throttle-window", type=int, default=0,
+                            help="THROTTLE_WINDOW to use, 0 notifies every position which moved")
+        parser.add_argument("--latency", type=float, default=0, help="milliseconds the FCM stand-in waits to answer")
+
+    def handle(self, *args, **options):
+        """Create a meeting in progress, run the benchmark and print the results."""
+        class Rollback(Exception):
+            """Raised to discard the synthetic data."""
+
+        server = FCMStubServer(latency=options["latency"] / 1000).start()
+        fcm_settings = dict(settings.FCM_SETTINGS, FCM_SERVER_KEY="benchmark", FCM_END_POINT=server.url,
+                            USE_OUTBOX=False, USE_TOPICS=False)
+        position_settings = dict(getattr(settings, "POSITION_SETTINGS", {}),
+                                 THROTTLE_WINDOW=options["throttle_window"], MAX_BATCH_SIZE=options["fixes"])
+
+        try:
+            with override_settings(FCM_SETTINGS=fcm_settings, POSITION_SETTINGS=position_settings), \
+                    transaction.atomic():
+                close_push_service()
+                user = self.create_meeting(options["participants"])
+                self.benchmark(user, options["fixes"], options["rounds"])
+                raise Rollback()
+        except Rollback:
+            pass
+        finally:
+            close_push_service()
+            self.stdout.write("stand-in: {} requests".format(server.requests))
+            server.stop()
+
+    @staticmethod
+    def create_meeting(participants):
+        """
+        Create a meeting in progress, accepted by `participants` users with a device each.
+
+        :return: the user posting positions
+        """
+        get_user_model().objects.bulk_create(
+            get_user_model()(username="benchmark-{}".format(i), email="benchmark-{}@rady.test".format(i))
+            for i in range(participants)
+        )
+        users = list(get_user_model().objects.filter(username__startswith="benchmark-"))
+        Device.objects.bulk_create(Device(user=user, registration_id="benchmark-{}".format(user.id)) for user in users)
+
+        meeting = Meeting.objects.create(organiser=users[0], status=Meeting.STATUS_PROGRESS)
+        Participant.objects.bulk_create(Participant(meeting=meeting, user=user, accepted=True) for user in users)
+        return users[0]
+
+    def benchmark(self, user, fixes, rounds):
+        """Time both ways of posting positions, and the queries they make."""
+        factory = APIRequestFactory()
+        single_view, batch_view = PositionsView.as_view(), PositionsBatchView.as_view()
+
+        def post(view, url, data):
+            request = factory.post(url, data, format="json")
+            force_authenticate(request, user)
+            response = view(request)
+            assert response.status_code == 201, response.data
+
+        def positions(i):
+            # every position is 100m further north than the previous one, so that each of them could be notified
+            now = timezone.now()
+            return [
+                dict(latitude=round((i * fixes + j) * 0.0009 % 80, 6), longitude=0,
+                     time=(now + timedelta(seconds=j)).isoformat())
+                for j in range(fixes)
+            ]
+
+        def single(i):
+            for position in positions(i):
+                post(single_view, "/api/v1/meetings/positions/", dict(latitude=position["latitude"], longitude=0))
+
+        def batch(i):
+            post(batch_view, "/api/v1/meetings/positions/batch/", dict(positions=positions(i)))
+
+        for name, way in (("{} single posts".format(fixes), single), ("1 batch of {}".format(fixes), batch)):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                latencies = self.measure(way, rounds)
+            self.report(name, latencies, len(queries) / rounds)
+
+    @staticmethod
+    def measure(way, rounds):
+        """
+        Time each call to `way`.
+
+        :param way: function posting the positions, given the index of the round
+        :param rounds: number of measures to make
+        :return: sorted list of latencies, in milliseconds
+        """
+        latencies = []
+        for i in range(rounds):
+            start = time.perf_counter()
+            way(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+        return sorted(latencies)
+
+    def report(self, name, latencies, queries):
+        """Print a summary of the given latencies, and of the number of queries made per round."""
+        self.stdout.write("{:<20} mean={:.3f}ms p50={:.3f}ms p99={:.3f}ms queries={:.0f}".format(
+            name,
+            statistics.mean(latencies),
+            latencies[len(latencies) // 2],
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            queries,
+        ))
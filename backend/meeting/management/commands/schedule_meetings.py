@@ -0,0 +1,50 @@
+"""Start and end meetings on time, and notify the positions left pending by throttling."""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from meeting.positions import flush_pending_positions, saved_pushes
+from meeting.scheduler import DEFAULT_BATCH_SIZE, end_stale_meetings, start_due_meetings
+
+__author__ = "agent <agent@local>"
+
+
+class Command(BaseCommand):
+    """
+    Start the pending meetings whose meeting time is reached, and end the stale ones, see `meeting.scheduler`.
+
+    The last positions received within a throttle window are notified once it is over, see `flush_pending_positions`,
+    the polling interval should therefore be shorter than the `THROTTLE_WINDOW` position setting.
+
+    A single scheduler should run at a time on SQLite, several of them wait for each other's batches on PostgreSQL.
+    """
+
+    help = "Start meetings at their meeting time, and end meetings left in progress."
+
+    def add_arguments(self, parser):
+        """Add the batch size, polling interval and one-shot mode as arguments."""
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                            help="number of meetings started or ended at once")
+        parser.add_argument("--interval", type=float, default=5,
+                            help="seconds to wait between polls when no meeting is to be started or ended")
+        parser.add_argument("--once", action="store_true", help="exit once no meeting is to be started or ended")
+
+    def handle(self, *args, **options):
+        """Start and end meetings until interrupted, or until none is left with `--once`."""
+        try:
+            while True:
+                started = start_due_meetings(batch_size=options["batch_size"])
+                ended = end_stale_meetings(batch_size=options["batch_size"])
+                if started or ended:
+                    self.stdout.write("Started {} and ended {} meetings".format(started, ended))
+                notified = flush_pending_positions()
+                if notified:
+                    self.stdout.write("Notified {} pending positions".format(notified))
+                saved_pushes.maybe_flush()
+                if started < options["batch_size"] and ended < options["batch_size"]:
+                    if options["once"]:
+                        return
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
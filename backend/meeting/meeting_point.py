@@ -0,0 +1,204 @@
+"""
+Computation of the point at which participants of a meeting should meet.
+
+Positions are handled as unit vectors on the sphere, all participants at once with NumPy. Three points are offered:
+
+    - MIDPOINT: the geodesic midpoint, the center of mass of the participants brought back on the sphere
+    - MINIMAX: the point minimizing the longest distance any participant has to go
+    - MEDIAN: the geometric median, minimizing the total distance participants have to go, with Weiszfeld's algorithm
+
+The minimax point and the median are found iteratively, and can start from a previous meeting point, in which case they
+only need a few iterations when participants moved a little.
+
+The distances and boxes around points used elsewhere are computed here as well, see `haversine`, `distance` and
+`bounding_box`.
+"""
+
+import math
+
+import numpy
+
+__author__ = "agent <agent@local>"
+
+
+EARTH_RADIUS = 6371008.8
+
+MIDPOINT = "midpoint"
+MINIMAX = "minimax"
+MEDIAN = "median"
+
+# distance, in radians, under which iterations stop, about 1 cm on earth
+TOLERANCE = 1e-9
+
+# iteration at which the minimax search starts from a previous point
+WARM_START_ITERATIONS = 100
+
+
+def to_vectors(latitudes, longitudes):
+    """
+    Convert coordinates to unit vectors.
+
+    :param latitudes: latitudes, in degrees
+    :param longitudes: longitudes, in degrees
+    :return: array of shape (n, 3)
+    """
+    latitudes = numpy.radians(numpy.asarray(latitudes, dtype=float))
+    longitudes = numpy.radians(numpy.asarray(longitudes, dtype=float))
+    return numpy.column_stack((
+        numpy.cos(latitudes) * numpy.cos(longitudes),
+        numpy.cos(latitudes) * numpy.sin(longitudes),
+        numpy.sin(latitudes),
+    ))
+
+
+def to_coordinates(vector):
+    """
+    Convert a vector to coordinates.
+
+    :param vector: vector of shape (3,), which does not need to be normalized
+    :return: the latitude and longitude, in degrees
+    """
+    x, y, z = vector
+    return float(numpy.degrees(numpy.arctan2(z, numpy.hypot(x, y)))), float(numpy.degrees(numpy.arctan2(y, x)))
+
+
+def angles(vector, vectors):
+    """
+    Compute the great-circle distances from a point to several others, with the haversine formula.
+
+    The haversine of the angle between two unit vectors is a quarter of their squared chord length.
+
+    :param vector: unit vector of shape (3,)
+    :param vectors: unit vectors of shape (n, 3)
+    :return: the distances, in radians
+    """
+    chords = numpy.linalg.norm(vectors - vector, axis=1)
+    return 2 * numpy.arcsin(numpy.clip(chords / 2, 0, 1))
+
+
+def haversine(latitude, longitude, latitudes, longitudes):
+    """
+    Compute the great-circle distances from a position to several others.
+
+    :param latitude: latitude of the position, in degrees
+    :param longitude: longitude of the position, in degrees
+    :param latitudes: latitudes of the other positions, in degrees
+    :param longitudes: longitudes of the other positions, in degrees
+    :return: the distances, in meters
+    """
+    return EARTH_RADIUS * angles(to_vectors([latitude], [longitude])[0], to_vectors(latitudes, longitudes))
+
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    """
+    Compute the great-circle distance between two positions, see `haversine`.
+
+    :return: the distance, in meters
+    """
+    return float(haversine(latitude1, longitude1, [latitude2], [longitude2])[0])
+
+
+def bounding_box(latitude, longitude, radius):
+    """
+    Compute the box of coordinates containing the circle around a position.
+
+    :param latitude: latitude of the position, in degrees
+    :param longitude: longitude of the position, in degrees
+    :param radius: radius of the circle, in meters
+    :return: half the height and half the width of the box, in degrees
+    """
+    height = math.degrees(radius / EARTH_RADIUS)
+    widest = math.cos(math.radians(min(90, abs(float(latitude)) + height)))
+    # near the poles, the circle spans every longitude
+    return height, (min(180, height / widest) if widest > 0 else 180)
+
+
+def _normalize(vector, fallback):
+    norm = numpy.linalg.norm(vector)
+    if norm < TOLERANCE:
+        # the points are spread evenly around the globe, any of them is as good
+        return fallback
+    return vector / norm
+
+
+def midpoint(vectors):
+    """
+    Compute the geodesic midpoint of points.
+
+    :param vectors: unit vectors of shape (n, 3)
+    :return: unit vector of the midpoint
+    """
+    return _normalize(vectors.sum(axis=0), vectors[0])
+
+
+def minimax(vectors, start=None, max_iterations=1000):
+    """
+    Approximate the point minimizing the distance to the farthest point, with the Badoiu-Clarkson algorithm.
+
+    The point moves toward the farthest point by a decreasing share of their distance, which gets within 1/k of the
+    optimal radius after k^2 iterations. When starting from a previous point, which should be close, steps start
+    smaller, so that the point does not first move away from it.
+
+    :param vectors: unit vectors of shape (n, 3)
+    :param start: unit vector from which to start, defaults to the midpoint
+    :param max_iterations: maximum number of iterations
+    :return: unit vector of the point
+    """
+    point = midpoint(vectors) if start is None else start
+    first_iteration = 1 if start is None else WARM_START_ITERATIONS
+    for iteration in range(first_iteration, first_iteration + max_iterations):
+        # the farthest point is the one with the smallest dot product, which is cheaper than computing distances
+        farthest = vectors[numpy.argmin(vectors.dot(point))]
+        step = (farthest - point) / (iteration + 1)
+        if numpy.linalg.norm(step) < TOLERANCE:
+            break
+        point = _normalize(point + step, point)
+    return point
+
+
+def median(vectors, start=None, max_iterations=100):
+    """
+    Compute the geometric median of points, with Weiszfeld's algorithm.
+
+    Each iteration moves the point to the average of the points, weighted by the inverse of their distance to it.
+
+    :param vectors: unit vectors of shape (n, 3)
+    :param start: unit vector from which to start, defaults to the midpoint
+    :param max_iterations: maximum number of iterations
+    :return: unit vector of the median
+    """
+    point = midpoint(vectors) if start is None else start
+    for _ in range(max_iterations):
+        distances = angles(point, vectors)
+        if distances.min() < TOLERANCE:
+            # Weiszfeld's iteration is not defined on a point, which may be the median: step away from it
+            distances = numpy.maximum(distances, TOLERANCE)
+        weights = 1 / distances
+        moved = _normalize((vectors * weights[:, numpy.newaxis]).sum(axis=0), point)
+        if numpy.linalg.norm(moved - point) < TOLERANCE:
+            return moved
+        point = moved
+    return point
+
+
+def meeting_point(latitudes, longitudes, method=MEDIAN, start=None):
+    """
+    Compute the point at which participants should meet.
+
+    :param latitudes: latitudes of the participants, in degrees
+    :param longitudes: longitudes of the participants, in degrees
+    :param method: one of `MIDPOINT`, `MINIMAX` or `MEDIAN`
+    :param start: latitude and longitude of a previous meeting point to start from, in degrees
+    :return: the latitude and longitude of the meeting point, in degrees
+    """
+    vectors = to_vectors(latitudes, longitudes)
+    if start is not None:
+        start = to_vectors([start[0]], [start[1]])[0]
+
+    if method == MIDPOINT:
+        return to_coordinates(midpoint(vectors))
+    if method == MINIMAX:
+        return to_coordinates(minimax(vectors, start))
+    if method == MEDIAN:
+        return to_coordinates(median(vectors, start))
+    raise ValueError("Unknown meeting point method: {}".format(method))
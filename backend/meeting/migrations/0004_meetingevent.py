@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 16:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meeting', '0003_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeetingEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(max_length=32)),
+                ('data', jsonfield.fields.JSONField()),
+                ('time', models.DateTimeField(auto_now_add=True)),
+                ('meeting', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='meeting.Meeting')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='meetingevent',
+            index_together=set([('meeting', 'id')]),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 18:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from meeting import geohash
+
+
+def compute_geohashes(apps, schema_editor):
+    Place = apps.get_model("meeting", "Place")
+    places = list(Place.objects.only("latitude", "longitude"))
+    hashes = geohash.encode_many([place.latitude for place in places], [place.longitude for place in places])
+    for place, place_geohash in zip(places, hashes):
+        Place.objects.filter(id=place.id).update(geohash=place_geohash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meeting', '0004_meetingevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='geohash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=9),
+            preserve_default=False,
+        ),
+        migrations.RunPython(compute_geohashes, migrations.RunPython.noop),
+    ]
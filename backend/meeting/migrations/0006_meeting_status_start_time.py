@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 19:02
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meeting', '0005_place_geohash'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='meeting',
+            index_together=set([('status', 'start_time')]),
+        ),
+    ]
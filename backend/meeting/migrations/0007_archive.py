@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 16:31
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('meeting', '0006_meeting_status_start_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMeeting',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('start_time', models.DateTimeField()),
+                ('meeting_time', models.DateTimeField(null=True)),
+                ('end_time', models.DateTimeField(null=True)),
+                ('type', models.CharField(max_length=8)),
+                ('status', models.CharField(max_length=8)),
+                ('on', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('organiser', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedParticipant',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('accepted', models.NullBooleanField(default=None)),
+                ('arrived', models.BooleanField(default=False)),
+                ('meeting', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participant_set', related_query_name='participant', to='meeting.ArchivedMeeting')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedPlace',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('name', models.CharField(max_length=255, null=True)),
+                ('geohash', models.CharField(db_index=True, max_length=9)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='archivedparticipant',
+            name='place',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_query_name='participant', to='meeting.ArchivedPlace'),
+        ),
+        migrations.AddField(
+            model_name='archivedparticipant',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='archivedparticipant',
+            unique_together=set([('user', 'meeting')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedmeeting',
+            index_together=set([('status', 'start_time')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 16:36
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meeting', '0007_archive'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='meeting',
+            index_together=set([('status', 'start_time'), ('status', 'meeting_time')]),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 16:42
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Sum, When
+
+
+def count_participants(apps, schema_editor):
+    Meeting = apps.get_model("meeting", "Meeting")
+
+    def count(**conditions):
+        return Sum(Case(When(then=1, **conditions), default=0, output_field=IntegerField()))
+
+    meetings = Meeting.objects.annotate(
+        all_participants=Count("participant"),
+        accepted=count(participant__accepted=True),
+        refused=count(participant__accepted=False),
+        arrived=count(participant__accepted=True, participant__arrived=True),
+    ).values_list("id", "all_participants", "accepted", "refused", "arrived")
+    for meeting_id, participants, accepted, refused, arrived in meetings:
+        Meeting.objects.filter(id=meeting_id).update(
+            participant_count=participants, accepted_count=accepted or 0, refused_count=refused or 0,
+            arrived_count=arrived or 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meeting', '0008_meeting_status_meeting_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meeting',
+            name='accepted_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='meeting',
+            name='arrived_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='meeting',
+            name='participant_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='meeting',
+            name='refused_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_participants, migrations.RunPython.noop),
+    ]
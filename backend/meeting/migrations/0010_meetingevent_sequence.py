@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 17:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def number_events(apps, schema_editor):
+    MeetingEvent = apps.get_model("meeting", "MeetingEvent")
+
+    events = MeetingEvent.objects.order_by("meeting_id", "id").values_list("id", "meeting_id")
+    last_meeting_id, sequence = None, 0
+    for event_id, meeting_id in events:
+        sequence = sequence + 1 if meeting_id == last_meeting_id else 1
+        last_meeting_id = meeting_id
+        MeetingEvent.objects.filter(id=event_id).update(sequence=sequence)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('meeting', '0009_meeting_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='meetingevent',
+            name='sequence',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(number_events, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='meetingevent',
+            unique_together=set([('meeting', 'sequence')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='meetingevent',
+            index_together=set([]),
+        ),
+    ]
@@ -1,19 +1,126 @@
 """Contains all models from the `meeting` module."""
 
-from django.db import models
+from decimal import Decimal
+
+import numpy
+from django.db import connection, models, transaction
 from django.conf import settings
+from django.utils import timezone
+from jsonfield import JSONField
 from popo_attribute_tracker.attribute_tracker import AttributeTrackerMixin
 
+from device.collector import collect_messages
+from device.models import send_topic_message
+from meeting import geohash, meeting_point
+from meeting.events import get_followers
+
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
 
 
+MICRO_DEGREES = 10 ** 6
+
+
+class PlaceQuerySet(models.QuerySet):
+    """Extends `QuerySet` to query places by their position."""
+
+    def around(self, latitude, longitude, radius):
+        """
+        Filter places which may be within a distance of a point, with the index on their geohash.
+
+        The places returned are in the cells around the point, some of them may be farther, see `nearby`.
+
+        :param latitude: latitude of the point, in degrees
+        :param longitude: longitude of the point, in degrees
+        :param radius: distance around the point, in meters
+        """
+        ranges = geohash.covering_ranges(latitude, longitude, radius)
+        if not ranges:
+            return self
+        query = models.Q()
+        for lowest, highest in ranges:
+            query |= models.Q(geohash__gte=lowest, geohash__lte=highest)
+        return self.filter(query)
+
+    def nearby(self, latitude, longitude, radius):
+        """
+        Get the places within a distance of a point, the closest first.
+
+        Places around the point are read with `around`, their exact distance is then computed all at once.
+
+        :param latitude: latitude of the point, in degrees
+        :param longitude: longitude of the point, in degrees
+        :param radius: distance around the point, in meters
+        :return: list of places, with their `distance` in meters
+        """
+        places = list(self.around(latitude, longitude, radius))
+        if not places:
+            return []
+
+        distances = meeting_point.haversine(
+            latitude, longitude, [place.latitude for place in places], [place.longitude for place in places]
+        )
+        nearby = []
+        for index in numpy.argsort(distances, kind="mergesort"):
+            if distances[index] > radius:
+                break
+            places[index].distance = float(distances[index])
+            nearby.append(places[index])
+        return nearby
+
+
 class Place(models.Model):
-    """Extends `Model` to define places to which meetings can be done."""
+    """
+    Extends `Model` to define places to which meetings can be done.
+
+    Places are indexed by the geohash of their position, which is kept up to date when they are saved.
+    """
 
     # 6 decimals allows for approximately a 10 cm precision, which is below non-military GPS precision
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
     name = models.CharField(max_length=255, null=True)
+    geohash = models.CharField(max_length=geohash.PRECISION, db_index=True, editable=False)
+
+    objects = PlaceQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        """Save the place, along with the geohash of its position."""
+        self.geohash = geohash.encode(self.latitude, self.longitude)
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = set(kwargs["update_fields"]) | {"geohash"}
+        super().save(*args, **kwargs)
+
+
+class MeetingQuerySet(models.QuerySet):
+    """Extends `QuerySet` to query meetings."""
+
+    def with_details(self, user):
+        """
+        Load everything shown about meetings to a user along with them, in a constant number of queries.
+
+        The organiser is joined, and the participants with their user and the participation of the user with its place
+        are prefetched, as `user_participations`, see `MeetingPlaceSerializer`.
+
+        :param user: user to whom the meetings are shown
+        """
+        participants = self.participants()
+        return self.select_related("organiser").prefetch_related(
+            models.Prefetch("participant_set", queryset=participants.select_related("user")),
+            models.Prefetch(
+                "participant_set",
+                queryset=participants.filter(user_id=user.id).select_related("place"),
+                to_attr="user_participations",
+            ),
+        )
+
+    @staticmethod
+    def participants():
+        """Get the QuerySet of the participants of the meetings."""
+        return Participant.objects
+
+    def everybody_arrived(self):
+        """Get the meetings whose participants all arrived, or refused them, from their counters alone."""
+        return self.filter(participant_count=models.F("refused_count") + models.F("arrived_count"))
 
 
 class Meeting(models.Model, AttributeTrackerMixin):
@@ -51,7 +158,84 @@ class Meeting(models.Model, AttributeTrackerMixin):
 
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, through="Participant")
 
+    # counters of the participants, of those who accepted the meeting, refused it, and accepted it and arrived, kept up
+    # to date by `post_save_participant`
+    participant_count = models.PositiveIntegerField(default=0)
+    accepted_count = models.PositiveIntegerField(default=0)
+    refused_count = models.PositiveIntegerField(default=0)
+    arrived_count = models.PositiveIntegerField(default=0)
+
+    objects = MeetingQuerySet.as_manager()
+
     TRACKED_ATTRS = ("status",)
+    COUNTERS = ("participant_count", "accepted_count", "refused_count", "arrived_count")
+
+    class Meta:
+        """Metaclass for the `Meeting` model."""
+
+        # meetings of users are listed by status and start time, see `MeetingListView`, and meetings are started and
+        # ended by status and meeting time, see `meeting.scheduler`
+        index_together = [("status", "start_time"), ("status", "meeting_time")]
+
+    def save(self, *args, **kwargs):
+        """Save the meeting, except its counters when it already exists, which this instance may hold outdated."""
+        if self.pk is not None and not kwargs.get("force_insert") and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTERS
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def topic(self):
+        """Get the name of the FCM topic to which accepted participants are subscribed, when using topics."""
+        return "meeting-{}".format(self.id)
+
+    def log_event(self, data):
+        """
+        Log an event of the meeting, for the participants following them, see `meeting.events`.
+
+        The meeting stays locked until the end of the transaction, events of a meeting are thus committed in the order
+        of their sequence number, and followers resuming after the last event they received never skip one. Ids, which
+        concurrent transactions may commit out of order, do not give this guarantee.
+
+        :param data: the Json object describing the event, with its "type"
+        """
+        with transaction.atomic(savepoint=False):
+            list(Meeting.objects.select_for_update().filter(id=self.id).values_list("id", flat=True))
+            last = MeetingEvent.objects\
+                .filter(meeting_id=self.id)\
+                .order_by("-sequence")\
+                .values_list("sequence", flat=True)\
+                .first()
+            MeetingEvent.objects.create(meeting=self, sequence=(last or 0) + 1, type=data["type"], data=data)
+
+    def send_message(self, participants, title=None, body=None, data=None):
+        """
+        Send a push message about the meeting to its participants, without deferring it.
+
+        The message is logged as an event of the meeting, and is not pushed to participants following the events.
+
+        When `USE_TOPICS` is set in `FCM_SETTINGS`, the message is published once to the meeting topic instead, to which
+        accepted participants are subscribed. The participant at the origin of the message then receives it as well, and
+        has to ignore it, as do participants following the events. Only the participants who did not answer yet, who
+        are not subscribed, are still sent the message directly.
+
+        :param participants: QuerySet of users to which to send the message
+        :param title: the title of the message
+        :param body: the body of the message
+        :param data: a Json object attached to the message
+        """
+        self.log_event(data)
+
+        if settings.FCM_SETTINGS.get("USE_TOPICS", False):
+            send_topic_message(self.topic, title=title, body=body, data=data)
+            participants = participants.filter(participant__meeting_id=self.id, participant__accepted__isnull=True)
+
+        followers = get_followers(self.id)
+        if followers:
+            participants = participants.exclude(id__in=followers)
+        participants.send_message(title=title, body=body, data=data, deferred=False)
 
 
 class Participant(models.Model, AttributeTrackerMixin):
@@ -74,3 +258,205 @@ class Participant(models.Model, AttributeTrackerMixin):
         """Metaclass for the `Participant` model."""
 
         unique_together = ("user", "meeting")
+
+    def save(self, *args, **kwargs):
+        """
+        Save the participant, with his row locked until his meeting is updated accordingly.
+
+        This instance may have been loaded before another one of the same participant was saved, its tracker is thus
+        first reset to the state stored in the database, and the tracked fields which are not saved are refreshed. The
+        changes are then those really made by this save, concurrent saves of the same change count and notify it once,
+        see `meeting.signals.post_save_participant`.
+
+        The messages sent about the change are collected and only sent once the transaction is committed, see
+        `device.collector`, no request to FCM is thus made with the rows locked, and a failure to send them does not
+        roll the change back.
+        """
+        with collect_messages():
+            if self.pk is not None:
+                stored = Participant.objects.select_for_update().filter(pk=self.pk).values(*self.TRACKED_ATTRS).first()
+                if stored is not None:
+                    update_fields = kwargs.get("update_fields")
+                    for attr, value in stored.items():
+                        if update_fields is not None and attr not in update_fields:
+                            setattr(self, attr, value)
+                    self._original_attrs = stored
+            super().save(*args, **kwargs)
+
+    @staticmethod
+    def counts(accepted, arrived):
+        """
+        Get how much a participant in a given state adds to the counters of his meeting.
+
+        :param accepted: whether the participant accepted the meeting, None if he did not answer yet
+        :param arrived: whether the participant arrived
+        :return: dict of the counters of `Meeting` to which the participant adds one
+        """
+        return dict(
+            accepted_count=int(accepted is True),
+            refused_count=int(accepted is False),
+            arrived_count=int(accepted is True and arrived is True),
+        )
+
+
+class MeetingEvent(models.Model):
+    """
+    Extends `Model` to log the events of meetings, which participants can follow, see `meeting.events`.
+
+    Events are only ever appended, their sequence number gives their order within their meeting, see
+    `Meeting.log_event`.
+    """
+
+    # the (meeting, sequence) index already allows to look events up by meeting
+    meeting = models.ForeignKey(Meeting, db_index=False)
+    sequence = models.PositiveIntegerField()
+    type = models.CharField(max_length=32)
+    data = JSONField()
+    time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        """Metaclass for the `MeetingEvent` model."""
+
+        unique_together = [("meeting", "sequence")]
+
+
+class PositionQuerySet(models.QuerySet):
+    """Extends `QuerySet` to query positions of participants."""
+
+    def latest_per_participant(self, meeting_id):
+        """
+        Get the last position of every participant of a meeting, in a single query.
+
+        The last position of each participant is found with the (meeting, user, time) index, reading a single entry of
+        it, however many positions were kept.
+
+        :param meeting_id: id of the meeting
+        """
+        quote = connection.ops.quote_name
+        return self.filter(meeting_id=meeting_id).extra(where=[
+            "{position}.{id} IN ("
+            "SELECT (SELECT latest.{id} FROM {position} latest "
+            "WHERE latest.{meeting} = participant.{meeting} AND latest.{user} = participant.{user} "
+            "ORDER BY latest.{time} DESC, latest.{id} DESC LIMIT 1) "
+            "FROM {participant} participant WHERE participant.{meeting} = %s)".format(
+                position=quote(Position._meta.db_table), participant=quote(Participant._meta.db_table),
+                id=quote("id"), meeting=quote("meeting_id"), user=quote("user_id"), time=quote("time"),
+            )
+        ], params=[meeting_id])
+
+
+class Position(models.Model):
+    """
+    Extends `Model` to keep the positions of participants during meetings in progress.
+
+    Positions are only ever appended. Coordinates are kept as integer micro-degrees, which is the precision of `Place`,
+    to keep rows small.
+    """
+
+    # the (meeting, user, time) index already allows to look positions up by meeting
+    meeting = models.ForeignKey(Meeting, db_index=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL)
+    latitude = models.IntegerField()
+    longitude = models.IntegerField()
+    time = models.DateTimeField(default=timezone.now)
+
+    objects = PositionQuerySet.as_manager()
+
+    class Meta:
+        """Metaclass for the `Position` model."""
+
+        index_together = [("meeting", "user", "time")]
+
+    @classmethod
+    def from_degrees(cls, latitude, longitude, **kwargs):
+        """
+        Create a new position from coordinates in degrees.
+
+        :param latitude: latitude of the position, in degrees
+        :param longitude: longitude of the position, in degrees
+        :param kwargs: other fields of the position
+        """
+        return cls(
+            latitude=int(round(latitude * MICRO_DEGREES)), longitude=int(round(longitude * MICRO_DEGREES)), **kwargs
+        )
+
+    @property
+    def latitude_degrees(self):
+        """Get the latitude of the position, in degrees."""
+        return Decimal(self.latitude).scaleb(-6)
+
+    @property
+    def longitude_degrees(self):
+        """Get the longitude of the position, in degrees."""
+        return Decimal(self.longitude).scaleb(-6)
+
+
+class ArchivedMeetingQuerySet(MeetingQuerySet):
+    """Extends `MeetingQuerySet` to query archived meetings."""
+
+    @staticmethod
+    def participants():
+        """Get the QuerySet of the participants of the archived meetings."""
+        return ArchivedParticipant.objects
+
+
+class ArchivedPlace(models.Model):
+    """
+    Extends `Model` to keep the places of archived meetings, see `meeting.archive`.
+
+    Archived rows keep the id they had, and are read as their `Place`.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    name = models.CharField(max_length=255, null=True)
+    geohash = models.CharField(max_length=geohash.PRECISION, db_index=True)
+
+    objects = PlaceQuerySet.as_manager()
+
+
+class ArchivedMeeting(models.Model):
+    """
+    Extends `Model` to keep meetings which ended or were canceled long ago, see `meeting.archive`.
+
+    Archived rows keep the id they had, and are read as their `Meeting`.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    start_time = models.DateTimeField()
+    meeting_time = models.DateTimeField(null=True)
+    end_time = models.DateTimeField(null=True)
+    type = models.CharField(max_length=8)
+    status = models.CharField(max_length=8)
+
+    organiser = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+")
+    on = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, related_name="+")
+
+    objects = ArchivedMeetingQuerySet.as_manager()
+
+    class Meta:
+        """Metaclass for the `ArchivedMeeting` model."""
+
+        index_together = [("status", "start_time")]
+
+
+class ArchivedParticipant(models.Model):
+    """
+    Extends `Model` to keep the participants of archived meetings, see `meeting.archive`.
+
+    Archived rows keep the id they had, and are read as their `Participant`.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="+")
+    meeting = models.ForeignKey(ArchivedMeeting, related_name="participant_set", related_query_name="participant")
+
+    accepted = models.NullBooleanField(default=None)
+    arrived = models.BooleanField(default=False)
+    place = models.ForeignKey(ArchivedPlace, null=True, related_query_name="participant")
+
+    class Meta:
+        """Metaclass for the `ArchivedParticipant` model."""
+
+        unique_together = ("user", "meeting")
@@ -0,0 +1,133 @@
+"""Pagination of meetings."""
+
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+__author__ = "agent <agent@local>"
+
+
+class MeetingCursorPagination(BasePagination):
+    """
+    Keyset pagination of meetings, the most recently started first.
+
+    Pages are only returned when the client asks for them, with `page_size` or `cursor`, otherwise every meeting is
+    returned at once, as before pages existed. A page is:
+
+        {
+            "next": "https://.../meetings/?cursor=...",  (the link to the next page, null on the last one)
+            "results": [...],  (the meetings of the page)
+        }
+
+    The cursor is the start time and id of the last meeting of the page, the next page is read from there with the
+    (status, start_time) index, however many meetings come before.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 20
+    max_page_size = 100
+    ordering = ("-start_time", "-id")
+
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Get the page of meetings asked for, if any.
+
+        :param queryset: QuerySet of the meetings to paginate
+        :param request: the request made
+        :param view: the view listing the meetings
+        :return: the list of meetings of the page, None if no page was asked for
+        """
+        return self.paginate_querysets([queryset], request)
+
+    def paginate_querysets(self, querysets, request):
+        """
+        Get the page of meetings asked for among several sources of meetings, such as hot and archived meetings.
+
+        A page is read from each source after the cursor, and they are merged.
+
+        :param querysets: QuerySets of the meetings to paginate, which do not overlap
+        :param request: the request made
+        :return: the list of meetings of the page, None if no page was asked for
+        """
+        if self.cursor_query_param not in request.query_params and \
+                self.page_size_query_param not in request.query_params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        results = []
+        for queryset in querysets:
+            queryset = queryset.order_by(*self.ordering)
+            if cursor is not None:
+                start_time, meeting_id = cursor
+                queryset = queryset.filter(Q(start_time__lt=start_time) | Q(start_time=start_time, id__lt=meeting_id))
+            # one more meeting tells whether there is a next page
+            results.extend(queryset[:self.page_size + 1])
+
+        results.sort(key=self.position, reverse=True)
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        return self.page
+
+    @staticmethod
+    def position(meeting):
+        """Get the position of a meeting in the order of the pages."""
+        return meeting.start_time, meeting.id
+
+    def get_page_size(self, request):
+        """Get the page size asked for, within `max_page_size`."""
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        """
+        Get the position given by the cursor of the request.
+
+        :return: the start time and id of the last meeting of the previous page, None if there is no cursor
+        :raise NotFound: if the cursor is invalid
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            start_time, meeting_id = base64.urlsafe_b64decode(encoded.encode("ascii")).decode("ascii").split("|")
+            start_time, meeting_id = parse_datetime(start_time), int(meeting_id)
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if start_time is None:
+            raise NotFound(self.invalid_cursor_message)
+        return start_time, meeting_id
+
+    @staticmethod
+    def encode_cursor(meeting):
+        """Get the cursor of the page following a meeting."""
+        position = "{}|{}".format(meeting.start_time.isoformat(), meeting.id)
+        return base64.urlsafe_b64encode(position.encode("ascii")).decode("ascii")
+
+    def get_next_link(self):
+        """Get the link to the next page, None if this is the last one."""
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        """Wrap the meetings of the page with the link to the next one."""
+        return Response(OrderedDict((("next", self.get_next_link()), ("results", data))))
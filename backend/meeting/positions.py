@@ -0,0 +1,492 @@
+"""
+Utilities to handle the positions sent by participants of meetings.
+
+Positions are sent often by devices, notifying other participants of each of them would flood them with pushes.
+Notifications are therefore throttled per meeting and per sender, according to the `POSITION_SETTINGS` setting:
+
+    - THROTTLE_WINDOW: minimum number of seconds between two notifications for the same sender in a meeting. The
+      positions received meanwhile are coalesced in the next notification, which is sent once the window is over even
+      if the sender stopped moving, see `flush_pending_positions`
+    - MIN_DISTANCE: minimum distance in meters the sender must have moved since the last notification
+    - MAX_BATCH_SIZE: maximum number of positions a device can send at once
+    - STATS_FLUSH_INTERVAL: minimum number of seconds between two writes of the number of pushes saved, which are
+      counted in memory meanwhile, see `SavedPushes`
+
+The state is kept in the default cache, which must be shared by all processes.
+
+The latest position of each participant of a meeting in progress is kept in the cache as well. Their version is the id
+of the last position stored for the meeting, which only grows, and is all that reading positions, see
+`get_latest_positions`, reads from the database. The cache is filled from the database when it is cold, and its entries
+expire after `CACHE_TIMEOUT` seconds, another key of `POSITION_SETTINGS`, or when the meeting is over, see
+`evict_positions`.
+
+Meetings of type "shortest" have their place moved to the meeting point of the accepted participants as their positions
+arrive, see `update_meeting_point`. `MEETING_POINT`, another key of `POSITION_SETTINGS`, is the kind of point computed,
+one of those of `meeting.meeting_point`, and defaults to the geometric median.
+
+Participants are marked as arrived as soon as one of their positions is within `ARRIVAL_RADIUS` meters, another key of
+`POSITION_SETTINGS`, of where they go, see `detect_arrival`. 0 leaves it to participants to tell when they arrived.
+"""
+
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+import numpy
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Max, Q
+from django.http import Http404
+from django.utils import timezone
+
+from meeting import meeting_point
+from meeting.models import Meeting, Participant, Place, Position
+from stats.models import SavedPushesInDay
+
+__author__ = "agent <agent@local>"
+
+
+DEFAULT_THROTTLE_WINDOW = 15
+DEFAULT_MIN_DISTANCE = 10
+DEFAULT_MAX_BATCH_SIZE = 500
+DEFAULT_CACHE_TIMEOUT = 24 * 60 * 60
+DEFAULT_MEETING_POINT = meeting_point.MEDIAN
+DEFAULT_ARRIVAL_RADIUS = 50
+DEFAULT_STATS_FLUSH_INTERVAL = 60
+
+NOTIFY = "notify"
+THROTTLED = "throttled"
+STATIONARY = "stationary"
+
+
+class SavedPushes:
+    """Number of pushes saved by the current process, which are not yet in `stats.SavedPushesInDay`."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.last_flush = time.monotonic()
+
+    def record(self, reason, pushes):
+        """
+        Count pushes which were not sent.
+
+        :param reason: why pushes were not sent, either `THROTTLED` or `STATIONARY`
+        :param pushes: number of pushes saved
+        """
+        with self.lock:
+            self.counts[(timezone.now().date(), reason)] += pushes
+
+    def flush(self):
+        """Add the pushes saved since the last flush to the database."""
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            self.last_flush = time.monotonic()
+
+        for (day, reason), pushes in counts.items():
+            if pushes:
+                SavedPushesInDay.record(reason, pushes, day=day)
+
+    def maybe_flush(self):
+        """Flush the counts if `STATS_FLUSH_INTERVAL` elapsed since the last flush and no transaction is running."""
+        interval = getattr(settings, "POSITION_SETTINGS", {}).get("STATS_FLUSH_INTERVAL", DEFAULT_STATS_FLUSH_INTERVAL)
+        if time.monotonic() - self.last_flush >= interval and not connection.in_atomic_block:
+            self.flush()
+
+
+saved_pushes = SavedPushes()
+
+
+def _notified_key(meeting_id, user_id):
+    return "position-notified:{}:{}".format(meeting_id, user_id)
+
+
+def _window_key(meeting_id, user_id):
+    return "position-window:{}:{}".format(meeting_id, user_id)
+
+
+def _pending_key(meeting_id, user_id):
+    return "position-pending:{}:{}".format(meeting_id, user_id)
+
+
+def check_position_notification(meeting_id, user_id, latitude, longitude):
+    """
+    Check whether other participants of the meeting should be notified of a new position of a user.
+
+    When they should, the position is recorded as the last one notified and a new throttle window begins. When the
+    position is throttled, it is kept as pending, to be notified once the window is over, unless a newer position
+    replaces it meanwhile.
+
+    :param meeting_id: id of the meeting in which the user is
+    :param user_id: id of the user who sent the position
+    :param latitude: latitude of the new position
+    :param longitude: longitude of the new position
+    :return: `NOTIFY` if the position must be notified, otherwise the reason why not, `THROTTLED` or `STATIONARY`
+    """
+    position_settings = getattr(settings, "POSITION_SETTINGS", {})
+    window = position_settings.get("THROTTLE_WINDOW", DEFAULT_THROTTLE_WINDOW)
+    min_distance = position_settings.get("MIN_DISTANCE", DEFAULT_MIN_DISTANCE)
+
+    position_key = _notified_key(meeting_id, user_id)
+    pending_key = _pending_key(meeting_id, user_id)
+
+    last_position = cache.get(position_key)
+    if last_position is not None and meeting_point.distance(*last_position, latitude, longitude) < min_distance:
+        # the participants already know where the user is, any pending position is outdated
+        cache.delete(pending_key)
+        return STATIONARY
+
+    # adding is atomic, only a single request can open the window
+    if window and not cache.add(_window_key(meeting_id, user_id), True, window):
+        cache.set(pending_key, (float(latitude), float(longitude)), _cache_timeout())
+        return THROTTLED
+
+    cache.set(position_key, (float(latitude), float(longitude)), _cache_timeout())
+    cache.delete(pending_key)
+    return NOTIFY
+
+
+def flush_pending_positions():
+    """
+    Notify the pending positions of the participants of meetings in progress whose throttle window is over.
+
+    Positions are only sent as they arrive, the last position of a sender who stopped sending positions within a window
+    would otherwise never be notified. This is run regularly by the `schedule_meetings` management command.
+
+    :return: the number of positions notified
+    """
+    window = getattr(settings, "POSITION_SETTINGS", {}).get("THROTTLE_WINDOW", DEFAULT_THROTTLE_WINDOW)
+    participants = list(
+        Participant.objects
+        .filter(accepted=True, meeting__status=Meeting.STATUS_PROGRESS)
+        .values_list("meeting_id", "user_id")
+    )
+    pending = cache.get_many([_pending_key(meeting_id, user_id) for meeting_id, user_id in participants])
+    if not pending:
+        return 0
+
+    meetings = Meeting.objects.in_bulk({meeting_id for meeting_id, user_id in participants})
+    users = get_user_model().objects.in_bulk({user_id for meeting_id, user_id in participants})
+
+    notified = 0
+    for meeting_id, user_id in participants:
+        if _pending_key(meeting_id, user_id) not in pending:
+            continue
+        # a position received meanwhile may have opened a new window, and be notified already
+        if window and not cache.add(_window_key(meeting_id, user_id), True, window):
+            continue
+
+        position = cache.get(_pending_key(meeting_id, user_id))
+        cache.delete(_pending_key(meeting_id, user_id))
+        if position is None:
+            continue
+        cache.set(_notified_key(meeting_id, user_id), position, _cache_timeout())
+        notify_position(meetings[meeting_id], users[user_id])
+        notified += 1
+
+    return notified
+
+
+def _participants_key(meeting_id):
+    return "position-participants:{}".format(meeting_id)
+
+
+def _latest_key(meeting_id, user_id):
+    return "position-latest:{}:{}".format(meeting_id, user_id)
+
+
+def _cache_timeout():
+    return getattr(settings, "POSITION_SETTINGS", {}).get("CACHE_TIMEOUT", DEFAULT_CACHE_TIMEOUT)
+
+
+def cache_latest_position(meeting_id, user_id, position):
+    """
+    Keep the latest position of a participant of a meeting in progress in the cache.
+
+    This must be done before the position is stored, so that readers who see the version it gives to the positions of
+    the meeting, see `get_positions_version`, find it in the cache.
+
+    :param meeting_id: id of the meeting
+    :param user_id: id of the participant
+    :param position: dict with the latitude, longitude and time of the position
+    """
+    latest = Position.from_degrees(position["latitude"], position["longitude"])
+    cache.set(_latest_key(meeting_id, user_id), (latest.latitude, latest.longitude, position["time"]), _cache_timeout())
+
+
+def get_positions_version(meeting_id):
+    """
+    Get the version of the positions of a meeting, which changes every time a participant moves.
+
+    This is the id of the last position stored for the meeting. Ids are given by the database, the version thus never
+    goes back and concurrent changes never get the same one.
+
+    :param meeting_id: id of the meeting
+    :return: the version, 0 if there are no positions yet
+    """
+    return Position.objects.filter(meeting_id=meeting_id).aggregate(version=Max("id"))["version"] or 0
+
+
+def get_latest_positions(meeting_id, user_id):
+    """
+    Get the latest position of every participant of a meeting, as seen by one of them.
+
+    Positions of meetings in progress are read from the cache, which is filled from the database when cold, and their
+    version from the database, see `get_positions_version`. Positions of other meetings are read from the database,
+    and have no version.
+
+    :param meeting_id: id of the meeting
+    :param user_id: id of the user reading the positions
+    :return: the version of the positions, and the list of positions, ordered by participant
+    :raise Http404: if the user does not participate in the meeting
+    """
+    participants = cache.get(_participants_key(meeting_id))
+
+    if participants is None:
+        meeting = Meeting.objects.filter(id=meeting_id, participant__user_id=user_id).first()
+        if meeting is None:
+            raise Http404()
+
+        positions = list(Position.objects.latest_per_participant(meeting_id).order_by("user_id"))
+        if meeting.status != Meeting.STATUS_PROGRESS:
+            return None, positions
+
+        version = get_positions_version(meeting_id)
+        # adding never replaces what a concurrent request already put in the cache, which may be more recent
+        timeout = _cache_timeout()
+        for position in positions:
+            cache.add(_latest_key(meeting_id, position.user_id),
+                      (position.latitude, position.longitude, position.time), timeout)
+        cache.add(_participants_key(meeting_id), set(meeting.participant_set.values_list("user_id", flat=True)),
+                  timeout)
+        return version, positions
+
+    if user_id not in participants:
+        raise Http404()
+
+    # the version is read first, the positions it covers are in the cache already
+    version = get_positions_version(meeting_id)
+    latest = cache.get_many([_latest_key(meeting_id, participant) for participant in participants])
+
+    positions = []
+    for participant in sorted(participants):
+        if _latest_key(meeting_id, participant) in latest:
+            latitude, longitude, position_time = latest[_latest_key(meeting_id, participant)]
+            positions.append(Position(
+                meeting_id=meeting_id, user_id=participant, latitude=latitude, longitude=longitude, time=position_time
+            ))
+    return version, positions
+
+
+def evict_positions(meeting):
+    """
+    Remove the positions of a meeting which is over from the cache.
+
+    :param meeting: meeting which ended or was canceled
+    """
+    user_ids = list(meeting.participant_set.values_list("user_id", flat=True))
+    cache.delete_many(
+        [_participants_key(meeting.id)] +
+        [_latest_key(meeting.id, user_id) for user_id in user_ids] +
+        [_pending_key(meeting.id, user_id) for user_id in user_ids] +
+        [_notified_key(meeting.id, user_id) for user_id in user_ids]
+    )
+
+
+def update_meeting_point(meeting):
+    """
+    Move the place of a meeting to the meeting point of the latest positions of its accepted participants.
+
+    The point is computed starting from the current place, which takes few iterations when participants moved a little,
+    and the place is only saved when it moved by at least `MIN_DISTANCE`. Participants are notified through the events
+    of the meeting.
+
+    :param meeting: meeting of type "shortest" in progress
+    :return: the place of the meeting, None if no participant sent a position yet
+    """
+    position_settings = getattr(settings, "POSITION_SETTINGS", {})
+
+    positions = list(
+        Position.objects.latest_per_participant(meeting.id)
+        .filter(user_id__in=Participant.objects.filter(meeting_id=meeting.id, accepted=True).values("user_id"))
+    )
+    if not positions:
+        return None
+
+    place = Place.objects.filter(participant__meeting_id=meeting.id).first()
+    latitude, longitude = meeting_point.meeting_point(
+        [position.latitude_degrees for position in positions],
+        [position.longitude_degrees for position in positions],
+        method=position_settings.get("MEETING_POINT", DEFAULT_MEETING_POINT),
+        start=None if place is None else (float(place.latitude), float(place.longitude)),
+    )
+
+    if place is not None and meeting_point.distance(place.latitude, place.longitude, latitude, longitude) < \
+            position_settings.get("MIN_DISTANCE", DEFAULT_MIN_DISTANCE):
+        return place
+
+    latitude, longitude = round(Decimal(latitude), 6), round(Decimal(longitude), 6)
+    if place is None:
+        place = Place.objects.create(latitude=latitude, longitude=longitude)
+        Participant.objects.filter(meeting_id=meeting.id).update(place=place)
+    else:
+        place.latitude, place.longitude = latitude, longitude
+        place.save(update_fields=["latitude", "longitude"])
+
+    meeting.log_event(dict(
+        type="meeting-point-update", meeting=meeting.id, latitude=str(latitude), longitude=str(longitude)
+    ))
+    return place
+
+
+def get_destination(participant):
+    """
+    Get where a participant of a meeting in progress goes.
+
+    This is the place of the meeting, or the latest position of the user met in meetings of type "person".
+
+    :param participant: the participant, with his meeting and place
+    :return: the latitude and longitude of the destination, in degrees, None if it is unknown
+    """
+    meeting = participant.meeting
+    if meeting.type != Meeting.TYPE_PERSON:
+        if participant.place is None:
+            return None
+        return participant.place.latitude, participant.place.longitude
+
+    if meeting.on_id is None or meeting.on_id == participant.user_id:
+        return None
+    latest = cache.get(_latest_key(meeting.id, meeting.on_id))
+    if latest is None:
+        latest = Position.objects\
+            .filter(meeting_id=meeting.id, user_id=meeting.on_id)\
+            .order_by("-time", "-id")\
+            .values_list("latitude", "longitude")\
+            .first()
+        if latest is None:
+            return None
+    return Decimal(latest[0]).scaleb(-6), Decimal(latest[1]).scaleb(-6)
+
+
+def is_within(latitude, longitude, radius, positions):
+    """
+    Check whether any of several positions is within a distance of a point.
+
+    Positions outside the bounding box of the circle around the point are discarded at once, the exact distance is only
+    computed for the others, all at once.
+
+    :param latitude: latitude of the point, in degrees
+    :param longitude: longitude of the point, in degrees
+    :param radius: the distance, in meters
+    :param positions: list of dicts with the latitude and longitude of each position
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    height, width = meeting_point.bounding_box(latitude, longitude, radius)
+
+    latitudes = numpy.array([float(position["latitude"]) for position in positions])
+    longitudes = numpy.array([float(position["longitude"]) for position in positions])
+    # differences of longitudes wrap around the antimeridian
+    inside = (numpy.abs(latitudes - latitude) <= height) & \
+        (numpy.abs((longitudes - longitude + 180) % 360 - 180) <= width)
+    if not inside.any():
+        return False
+
+    return bool((meeting_point.haversine(latitude, longitude, latitudes[inside], longitudes[inside]) <= radius).any())
+
+
+def detect_arrival(participant, positions):
+    """
+    Mark a participant as arrived if one of his new positions is close enough to his destination.
+
+    He is then saved as if he had told it himself, other participants are notified and the meeting ends if everybody
+    arrived, see `post_save_participant`.
+
+    :param participant: accepted participant of a meeting in progress, with his meeting and place
+    :param positions: list of dicts with the latitude and longitude of each new position
+    :return: whether the participant arrived
+    """
+    radius = getattr(settings, "POSITION_SETTINGS", {}).get("ARRIVAL_RADIUS", DEFAULT_ARRIVAL_RADIUS)
+    if participant.arrived or not radius:
+        return False
+
+    destination = get_destination(participant)
+    if destination is None or not is_within(*destination, radius, positions):
+        return False
+
+    participant.arrived = True
+    participant.save(update_fields=("arrived",))
+    return True
+
+
+def notify_position(meeting, user):
+    """
+    Notify the other accepted participants of a meeting that a user moved.
+
+    Meetings of type "shortest" first get a new meeting point, see `update_meeting_point`.
+
+    :param meeting: meeting in progress
+    :param user: user who moved
+    :return: the place of the meeting for meetings of type "shortest", None for others
+    """
+    place = None
+    if meeting.type == Meeting.TYPE_SHORTEST:
+        place = update_meeting_point(meeting)
+
+    meeting.send_message(
+        get_user_model().objects
+        .filter(Q(participant__meeting_id=meeting.id) & Q(participant__accepted=True))
+        .filter(~Q(id=user.id)),
+        title="New position",
+        body="{} position changed".format(user.username),
+        data=dict(type="user-position-update", meeting=meeting.id, participant=user.id),
+    )
+    return place
+
+
+def record_positions(user, positions):
+    """
+    Keep new positions of a user, and notify the other participants of the meetings in progress he is in.
+
+    The last position is first kept in the cache, see `cache_latest_position`, then the positions are kept for each
+    meeting in progress the user accepted, in a single insert. Each meeting then gets at most one notification, about
+    the last position, subject to throttling (see `check_position_notification` and `notify_position`). Pushes which
+    were not sent are counted, see `SavedPushes`. Finally, the user is marked as arrived in the meetings he reached, see
+    `detect_arrival`.
+
+    :param user: user who sent the positions
+    :param positions: list of dicts with the latitude, longitude and time of each position, ordered by time
+    """
+    participants = list(Participant.objects
+                        .filter(user_id=user.id, accepted=True, meeting__status=Meeting.STATUS_PROGRESS)
+                        .select_related("meeting", "place"))
+    meetings = [participant.meeting for participant in participants]
+    last_position = positions[-1]
+    for meeting in meetings:
+        cache_latest_position(meeting.id, user.id, last_position)
+
+    Position.objects.bulk_create(
+        Position.from_degrees(position["latitude"], position["longitude"], time=position["time"],
+                              meeting=meeting, user=user)
+        for meeting in meetings
+        for position in positions
+    )
+
+    for participant in participants:
+        meeting = participant.meeting
+        notification = check_position_notification(
+            meeting.id, user.id, last_position["latitude"], last_position["longitude"]
+        )
+        if notification != NOTIFY:
+            # the other accepted participants, who are counted on the meeting
+            saved_pushes.record(notification, meeting.accepted_count - 1)
+        else:
+            place = notify_position(meeting, user)
+            if place is not None:
+                participant.place = place
+
+        detect_arrival(participant, positions)
+
+    saved_pushes.maybe_flush()
@@ -0,0 +1,42 @@
+"""This module defines renderers for the `meeting` application."""
+
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+__author__ = "agent <agent@local>"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Renders meeting events as a server-sent events stream.
+
+    The stream ends with the response, clients such as `EventSource` then reconnect after `retry` milliseconds, giving
+    the id of the last event received in the Last-Event-ID header. Other data, such as errors, is sent as an "error"
+    event.
+    """
+
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+    retry = 1000
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Render the list of serialized events as a stream.
+
+        :param data: list of serialized events, or any other data to send as an error
+        :param accepted_media_type: media type accepted by the client
+        :param renderer_context: context of the view
+        :return: the stream, encoded
+        """
+        chunks = ["retry: {}\n".format(self.retry)]
+        if isinstance(data, list):
+            chunks.extend(
+                "id: {}\nevent: {}\ndata: {}\n".format(event["id"], event["type"], json.dumps(event, cls=JSONEncoder))
+                for event in data
+            )
+        elif data is not None:
+            chunks.append("event: error\ndata: {}\n".format(json.dumps(data, cls=JSONEncoder)))
+        return "\n".join(chunks).encode(self.charset) + b"\n"
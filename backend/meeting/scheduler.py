@@ -0,0 +1,104 @@
+"""
+Scheduling of the lifecycle of meetings.
+
+Pending meetings are started once their meeting time is reached, and meetings left in progress are ended once they
+should long be over, as their organiser would do. This is configured by the `SCHEDULER_SETTINGS` setting:
+
+    - MAX_DURATION: number of seconds after which a meeting in progress is ended, counted from its meeting time, or from
+      its creation when it has none
+
+Meetings are found with the (status, meeting_time) and (status, start_time) indexes, and the status of a whole batch
+is changed in a single query. Participants are then notified as when the status of a meeting is saved, see
+`notify_status`, the messages of a batch being sent once it is committed, see `device.collector`.
+
+The `schedule_meetings` management command runs the scheduler.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from device.collector import collect_messages
+from meeting.models import Meeting
+from meeting.signals import notify_status
+
+__author__ = "agent <agent@local>"
+
+
+DEFAULT_MAX_DURATION = 6 * 60 * 60
+DEFAULT_BATCH_SIZE = 100
+
+
+def due_meetings(now):
+    """
+    Get the pending meetings whose meeting time is reached.
+
+    :param now: the current time
+    :return: QuerySet of the meetings, by meeting time
+    """
+    return Meeting.objects\
+        .filter(status=Meeting.STATUS_PENDING, meeting_time__lte=now)\
+        .order_by("meeting_time", "id")
+
+
+def stale_meetings(now):
+    """
+    Get the meetings in progress for longer than `MAX_DURATION`.
+
+    :param now: the current time
+    :return: QuerySet of the meetings, by id
+    """
+    max_duration = getattr(settings, "SCHEDULER_SETTINGS", {}).get("MAX_DURATION", DEFAULT_MAX_DURATION)
+    limit = now - timedelta(seconds=max_duration)
+    return Meeting.objects\
+        .filter(status=Meeting.STATUS_PROGRESS)\
+        .filter(Q(meeting_time__lt=limit) | Q(meeting_time__isnull=True, start_time__lt=limit))\
+        .order_by("id")
+
+
+def _change_status(meetings, status, batch_size, **fields):
+    """
+    Change the status of a batch of meetings in a single query, and notify their participants.
+
+    :param meetings: QuerySet of the meetings to change, in the order in which to change them
+    :param status: the new status of the meetings
+    :param batch_size: maximum number of meetings to change
+    :param fields: other fields to set on the meetings
+    :return: the number of meetings changed
+    """
+    with collect_messages():
+        # the meetings are locked until the end of the batch, saving them meanwhile waits for the new status
+        meeting_ids = list(meetings.select_for_update().values_list("id", flat=True)[:batch_size])
+        if not meeting_ids:
+            return 0
+
+        Meeting.objects.filter(id__in=meeting_ids).update(status=status, **fields)
+        for meeting in Meeting.objects.filter(id__in=meeting_ids):
+            notify_status(meeting)
+
+    return len(meeting_ids)
+
+
+def start_due_meetings(now=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Start a batch of pending meetings whose meeting time is reached.
+
+    :param now: the current time, now by default
+    :param batch_size: maximum number of meetings to start
+    :return: the number of meetings started
+    """
+    return _change_status(due_meetings(now or timezone.now()), Meeting.STATUS_PROGRESS, batch_size)
+
+
+def end_stale_meetings(now=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    End a batch of meetings in progress for longer than `MAX_DURATION`, recording when they ended.
+
+    :param now: the current time, now by default
+    :param batch_size: maximum number of meetings to end
+    :return: the number of meetings ended
+    """
+    now = now or timezone.now()
+    return _change_status(stale_meetings(now), Meeting.STATUS_ENDED, batch_size, end_time=now)
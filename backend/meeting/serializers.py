@@ -3,21 +3,28 @@
 from itertools import chain
 
 from decimal import Decimal
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import transaction
 from django.db.models import Q
 from rest_framework.exceptions import ValidationError
-from rest_framework.fields import CurrentUserDefault, HiddenField, DecimalField
+from rest_framework.fields import CurrentUserDefault, HiddenField, DecimalField, DateTimeField, FloatField, \
+    IntegerField, JSONField, MultipleChoiceField
 from rest_framework.relations import PrimaryKeyRelatedField
 from rest_framework.serializers import ModelSerializer, Serializer
 
-from meeting.models import Meeting, Place, Participant
+from device.collector import collect_messages
+from meeting.models import Meeting, MeetingEvent, Place, Participant, Position
+from meeting.positions import DEFAULT_MAX_BATCH_SIZE
 from user.models import Friendship
 from user.serializers import PublicUserSerializer
 
 __author__ = "Benjamin Schubert, <ben.c.schubert@gmail.com>"
 
 
+# places are looked for around a user, larger areas would read too many of them
+MAX_NEARBY_RADIUS = 50000
+
+
 class AutoShrinkDecimal(DecimalField):
     """Extend `DecimalField` to automatically strip to the number of decimal given."""
 
@@ -35,10 +42,35 @@ class PlaceSerializer(ModelSerializer):
     class Meta:
         """Defines the metaclass for the `PlaceSerializer`."""
 
-        fields = "__all__"
+        exclude = ("geohash",)
         model = Place
 
 
+class NearbyPlaceSerializer(PlaceSerializer):
+    """Defines a serializer for places found around a position, with their distance to it."""
+
+    distance = FloatField(read_only=True)
+
+
+class NearbyQuerySerializer(Serializer):
+    """Defines a serializer for the position around which to look for places."""
+
+    lat = FloatField(min_value=-90, max_value=90)
+    lng = FloatField(min_value=-180, max_value=180)
+    radius = FloatField(min_value=0, max_value=MAX_NEARBY_RADIUS)
+
+
+class MeetingFilterSerializer(Serializer):
+    """Defines a serializer for the filters of the list of meetings."""
+
+    status = MultipleChoiceField(
+        choices=(Meeting.STATUS_PENDING, Meeting.STATUS_PROGRESS, Meeting.STATUS_ENDED, Meeting.STATUS_CANCELED),
+        required=False,
+    )
+    started_after = DateTimeField(required=False)
+    started_before = DateTimeField(required=False)
+
+
 class MeetingPlaceSerializer(ModelSerializer):
     """
     Defines a serializer for the `Place` model when used in a `Meeting`.
@@ -53,16 +85,21 @@ class MeetingPlaceSerializer(ModelSerializer):
     class Meta:
         """Defines the metaclass for the `MeetingPlaceSerializer`."""
 
-        fields = "__all__"
+        exclude = ("geohash",)
         model = Place
 
     def get_attribute(self, instance):
         """
         Get the correct place for the requesting user.
 
+        The participation of the user is taken from the meeting when it was prefetched, see
+        `MeetingQuerySet.with_details`.
+
         :param instance: meeting for which to get the place
         :return: a `Place` instance
         """
+        if hasattr(instance, "user_participations"):
+            return instance.user_participations[0].place if instance.user_participations else None
         try:
             return Participant.objects.get(user=self.context["request"].user, meeting=instance).place
         except Participant.DoesNotExist:
@@ -126,7 +163,8 @@ class MeetingSerializer(ModelSerializer):
     class Meta:
         """Defines the metaclass for the `MeetingSerializer`."""
 
-        exclude = ("end_time", "start_time")
+        # archived meetings, shown with the same serializer, have no counters
+        exclude = ("end_time", "start_time", "participant_count", "accepted_count", "refused_count", "arrived_count")
         model = Meeting
         depth = 1
 
@@ -146,15 +184,16 @@ class WriteMeetingSerializer(MeetingSerializer):
     class Meta(MeetingSerializer.Meta):
         """Metaclass for the `WriteMeetingSerializer`."""
 
-        exclude = ("status",)
+        exclude = ("status", "participant_count", "accepted_count", "refused_count", "arrived_count")
         depth = 0
 
-    @transaction.atomic
+    @collect_messages()
     def create(self, validated_data):
         """
         Create a new meeting.
 
         This operation is atomic and will create every participant and places accordingly.
+        Notifications to the participants are sent at once, when the meeting is committed.
 
         If this is a 'place' meeting, set the status as 'in progress'. Other types of meetings
         needs more information to start.
@@ -274,3 +313,58 @@ class PositionSerializer(Serializer):
 
     latitude = AutoShrinkDecimal(decimal_places=6, max_digits=9, max_value=90, min_value=-90)
     longitude = AutoShrinkDecimal(decimal_places=6, max_digits=9, max_value=180, min_value=-180)
+
+
+class TimedPositionSerializer(PositionSerializer):
+    """Defines a serializer for positions taken at a given time."""
+
+    time = DateTimeField()
+
+
+class PositionBatchSerializer(Serializer):
+    """Defines a serializer for several positions sent at once, which must be ordered by time."""
+
+    positions = TimedPositionSerializer(many=True, allow_empty=False)
+
+    def validate_positions(self, positions):
+        """
+        Check that there are not too many positions and that they are ordered.
+
+        :param positions: positions to validate
+        :return: the positions
+        """
+        max_batch_size = getattr(settings, "POSITION_SETTINGS", {}).get("MAX_BATCH_SIZE", DEFAULT_MAX_BATCH_SIZE)
+        if len(positions) > max_batch_size:
+            raise ValidationError("At most {} positions can be sent at once.".format(max_batch_size))
+
+        if any(previous["time"] > current["time"] for previous, current in zip(positions, positions[1:])):
+            raise ValidationError("Positions must be ordered by time.")
+
+        return positions
+
+
+class ParticipantPositionSerializer(ModelSerializer):
+    """Defines a serializer for the `Position` model, giving coordinates in degrees."""
+
+    latitude = DecimalField(source="latitude_degrees", decimal_places=6, max_digits=9, read_only=True)
+    longitude = DecimalField(source="longitude_degrees", decimal_places=6, max_digits=9, read_only=True)
+
+    class Meta:
+        """Defines the metaclass for the `ParticipantPositionSerializer`."""
+
+        fields = ("user", "latitude", "longitude", "time")
+        model = Position
+
+
+class MeetingEventSerializer(ModelSerializer):
+    """Defines a serializer for the `MeetingEvent` model."""
+
+    # events are identified by their sequence number in their meeting, which gives their order
+    id = IntegerField(source="sequence", read_only=True)
+    data = JSONField(read_only=True)
+
+    class Meta:
+        """Defines the metaclass for the `MeetingEventSerializer`."""
+
+        fields = ("id", "type", "data", "time")
+        model = MeetingEvent
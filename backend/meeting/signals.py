@@ -1,14 +1,54 @@
 """Contains all signal handlers from the `meeting` module."""
-from django.db.models import Q
+from django.conf import settings
+from django.db.models import F, Q
 from django.db.models.signals import post_save, post_init
 from django.dispatch import receiver
+from django.utils import timezone
 
-from device.models import DeferredMessage
+from device.models import DeferredMessage, Device
 from meeting.models import Participant, Meeting
+from meeting.positions import evict_positions
 
 __author__ = "Damien Rochat <rochat.damien@gmail.com>"
 
 
+def use_topics():
+    """Check whether meeting events are published to meeting topics, see `Meeting.send_message`."""
+    return settings.FCM_SETTINGS.get("USE_TOPICS", False)
+
+
+def unsubscribe_participants(meeting):
+    """Unsubscribe the devices of the accepted participants from the topic of a meeting which is over."""
+    if use_topics():
+        Device.objects\
+            .filter(Q(user__participant__meeting_id=meeting.id) & Q(user__participant__accepted=True))\
+            .unsubscribe(meeting.topic)
+
+
+def update_counts(participant, created):
+    """
+    Update the counters of the meeting of a participant who was created or changed, in a single query.
+
+    Counters are changed relatively to their value in the database, concurrent changes of participants of the same
+    meeting thus never overwrite each other. The previous state of the participant is the one stored before the save,
+    see `Participant.save`, a change is thus counted once even if stale copies of the participant save it again.
+    Participants are never deleted before their meeting.
+
+    :param participant: the participant which was saved
+    :param created: whether the participant was created
+    """
+    counts = Participant.counts(participant.accepted, participant.arrived)
+    if created:
+        counts["participant_count"] = 1
+    else:
+        previous = Participant.counts(participant.previous("accepted"), participant.previous("arrived"))
+        counts = {counter: count - previous[counter] for counter, count in counts.items()}
+
+    changes = {counter: F(counter) + count for counter, count in counts.items() if count != 0}
+    if changes:
+        Meeting.objects.filter(id=participant.meeting_id).update(**changes)
+
+
 @receiver(post_init, sender=Participant)
 def post_init_participant(instance, **kwargs):
     """
@@ -26,12 +66,22 @@ def post_save_participant(instance, created, **kwargs):
 
     Creation :
     - Send a push notification to the participant to inform of the new meeting (except organiser and hidden user).
+    - When using topics, subscribe the participant to the meeting topic if he accepted it already, as the organiser.
     Update :
     - Send a push notification to the other users to inform them of the event (no push message to
       the person at the origin of the action and the participants who declined the meeting).
     - Check if every participant is arrived and if so, the meeting is finished and inform the participants.
+    - When using topics, subscribe the participant to the meeting topic when accepting it, and unsubscribe him when
+      canceling his participation.
+
+    The counters of participants of the meeting are updated in both cases, see `update_counts`.
     """
+    update_counts(instance, created)
+
     if created:
+        if instance.accepted is True and use_topics():
+            Device.objects.filter(user_id=instance.user_id).subscribe(instance.meeting.topic)
+
         if instance.meeting.organiser_id != instance.user_id and instance.user.is_hidden is False:
             instance.user.send_message(
                 title="New meeting",
@@ -49,7 +99,8 @@ def post_save_participant(instance, created, **kwargs):
         if instance.has_changed("accepted"):
 
             if instance.accepted is True:
-                meeting_users.send_message(
+                instance.meeting.send_message(
+                    meeting_users,
                     title="Meeting update",
                     body="{} accepted the meeting".format(instance.user.username),
                     data=dict(
@@ -57,13 +108,19 @@ def post_save_participant(instance, created, **kwargs):
                         meeting=instance.meeting.id,
                         participant=instance.user_id,
                     ),
-                    deferred=False,
                 )
 
+                if use_topics():
+                    Device.objects.filter(user_id=instance.user_id).subscribe(instance.meeting.topic)
+
             elif instance.accepted is False:
 
                 if instance.previous("accepted") is True:
-                    meeting_users.send_message(
+                    if use_topics():
+                        Device.objects.filter(user_id=instance.user_id).unsubscribe(instance.meeting.topic)
+
+                    instance.meeting.send_message(
+                        meeting_users,
                         title="Meeting update",
                         body="{} canceled his participation".format(instance.user.username),
                         data=dict(
@@ -71,11 +128,11 @@ def post_save_participant(instance, created, **kwargs):
                             meeting=instance.meeting.id,
                             participant=instance.user_id
                         ),
-                        deferred=False,
                     )
 
                 else:
-                    meeting_users.send_message(
+                    instance.meeting.send_message(
+                        meeting_users,
                         title="Meeting update",
                         body="{} refused the meeting".format(instance.user.username),
                         data=dict(
@@ -83,12 +140,12 @@ def post_save_participant(instance, created, **kwargs):
                             meeting=instance.meeting.id,
                             participant=instance.user_id,
                         ),
-                        deferred=False,
                     )
 
         elif instance.has_changed("arrived") and instance.arrived is True:
 
-            meeting_users.send_message(
+            instance.meeting.send_message(
+                meeting_users,
                 title="Meeting update",
                 body="{} has arrived to the meeting".format(instance.user.username),
                 data=dict(
@@ -96,14 +153,18 @@ def post_save_participant(instance, created, **kwargs):
                     meeting=instance.meeting.id,
                     participant=instance.user_id,
                 ),
-                deferred=False,
             )
 
-            if Participant.objects\
-                    .filter(Q(meeting_id=instance.meeting_id) & ~Q(accepted=False) & Q(arrived=False))\
-                    .count() == 0:
-                instance.meeting.status = Meeting.STATUS_ENDED
-                instance.meeting.save(update_fields=("status",))
+            # the meeting is only ended once, by whichever of concurrent arrivals sees everybody arrived
+            now = timezone.now()
+            if Meeting.objects\
+                    .everybody_arrived()\
+                    .filter(id=instance.meeting_id, status__in=(Meeting.STATUS_PENDING, Meeting.STATUS_PROGRESS))\
+                    .update(status=Meeting.STATUS_ENDED, end_time=now):
+                meeting = instance.meeting
+                meeting.status, meeting.end_time = Meeting.STATUS_ENDED, now
+                notify_status(meeting)
+                meeting.reset_tracker()
 
     instance.reset_tracker()
 
@@ -118,49 +179,88 @@ def post_init_meeting(instance, **kwargs):
     instance.initialize_tracker()
 
 
-@receiver(post_save, sender=Meeting)
-def post_save_meeting(instance, created, **kwargs):
+def notify_status(meeting):
     """
-    Fired when meeting is saved (created or updated).
+    Inform the participants of a meeting of its new status.
 
-    Update :
     - If the status is now 'progress' or 'ended'
         - Send a push message to inform the participants (except users who declined).
     - If the status is now 'ended'
         - Send a push message to inform the participants (except users who declined).
         - Remove eventually pending push messages related to the meeting.
+        - Unsubscribe the participants from the meeting topic, when using topics.
+        - Remove the latest positions of the participants from the cache.
+        - Log the event for participants following the meeting events.
+
+    The last message is sent to the devices directly, so that it reaches them even if it is sent after they are
+    unsubscribed, as it happens with the outbox.
+
+    This is called when a meeting is saved with a new status, and by `meeting.scheduler` for the meetings whose status
+    it changes in bulk, without saving them.
+
+    :param meeting: the meeting whose status changed
     """
-    if created is False:
-
-        if instance.has_changed("status"):
-            meeting_users = instance.participants\
-                .filter(~Q(participant__accepted=False))\
-                .all()
-
-            if instance.status == Meeting.STATUS_PROGRESS:
-                meeting_users.send_message(
-                    title="Meeting in progress",
-                    body="Go to the meeting now",
-                    data=dict(type="meeting-in-progress", meeting=instance.id),
-                    deferred=False,
-                )
+    meeting_users = meeting.participants\
+        .filter(~Q(participant__accepted=False))\
+        .all()
 
-            elif instance.status == Meeting.STATUS_ENDED:
-                meeting_users.send_message(
-                    title="Meeting finished",
-                    body="The meeting is now finished",
-                    data=dict(type="finished-meeting", meeting=instance.id),
-                    deferred=False,
-                )
-                DeferredMessage.objects.filter(related_type="meeting", related_id=instance.id).delete()
-
-            elif instance.status == Meeting.STATUS_CANCELED:
-                meeting_users.send_message(
-                    title="Meeting canceled",
-                    body="The meeting has been canceled",
-                    data=dict(type="canceled-meeting", meeting=instance.id),
-                    deferred=False,
-                )
-                DeferredMessage.objects.filter(related_type="meeting", related_id=instance.id).delete()
+    if meeting.status == Meeting.STATUS_PROGRESS:
+        meeting.send_message(
+            meeting_users,
+            title="Meeting in progress",
+            body="Go to the meeting now",
+            data=dict(type="meeting-in-progress", meeting=meeting.id),
+        )
+
+    elif meeting.status == Meeting.STATUS_ENDED:
+        meeting_users.send_message(
+            title="Meeting finished",
+            body="The meeting is now finished",
+            data=dict(type="finished-meeting", meeting=meeting.id),
+            deferred=False,
+        )
+        meeting.log_event(dict(type="finished-meeting", meeting=meeting.id))
+        DeferredMessage.objects.filter(related_type="meeting", related_id=meeting.id).delete()
+        unsubscribe_participants(meeting)
+        evict_positions(meeting)
+
+    elif meeting.status == Meeting.STATUS_CANCELED:
+        meeting_users.send_message(
+            title="Meeting canceled",
+            body="The meeting has been canceled",
+            data=dict(type="canceled-meeting", meeting=meeting.id),
+            deferred=False,
+        )
+        meeting.log_event(dict(type="canceled-meeting", meeting=meeting.id))
+        DeferredMessage.objects.filter(related_type="meeting", related_id=meeting.id).delete()
+        unsubscribe_participants(meeting)
+        evict_positions(meeting)
+
+
+@receiver(post_save, sender=Meeting)
+def post_save_meeting(instance, created, **kwargs):
+    """
+    Fired when meeting is saved (created or updated).
+
+    Update :
+    - If the status changed, inform the participants, see `notify_status`.
+    """
+    if created is False and instance.has_changed("status"):
+        notify_status(instance)
 
     instance.reset_tracker()
+
+
+@receiver(post_save, sender=Device)
+def post_save_device(instance, created, update_fields, **kwargs):
+    """
+    Fired when a device is saved (created or updated).
+
+    When using topics, subscribe a device newly registered for a user to the topics of the meetings he accepted and
+    which are not over yet.
+    """
+    if use_topics() and (created or (update_fields is not None and "user" in update_fields)):
+        for meeting in Meeting.objects.filter(
+                Q(participant__user_id=instance.user_id) & Q(participant__accepted=True) &
+                Q(status__in=(Meeting.STATUS_PENDING, Meeting.STATUS_PROGRESS))):
+            Device.objects.filter(id=instance.id).subscribe(meeting.topic)
@@ -0,0 +1,176 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework import status
+
+from meeting.archive import archivable_meetings, archive_batch
+from meeting.models import ArchivedMeeting, ArchivedParticipant, ArchivedPlace, Meeting, MeetingEvent, Participant, \
+    Place, Position
+from test_utils import APIEndpointTestCase, API_V1, authenticated
+
+__author__ = "agent <agent@local>"
+
+
+class TestArchive(APIEndpointTestCase):
+    url = API_V1 + "meetings/"
+    number_of_other_users = 2
+
+    def setUp(self):
+        super().setUp()
+        self.others = list(get_user_model().objects.exclude(id=self.user.id))
+
+    def create_meeting(self, status, days_ago, name):
+        meeting = Meeting.objects.create(organiser=self.user, status=status, type=Meeting.TYPE_PLACE)
+        Meeting.objects.filter(id=meeting.id).update(start_time=timezone.now() - timedelta(days=days_ago))
+        place = Place.objects.create(latitude=46.52, longitude=6.63, name=name)
+        for user in [self.user] + self.others:
+            Participant.objects.create(meeting=meeting, user=user, accepted=True, place=place)
+        return Meeting.objects.get(id=meeting.id)
+
+    def test_old_finished_meetings_are_archivable(self):
+        ended = self.create_meeting(Meeting.STATUS_ENDED, 10, "ended")
+        canceled = self.create_meeting(Meeting.STATUS_CANCELED, 10, "canceled")
+        self.create_meeting(Meeting.STATUS_ENDED, 1, "recent")
+        self.create_meeting(Meeting.STATUS_PROGRESS, 10, "running")
+
+        self.assertEqual(list(archivable_meetings(timedelta(days=7))), [ended, canceled])
+
+    def test_long_meetings_are_archivable_once_ended_long_enough_ago(self):
+        long_ago = self.create_meeting(Meeting.STATUS_ENDED, 20, "long ago")
+        recent = self.create_meeting(Meeting.STATUS_ENDED, 20, "recent")
+        Meeting.objects.filter(id=long_ago.id).update(end_time=timezone.now() - timedelta(days=10))
+        Meeting.objects.filter(id=recent.id).update(end_time=timezone.now() - timedelta(days=1))
+
+        self.assertEqual(list(archivable_meetings(timedelta(days=7))), [long_ago])
+
+    def test_meetings_are_moved_with_participants_and_places(self):
+        meeting = self.create_meeting(Meeting.STATUS_ENDED, 10, "ended")
+        participant_ids = set(meeting.participant_set.values_list("id", flat=True))
+        place_id = meeting.participant_set.first().place_id
+
+        archive_batch([meeting.id])
+
+        self.assertFalse(Meeting.objects.filter(id=meeting.id).exists())
+        self.assertFalse(Participant.objects.filter(meeting_id=meeting.id).exists())
+        self.assertFalse(Place.objects.filter(id=place_id).exists())
+
+        archived = ArchivedMeeting.objects.get(id=meeting.id)
+        self.assertEqual((archived.status, archived.start_time, archived.organiser_id),
+                         (meeting.status, meeting.start_time, meeting.organiser_id))
+        self.assertEqual(set(archived.participant_set.values_list("id", flat=True)), participant_ids)
+        self.assertEqual(ArchivedPlace.objects.get(id=place_id).name, "ended")
+
+    def test_positions_and_events_are_deleted(self):
+        meeting = self.create_meeting(Meeting.STATUS_ENDED, 10, "ended")
+        Position.from_degrees(46.52, 6.63, meeting=meeting, user=self.user).save()
+        meeting.log_event(dict(type="meeting-finished", meeting=meeting.id))
+
+        archive_batch([meeting.id])
+
+        self.assertFalse(Position.objects.exists())
+        self.assertFalse(MeetingEvent.objects.exists())
+
+    def test_places_still_used_are_only_copied(self):
+        meeting = self.create_meeting(Meeting.STATUS_ENDED, 10, "ended")
+        running = self.create_meeting(Meeting.STATUS_PROGRESS, 10, "running")
+        place = meeting.participant_set.first().place
+        Participant.objects.filter(meeting=running).update(place=place)
+
+        archive_batch([meeting.id])
+
+        self.assertTrue(Place.objects.filter(id=place.id).exists())
+        self.assertTrue(ArchivedPlace.objects.filter(id=place.id).exists())
+
+    def test_command_archives_in_batches(self):
+        for i in range(5):
+            self.create_meeting(Meeting.STATUS_ENDED, 10, "ended-{}".format(i))
+        running = self.create_meeting(Meeting.STATUS_PROGRESS, 10, "running")
+
+        output = StringIO()
+        call_command("archive_meetings", batch_size=2, stdout=output)
+
+        self.assertIn("Archived 5 meetings", output.getvalue())
+        self.assertEqual(list(Meeting.objects.all()), [running])
+        self.assertEqual(ArchivedMeeting.objects.count(), 5)
+        self.assertEqual(ArchivedParticipant.objects.count(), 15)
+
+    @authenticated
+    def test_history_lists_hot_and_archived_meetings(self):
+        archived = self.create_meeting(Meeting.STATUS_ENDED, 10, "archived")
+        ended = self.create_meeting(Meeting.STATUS_ENDED, 5, "ended")
+        running = self.create_meeting(Meeting.STATUS_PROGRESS, 1, "running")
+        archive_batch([archived.id])
+
+        meetings = self.get().json()
+
+        self.assertEqual([meeting["id"] for meeting in meetings], [running.id, ended.id, archived.id])
+        self.assertEqual(meetings[2]["place"]["name"], "archived")
+        self.assertEqual(len(meetings[2]["participants"]), 3)
+
+    @authenticated
+    def test_history_pages_span_hot_and_archived_meetings(self):
+        meetings = [self.create_meeting(Meeting.STATUS_ENDED, days, str(days)) for days in (10, 9, 8, 2, 1)]
+        archive_batch([meetings[0].id, meetings[2].id])
+
+        ids = []
+        response = self.get(query_params=dict(page_size=2))
+        while True:
+            ids.extend(meeting["id"] for meeting in response.json()["results"])
+            if response.json()["next"] is None:
+                break
+            response = self.get(url=response.json()["next"])
+
+        self.assertEqual(ids, [meeting.id for meeting in reversed(meetings)])
+
+    @authenticated
+    def test_active_meetings_do_not_read_the_archive(self):
+        archived = self.create_meeting(Meeting.STATUS_ENDED, 10, "archived")
+        running = self.create_meeting(Meeting.STATUS_PROGRESS, 1, "running")
+        archive_batch([archived.id])
+
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, dict(status=[Meeting.STATUS_PENDING, Meeting.STATUS_PROGRESS]))
+
+        self.assertEqual([meeting["id"] for meeting in response.json()], [running.id])
+
+    @authenticated
+    def test_archived_meeting_details_can_be_read(self):
+        meeting = self.create_meeting(Meeting.STATUS_ENDED, 10, "archived")
+        archive_batch([meeting.id])
+
+        response = self.get(url=self.url + "{}/".format(meeting.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["place"]["name"], "archived")
+
+    @authenticated
+    def test_archived_meeting_cannot_be_updated(self):
+        meeting = self.create_meeting(Meeting.STATUS_ENDED, 10, "archived")
+        archive_batch([meeting.id])
+
+        response = self.client.patch(self.url + "{}/".format(meeting.id), dict(status=Meeting.STATUS_CANCELED))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @authenticated
+    def test_archived_meeting_details_are_only_shown_to_participants(self):
+        meeting = self.create_meeting(Meeting.STATUS_ENDED, 10, "archived")
+        meeting.participant_set.filter(user=self.user).delete()
+        archive_batch([meeting.id])
+
+        self.assertEqual(self.get(url=self.url + "{}/".format(meeting.id)).status_code, status.HTTP_403_FORBIDDEN)
+
+    @authenticated
+    def test_places_include_archived_places(self):
+        archived = self.create_meeting(Meeting.STATUS_ENDED, 10, "archived")
+        self.create_meeting(Meeting.STATUS_PROGRESS, 1, "running")
+        archive_batch([archived.id])
+
+        names = {place["name"] for place in self.get(url=self.url + "places/").json()}
+        nearby = self.get(url=self.url + "places/nearby/", query_params=dict(lat=46.52, lng=6.63, radius=100)).json()
+
+        self.assertEqual(names, {"archived", "running"})
+        self.assertEqual({place["name"] for place in nearby}, {"archived", "running"})
@@ -0,0 +1,136 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework import status
+
+from device.tests import create_device, MockFcmMessagesMixin
+from meeting.events import get_followers
+from meeting.models import Meeting, MeetingEvent, Participant
+from meeting.tests import create_meeting
+from test_utils import APIEndpointTestCase, API_V1, authenticated, run_commit_hooks
+from user.models import Friendship
+
+__author__ = "agent <agent@local>"
+
+
+class TestMeetingEvents(MockFcmMessagesMixin, APIEndpointTestCase):
+    url = API_V1 + "meetings/"
+
+    number_of_other_users = 3
+
+    def setUp(self):
+        super().setUp()
+
+        for user in get_user_model().objects.all():
+            create_device(user)
+            Friendship(from_account=self.user, to_account=user, is_accepted=True).save()
+
+        self.meeting = create_meeting(self.user)
+        self.events_url = self.url + "{}/events/".format(self.meeting.id)
+        self.other = Participant.objects.filter(meeting=self.meeting, accepted=None).first().user
+
+        cache.clear()
+        self.mocked_send_fcm_bulk_message.reset_mock()
+
+    def accept(self, user):
+        participant = Participant.objects.get(meeting=self.meeting, user=user)
+        participant.accepted = True
+        participant.save()
+
+    def get_events(self, after=None, **headers):
+        query = "?wait=0" if after is None else "?wait=0&after={}".format(after)
+        return self.client.get(self.events_url + query, **headers)
+
+    @authenticated
+    def test_participant_events_are_logged(self):
+        self.accept(self.other)
+
+        events = self.get_events().json()
+
+        self.assertEqual([event["type"] for event in events], ["user-accepted-meeting"])
+        self.assertEqual(events[0]["data"]["participant"], self.other.id)
+
+    @authenticated
+    def test_events_resume_after_the_last_one_received(self):
+        self.accept(self.other)
+        last = self.get_events().json()[-1]["id"]
+        self.meeting.status = Meeting.STATUS_PROGRESS
+        self.meeting.save()
+
+        self.assertEqual([event["type"] for event in self.get_events(last).json()], ["meeting-in-progress"])
+        self.assertEqual(
+            [event["type"] for event in self.get_events(HTTP_LAST_EVENT_ID=str(last)).json()], ["meeting-in-progress"]
+        )
+
+    @authenticated
+    def test_end_of_meeting_is_logged(self):
+        self.meeting.status = Meeting.STATUS_CANCELED
+        self.meeting.save()
+
+        self.assertEqual([event["type"] for event in self.get_events().json()], ["canceled-meeting"])
+
+    @authenticated
+    def test_events_as_server_sent_events(self):
+        self.accept(self.other)
+        event = MeetingEvent.objects.get()
+
+        response = self.get_events(HTTP_ACCEPT="text/event-stream")
+
+        self.assertEqual(response["Content-Type"], "text/event-stream; charset=utf-8")
+        content = response.content.decode("utf8")
+        self.assertTrue(content.startswith("retry: "))
+        self.assertIn("id: {}\nevent: user-accepted-meeting\ndata: {{".format(event.sequence), content)
+        self.assertTrue(content.endswith("}\n\n"))
+
+    @authenticated
+    def test_others_cannot_follow_events(self):
+        Participant.objects.filter(meeting=self.meeting, user=self.user).delete()
+
+        self.assertEqual(self.get_events().status_code, status.HTTP_404_NOT_FOUND)
+
+    @authenticated
+    def test_invalid_last_event_is_rejected(self):
+        self.assertEqual(self.get_events("last").status_code, status.HTTP_400_BAD_REQUEST)
+
+    @authenticated
+    def test_invalid_wait_is_rejected(self):
+        for wait in ("-1", "nan", "soon"):
+            response = self.client.get(self.events_url + "?wait={}".format(wait))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, wait)
+
+    @authenticated
+    def test_events_are_numbered_per_meeting(self):
+        other_meeting = create_meeting(self.user)
+        self.accept(self.other)
+        other_meeting.status = Meeting.STATUS_CANCELED
+        other_meeting.save()
+        self.meeting.status = Meeting.STATUS_PROGRESS
+        self.meeting.save()
+
+        self.assertEqual([event["id"] for event in self.get_events().json()], [1, 2])
+        self.assertEqual(
+            list(MeetingEvent.objects.filter(meeting=other_meeting).values_list("sequence", "type")),
+            [(1, "canceled-meeting")]
+        )
+
+    @authenticated
+    def test_followers_are_not_sent_pushes(self):
+        Participant.objects.filter(meeting=self.meeting).update(accepted=True)
+        self.get_events()
+        self.assertEqual(get_followers(self.meeting.id), {self.user.id})
+
+        participant = Participant.objects.get(meeting=self.meeting, user=self.other)
+        participant.arrived = True
+        participant.save()
+        run_commit_hooks()
+
+        registration_ids = self.mocked_send_fcm_bulk_message.call_args[1]["registration_ids"]
+        self.assertNotIn(self.user.get_device().registration_id, registration_ids)
+        self.assertEqual(len(registration_ids), self.number_of_other_users - 1)
+
+    @authenticated
+    @override_settings(EVENT_SETTINGS=dict(GRACE=-1))
+    def test_participants_stop_following_when_not_polling(self):
+        self.get_events()
+
+        self.assertEqual(get_followers(self.meeting.id), set())
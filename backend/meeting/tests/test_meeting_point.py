@@ -0,0 +1,178 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import override_settings, SimpleTestCase
+
+from device.tests import create_device, MockFcmMessagesMixin
+from meeting import meeting_point
+from meeting.models import Meeting, MeetingEvent, Participant, Place, Position
+from meeting.positions import update_meeting_point
+from meeting.tests import create_meeting
+from test_utils import APIEndpointTestCase, API_V1, authenticated
+
+__author__ = "agent <agent@local>"
+
+
+class TestMeetingPointComputation(SimpleTestCase):
+    def assertPointEqual(self, point, expected, places=6):
+        self.assertAlmostEqual(point[0], expected[0], places=places)
+        self.assertAlmostEqual(point[1], expected[1], places=places)
+
+    def test_two_participants_meet_halfway(self):
+        for method in (meeting_point.MIDPOINT, meeting_point.MINIMAX, meeting_point.MEDIAN):
+            with self.subTest(method=method):
+                self.assertPointEqual(meeting_point.meeting_point([0, 0], [0, 10], method=method), (0, 5))
+
+    def test_midpoint_is_on_the_great_circle(self):
+        latitude, longitude = meeting_point.meeting_point([45, 45], [0, 90], method=meeting_point.MIDPOINT)
+
+        self.assertGreater(latitude, 45)
+        self.assertAlmostEqual(longitude, 45)
+
+    def test_median_is_attracted_by_groups(self):
+        self.assertPointEqual(
+            meeting_point.meeting_point([0, 0, 0, 1], [0, 0, 0, 0], method=meeting_point.MEDIAN), (0, 0)
+        )
+
+    def test_minimax_minimizes_the_longest_distance(self):
+        latitudes, longitudes = [0, 0, 0, 0.01], [0, 0, 0, 0]
+        minimax = meeting_point.meeting_point(latitudes, longitudes, method=meeting_point.MINIMAX)
+        median = meeting_point.meeting_point(latitudes, longitudes, method=meeting_point.MEDIAN)
+
+        self.assertPointEqual(minimax, (0.005, 0), places=4)
+        self.assertLess(
+            meeting_point.haversine(*minimax, latitudes, longitudes).max(),
+            meeting_point.haversine(*median, latitudes, longitudes).max(),
+        )
+
+    def test_single_participant_is_the_meeting_point(self):
+        for method in (meeting_point.MIDPOINT, meeting_point.MINIMAX, meeting_point.MEDIAN):
+            with self.subTest(method=method):
+                self.assertPointEqual(meeting_point.meeting_point([46.5], [6.6], method=method), (46.5, 6.6))
+
+    def test_warm_start_converges_to_the_same_median(self):
+        latitudes, longitudes = [46.5, 46.52, 46.51, 46.55], [6.6, 6.63, 6.58, 6.61]
+        cold = meeting_point.meeting_point(latitudes, longitudes, method=meeting_point.MEDIAN)
+        warm = meeting_point.meeting_point(latitudes, longitudes, method=meeting_point.MEDIAN, start=(46.52, 6.6))
+
+        self.assertLess(meeting_point.haversine(*cold, [warm[0]], [warm[1]])[0], 1)
+
+    def test_warm_start_converges_to_an_equivalent_minimax_point(self):
+        latitudes, longitudes = [46.5, 46.52, 46.51, 46.55], [6.6, 6.63, 6.58, 6.61]
+        cold = meeting_point.meeting_point(latitudes, longitudes, method=meeting_point.MINIMAX)
+        warm = meeting_point.meeting_point(latitudes, longitudes, method=meeting_point.MINIMAX, start=(46.52, 6.6))
+
+        # the minimax point is approximated, but the longest distances must be about the same
+        self.assertAlmostEqual(
+            meeting_point.haversine(*cold, latitudes, longitudes).max(),
+            meeting_point.haversine(*warm, latitudes, longitudes).max(),
+            delta=30,
+        )
+
+    def test_meeting_point_across_the_antimeridian(self):
+        self.assertPointEqual(
+            meeting_point.meeting_point([0, 0], [179, -179], method=meeting_point.MEDIAN), (0, 180), places=4
+        )
+
+    def test_unknown_method_is_rejected(self):
+        with self.assertRaises(ValueError):
+            meeting_point.meeting_point([0], [0], method="centroid")
+
+
+@override_settings(POSITION_SETTINGS=dict(THROTTLE_WINDOW=0, MIN_DISTANCE=10, MEETING_POINT="median"))
+class TestMeetingPointUpdate(MockFcmMessagesMixin, APIEndpointTestCase):
+    url = API_V1 + "meetings/positions/"
+
+    number_of_other_users = 2
+
+    def setUp(self):
+        super().setUp()
+
+        for user in get_user_model().objects.all():
+            create_device(user)
+
+        self.meeting = create_meeting(self.user)
+        self.meeting.type = Meeting.TYPE_SHORTEST
+        self.meeting.status = Meeting.STATUS_PROGRESS
+        self.meeting.save(update_fields=("type", "status"))
+        Participant.objects.filter(meeting=self.meeting).update(accepted=True)
+
+        self.others = list(get_user_model().objects.exclude(id=self.user.id))
+        cache.clear()
+
+    def get_place(self):
+        return Place.objects.get(participant__meeting=self.meeting, participant__user=self.user)
+
+    def add_position(self, user, latitude, longitude):
+        Position.from_degrees(latitude, longitude, meeting=self.meeting, user=user).save()
+
+    @authenticated
+    def test_meeting_point_is_stored_as_place_of_every_participant(self):
+        self.add_position(self.others[0], 0, 0.02)
+        self.add_position(self.others[1], 0, 0.01)
+
+        self.post(dict(latitude=0, longitude=0))
+
+        place = self.get_place()
+        self.assertEqual((place.latitude, place.longitude), (0, Decimal("0.01")))
+        self.assertEqual(
+            set(Participant.objects.filter(meeting=self.meeting).values_list("place_id", flat=True)), {place.id}
+        )
+
+    @authenticated
+    def test_meeting_point_is_moved_incrementally(self):
+        self.add_position(self.others[0], 0, 0.02)
+        self.add_position(self.others[1], 0, 0.01)
+        self.post(dict(latitude=0, longitude=0))
+        place = self.get_place()
+
+        self.add_position(self.others[1], 0, 0.015)
+        self.post(dict(latitude=0, longitude=0.001))
+
+        self.assertEqual(self.get_place().id, place.id)
+        self.assertEqual(self.get_place().longitude, Decimal("0.015"))
+        self.assertEqual(Place.objects.count(), 1)
+
+    @authenticated
+    def test_meeting_point_update_is_logged_as_event(self):
+        self.add_position(self.others[0], 0, 0.02)
+
+        self.post(dict(latitude=0, longitude=0))
+
+        self.assertTrue(MeetingEvent.objects.filter(meeting=self.meeting, type="meeting-point-update").exists())
+
+    def test_small_moves_do_not_update_the_place(self):
+        self.add_position(self.user, 0, 0)
+        self.add_position(self.others[0], 0, 0.02)
+        place = update_meeting_point(self.meeting)
+
+        self.add_position(self.others[0], 0, 0.02005)
+        update_meeting_point(self.meeting)
+
+        self.assertEqual(Place.objects.get(id=place.id).longitude, place.longitude)
+        self.assertEqual(MeetingEvent.objects.filter(type="meeting-point-update").count(), 1)
+
+    def test_participants_who_did_not_accept_are_ignored(self):
+        Participant.objects.filter(meeting=self.meeting, user=self.others[1]).update(accepted=False)
+        self.add_position(self.user, 0, 0)
+        self.add_position(self.others[0], 0, 0.02)
+        self.add_position(self.others[1], 10, 10)
+
+        place = update_meeting_point(self.meeting)
+
+        self.assertEqual((place.latitude, place.longitude), (0, Decimal("0.01")))
+
+    def test_no_meeting_point_without_positions(self):
+        self.assertIsNone(update_meeting_point(self.meeting))
+        self.assertFalse(Place.objects.exists())
+
+    @authenticated
+    def test_other_meetings_do_not_get_a_meeting_point(self):
+        self.meeting.type = Meeting.TYPE_PERSON
+        self.meeting.save(update_fields=("type",))
+        self.add_position(self.others[0], 0, 0.02)
+
+        self.post(dict(latitude=0, longitude=0))
+
+        self.assertFalse(Place.objects.exists())
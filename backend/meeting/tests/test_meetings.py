@@ -1,11 +1,15 @@
+from datetime import timedelta
 from unittest import expectedFailure
 
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
 
 from device.models import DeferredMessage
 from device.tests import MockFcmMessagesMixin
-from meeting.models import Meeting, Participant
+from meeting.models import Meeting, Participant, Place
 from meeting.tests import create_meeting
 from test_utils import APIEndpointTestCase, API_V1, authenticated
 from user.models import Friendship
@@ -300,7 +304,7 @@ class TestMeetingDetails(MockFcmMessagesMixin, APIEndpointTestCase):
 
     @authenticated
     def test_ended_meeting_cancel_related_deferred_messages(self):
-        self.mocked_send_fcm_message.return_value = dict(success=0)
+        self.mocked_send_fcm_message.return_value = dict(success=0, results=[dict(error="NotRegistered")])
 
         meeting = create_meeting(self.user)
 
@@ -310,10 +314,116 @@ class TestMeetingDetails(MockFcmMessagesMixin, APIEndpointTestCase):
 
     @authenticated
     def test_canceled_meeting_cancel_related_deferred_messages(self):
-        self.mocked_send_fcm_message.return_value = dict(success=0)
+        self.mocked_send_fcm_message.return_value = dict(success=0, results=[dict(error="NotRegistered")])
 
         meeting = create_meeting(self.user)
 
         self.put(dict(status=Meeting.STATUS_CANCELED), url=self.url.format(meeting.id))
 
         self.assertEqual(DeferredMessage.objects.count(), 0)
+
+
+class TestMeetingListQueries(APIEndpointTestCase):
+    url = API_V1 + "meetings/"
+    number_of_other_users = 5
+
+    def create_meetings(self, count):
+        others = list(get_user_model().objects.exclude(id=self.user.id))
+        for i in range(count):
+            meeting = Meeting.objects.create(organiser=others[i % len(others)], type=Meeting.TYPE_PLACE)
+            place = Place.objects.create(latitude=i, longitude=0, name="place-{}".format(i))
+            Participant.objects.create(meeting=meeting, user=self.user, accepted=True, place=place)
+            for other in others:
+                Participant.objects.create(meeting=meeting, user=other, place=place)
+
+    @authenticated
+    def test_meetings_are_listed_in_a_constant_number_of_queries(self):
+        # meetings with their organiser, participants with their user, and the participation of the user with its place,
+        # and archived meetings, of which there are none
+        for count in (2, 20):
+            self.create_meetings(count)
+            with self.assertNumQueries(4):
+                self.get()
+
+    @authenticated
+    def test_meetings_show_the_place_of_the_user(self):
+        self.create_meetings(3)
+        meetings = sorted(self.get().json(), key=lambda meeting: meeting["id"])
+
+        self.assertEqual([meeting["place"]["name"] for meeting in meetings], ["place-0", "place-1", "place-2"])
+        self.assertEqual([len(meeting["participants"]) for meeting in meetings], [6, 6, 6])
+
+
+class TestMeetingListPagination(APIEndpointTestCase):
+    url = API_V1 + "meetings/"
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.meetings = []
+        for i, status in enumerate([Meeting.STATUS_ENDED] * 3 + [Meeting.STATUS_PENDING, Meeting.STATUS_PROGRESS]):
+            meeting = Meeting.objects.create(organiser=self.user, status=status)
+            Participant.objects.create(meeting=meeting, user=self.user, accepted=True)
+            Meeting.objects.filter(id=meeting.id).update(start_time=now - timedelta(days=5 - i))
+            self.meetings.append(meeting.id)
+        # two meetings started at the same time are still paginated in a stable order
+        Meeting.objects.filter(id=self.meetings[1]).update(start_time=now - timedelta(days=5))
+
+    def ids(self, response):
+        return [meeting["id"] for meeting in response.json()["results"]]
+
+    @authenticated
+    def test_meetings_are_not_paginated_unless_asked(self):
+        response = self.get()
+
+        self.assertEqual([meeting["id"] for meeting in response.json()], list(reversed(self.meetings)))
+
+    @authenticated
+    def test_meetings_are_paginated_the_most_recent_first(self):
+        ids = []
+        response = self.get(query_params=dict(page_size=2))
+        while True:
+            ids.extend(self.ids(response))
+            if response.json()["next"] is None:
+                break
+            response = self.get(url=response.json()["next"])
+
+        self.assertEqual(ids, list(reversed(self.meetings[2:])) + [self.meetings[1], self.meetings[0]])
+
+    @authenticated
+    def test_pages_are_read_after_the_cursor_only(self):
+        next_url = self.get(query_params=dict(page_size=2)).json()["next"]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url=next_url)
+
+        self.assertIn('"start_time" <', queries[0]["sql"])
+
+    @authenticated
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.get(query_params=dict(cursor="nope")).status_code, status.HTTP_404_NOT_FOUND)
+
+    @authenticated
+    def test_page_size_is_limited(self):
+        self.assertEqual(len(self.ids(self.get(query_params=dict(page_size=1000)))), 5)
+
+    @authenticated
+    def test_meetings_can_be_filtered_by_status(self):
+        response = self.client.get(self.url, dict(status=[Meeting.STATUS_PENDING, Meeting.STATUS_PROGRESS]))
+
+        self.assertEqual([meeting["id"] for meeting in response.json()], [self.meetings[4], self.meetings[3]])
+
+    @authenticated
+    def test_invalid_status_is_rejected(self):
+        self.assert400WithError(self.get(query_params=dict(status="started")), "status")
+
+    @authenticated
+    def test_meetings_can_be_filtered_by_start_time(self):
+        now = timezone.now()
+        response = self.get(query_params=dict(
+            page_size=10,
+            started_after=(now - timedelta(days=3, hours=1)).isoformat(),
+            started_before=(now - timedelta(days=1, hours=1)).isoformat(),
+        ))
+
+        self.assertEqual(self.ids(response), [self.meetings[3], self.meetings[2]])
@@ -1,4 +1,4 @@
-from unittest.mock import ANY, call
+from unittest.mock import ANY
 
 from django.contrib.auth import get_user_model
 from django.db.models import Q
@@ -6,7 +6,7 @@ from django.db.models import Q
 from device.tests import create_device, MockFcmMessagesMixin
 from meeting.models import Meeting, Participant
 from meeting.tests import create_meeting
-from test_utils import APIEndpointTestCase, authenticated, API_V1
+from test_utils import APIEndpointTestCase, authenticated, API_V1, run_commit_hooks
 from user.models import Friendship
 
 __author__ = "Damien Rochat <rochat.damien@gmail.com>"
@@ -39,20 +39,23 @@ class MessagesTestCase(MockFcmMessagesMixin, APIEndpointTestCase):
             ),
             url=API_V1 + "meetings/"
         )
+        self.assertEqual(self.mocked_send_fcm_message.call_count, 0)  # nothing sent before the commit
+        run_commit_hooks()
 
-        self.assertEqual(self.mocked_send_fcm_message.call_count, other_participants.count())
-        self.mocked_send_fcm_message.assert_has_calls([
-            call(
-                registration_id=u.get_device().registration_id,
-                message_title=ANY,
-                message_body=ANY,
-                message_icon=ANY,
-                data_message={"type": "new-meeting", "meeting": Meeting.objects.first().id},
-                sound=ANY,
-                badge=ANY,
-            )
-            for u in other_participants
-        ], any_order=True)
+        self.mocked_send_fcm_bulk_message.assert_called_once_with(
+            registration_ids=ANY,
+            message_title=ANY,
+            message_body=ANY,
+            message_icon=ANY,
+            data_message={"type": "new-meeting", "meeting": Meeting.objects.first().id},
+            sound=ANY,
+            badge=ANY,
+            collapse_key="meeting-{}-new-meeting".format(Meeting.objects.first().id),
+        )
+        self.assertEqual(
+            sorted(self.mocked_send_fcm_bulk_message.call_args[1]["registration_ids"]),
+            sorted(u.get_device().registration_id for u in other_participants)
+        )
 
     @authenticated
     def test_accept_meeting_send_push_notification_to_participants(self):
@@ -69,7 +72,11 @@ class MessagesTestCase(MockFcmMessagesMixin, APIEndpointTestCase):
             .exclude(Q(id=self.user.id) | Q(participant__accepted=False))\
             .all()
 
+        # the messages sent while setting the meeting up go out once it is committed
+        run_commit_hooks()
+        self.mocked_send_fcm_bulk_message.reset_mock()
         self.put(dict(accepted=True), url=API_V1 + "meetings/{}/participants/".format(meeting.id))
+        run_commit_hooks()
 
         self.mocked_send_fcm_bulk_message.assert_called_once_with(
             registration_ids=[u.get_device().registration_id for u in other_participants],
@@ -81,6 +88,22 @@ class MessagesTestCase(MockFcmMessagesMixin, APIEndpointTestCase):
             badge=ANY,
         )
 
+    def test_participant_change_is_sent_once_committed(self):
+        meeting = create_meeting(self.user)
+        run_commit_hooks()
+        self.mocked_send_fcm_bulk_message.reset_mock()
+
+        participant = Participant.objects.get(meeting=meeting, user=self.user)
+        participant.arrived = True
+        participant.save()
+        self.mocked_send_fcm_bulk_message.assert_not_called()
+
+        run_commit_hooks()
+        self.assertEqual(
+            self.mocked_send_fcm_bulk_message.call_args[1]["data_message"],
+            {"type": "user-arrived-to-meeting", "meeting": meeting.id, "participant": self.user.id}
+        )
+
     @authenticated
     def test_refused_meeting_send_push_notification_to_participants(self):
         """
@@ -96,7 +119,11 @@ class MessagesTestCase(MockFcmMessagesMixin, APIEndpointTestCase):
             .exclude(Q(id=self.user.id) | Q(participant__accepted=False))\
             .all()
 
+        # the messages sent while setting the meeting up go out once it is committed
+        run_commit_hooks()
+        self.mocked_send_fcm_bulk_message.reset_mock()
         self.put(dict(accepted=False), url=API_V1 + "meetings/{}/participants/".format(meeting.id))
+        run_commit_hooks()
 
         self.mocked_send_fcm_bulk_message.assert_called_once_with(
             registration_ids=[u.get_device().registration_id for u in other_participants],
@@ -123,7 +150,11 @@ class MessagesTestCase(MockFcmMessagesMixin, APIEndpointTestCase):
             .filter(~Q(id=self.user.id) & ~Q(participant__accepted=False))\
             .all()
 
+        # the messages sent while setting the meeting up go out once it is committed
+        run_commit_hooks()
+        self.mocked_send_fcm_bulk_message.reset_mock()
         self.put(dict(arrived=True), url=API_V1 + "meetings/{}/participants/".format(meeting.id))
+        run_commit_hooks()
 
         self.mocked_send_fcm_bulk_message.assert_called_once_with(
             registration_ids=[u.get_device().registration_id for u in other_participants],
@@ -219,20 +250,23 @@ class MessagesTestCase(MockFcmMessagesMixin, APIEndpointTestCase):
             ),
             url=API_V1 + "meetings/"
         )
+        self.assertEqual(self.mocked_send_fcm_message.call_count, 0)  # nothing sent before the commit
+        run_commit_hooks()
 
-        self.assertEqual(self.mocked_send_fcm_message.call_count, other_participants.count() - 1)
-        self.mocked_send_fcm_message.assert_has_calls([
-            call(
-                registration_id=u.get_device().registration_id,
-                message_title=ANY,
-                message_body=ANY,
-                message_icon=ANY,
-                data_message={"type": "new-meeting", "meeting": Meeting.objects.first().id},
-                sound=ANY,
-                badge=ANY,
-            )
-            for u in other_participants.exclude(id=hidden.id)
-        ], any_order=True)
+        self.mocked_send_fcm_bulk_message.assert_called_once_with(
+            registration_ids=ANY,
+            message_title=ANY,
+            message_body=ANY,
+            message_icon=ANY,
+            data_message={"type": "new-meeting", "meeting": Meeting.objects.first().id},
+            sound=ANY,
+            badge=ANY,
+            collapse_key="meeting-{}-new-meeting".format(Meeting.objects.first().id),
+        )
+        self.assertEqual(
+            sorted(self.mocked_send_fcm_bulk_message.call_args[1]["registration_ids"]),
+            sorted(u.get_device().registration_id for u in other_participants.exclude(id=hidden.id))
+        )
 
     @authenticated
     def test_user_canceled_participation_send_push_notification_to_participants(self):
@@ -249,7 +283,11 @@ class MessagesTestCase(MockFcmMessagesMixin, APIEndpointTestCase):
             .filter(~Q(id=self.user.id) & ~Q(participant__accepted=False))\
             .all()
 
+        # the messages sent while setting the meeting up go out once it is committed
+        run_commit_hooks()
+        self.mocked_send_fcm_bulk_message.reset_mock()
         self.put(dict(accepted=False), url=API_V1 + "meetings/{}/participants/".format(meeting.id))
+        run_commit_hooks()
 
         self.mocked_send_fcm_bulk_message.assert_called_once_with(
             registration_ids=[u.get_device().registration_id for u in other_participants],
@@ -280,9 +318,12 @@ class MessagesTestCase(MockFcmMessagesMixin, APIEndpointTestCase):
             participant.arrived = True
             participant.save(update_fields=("arrived",))
 
+        # the messages sent while setting the meeting up go out once it is committed
+        run_commit_hooks()
         self.mocked_send_fcm_bulk_message.reset_mock()
 
         self.put(dict(arrived=True), url=API_V1 + "meetings/{}/participants/".format(meeting.id))
+        run_commit_hooks()
 
         participants = meeting.participants.filter(~Q(participant__accepted=False)).all()
 
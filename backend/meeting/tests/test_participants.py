@@ -1,7 +1,8 @@
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from rest_framework import status
 
-from meeting.models import Participant, Meeting
+from meeting.models import MeetingEvent, Participant, Meeting
 from test_utils import APIEndpointTestCase, API_V1, authenticated
 
 
@@ -125,3 +126,101 @@ class ParticipantsDetailsEndpointTestCase(APIEndpointTestCase):
             self.put(dict(), url=self.url.format(self.meeting.id)).status_code,
             status.HTTP_400_BAD_REQUEST
         )
+
+
+class MeetingCountersTestCase(APIEndpointTestCase):
+    number_of_other_users = 3
+
+    def setUp(self):
+        super().setUp()
+
+        self.meeting = Meeting.objects.create(organiser=self.user, status=Meeting.STATUS_PROGRESS)
+        self.participants = [
+            Participant.objects.create(meeting=self.meeting, user=user, accepted=True if user == self.user else None)
+            for user in get_user_model().objects.order_by("id")
+        ]
+
+    def counters(self):
+        return Meeting.objects\
+            .values_list("participant_count", "accepted_count", "refused_count", "arrived_count")\
+            .get(id=self.meeting.id)
+
+    def change(self, participant, **changes):
+        participant = Participant.objects.get(id=participant.id)
+        for attribute, value in changes.items():
+            setattr(participant, attribute, value)
+        participant.save()
+
+    def test_counters_follow_new_participants(self):
+        self.assertEqual(self.counters(), (4, 1, 0, 0))
+
+    def test_counters_follow_answers_and_arrivals(self):
+        self.change(self.participants[1], accepted=True)
+        self.change(self.participants[2], accepted=False)
+        self.change(self.participants[1], arrived=True)
+        self.assertEqual(self.counters(), (4, 2, 1, 1))
+
+        # canceling after arriving
+        self.change(self.participants[1], accepted=False)
+        self.assertEqual(self.counters(), (4, 1, 2, 0))
+
+    def test_meeting_ends_once_everybody_arrived_or_refused(self):
+        self.change(self.participants[1], accepted=False)
+        self.change(self.participants[2], accepted=True)
+        self.change(self.participants[3], accepted=True)
+        self.change(self.participants[0], arrived=True)
+        self.change(self.participants[2], arrived=True)
+        self.assertEqual(Meeting.objects.get(id=self.meeting.id).status, Meeting.STATUS_PROGRESS)
+
+        self.change(self.participants[3], arrived=True)
+
+        meeting = Meeting.objects.get(id=self.meeting.id)
+        self.assertEqual(meeting.status, Meeting.STATUS_ENDED)
+        self.assertIsNotNone(meeting.end_time)
+        self.assertEqual(MeetingEvent.objects.filter(type="finished-meeting").count(), 1)
+
+    def test_meeting_ended_by_a_concurrent_arrival_is_not_ended_again(self):
+        self.change(self.participants[1], accepted=True)
+        for participant in self.participants[2:]:
+            self.change(participant, accepted=False)
+        self.change(self.participants[0], arrived=True)
+
+        participant = Participant.objects.get(id=self.participants[1].id)
+        Meeting.objects.filter(id=self.meeting.id).update(status=Meeting.STATUS_ENDED)
+        participant.arrived = True
+        participant.save()
+
+        self.assertEqual(self.counters(), (4, 2, 2, 2))
+        self.assertFalse(MeetingEvent.objects.filter(type="finished-meeting").exists())
+
+    def test_change_saved_by_stale_copies_is_counted_once(self):
+        self.change(self.participants[1], accepted=True)
+        first = Participant.objects.get(id=self.participants[1].id)
+        second = Participant.objects.get(id=self.participants[1].id)
+
+        for participant in (first, second):
+            participant.arrived = True
+            participant.save()
+
+        self.assertEqual(self.counters(), (4, 2, 0, 1))
+        self.assertEqual(MeetingEvent.objects.filter(type="user-arrived-to-meeting").count(), 1)
+
+    def test_fields_not_saved_are_refreshed_from_database(self):
+        self.change(self.participants[1], accepted=True)
+        stale = Participant.objects.get(id=self.participants[1].id)
+        self.change(self.participants[1], accepted=False)
+
+        stale.arrived = True
+        stale.save(update_fields=("arrived",))
+
+        self.assertFalse(stale.accepted)
+        self.assertEqual(self.counters(), (4, 1, 1, 0))
+
+    def test_saving_stale_meeting_keeps_counters(self):
+        meeting = Meeting.objects.get(id=self.meeting.id)
+        self.change(self.participants[1], accepted=True)
+
+        meeting.meeting_time = timezone.now()
+        meeting.save()
+
+        self.assertEqual(self.counters(), (4, 2, 0, 0))
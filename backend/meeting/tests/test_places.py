@@ -1,5 +1,11 @@
+import math
+
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 
+from meeting import geohash
 from meeting.models import Place, Participant, Meeting
 from test_utils import APIEndpointTestCase, API_V1, authenticated
 
@@ -66,3 +72,84 @@ class TestMeeting(APIEndpointTestCase):
             self.put(dict(latitude=0.0042342334, longitude=0), url=self.url + "1/").status_code,
             status.HTTP_200_OK
         )
+
+    @authenticated
+    def test_updating_a_place_updates_its_geohash(self):
+        self.put(dict(latitude=46.52, longitude=6.63), url=self.url + "1/")
+
+        self.assertEqual(Place.objects.get(id=1).geohash, geohash.encode(46.52, 6.63))
+
+
+class TestGeohash(SimpleTestCase):
+    def test_geohash_of_a_position(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, precision=11), "u4pruydqqvj")
+
+    def test_geohash_of_the_edges_of_the_world(self):
+        self.assertEqual(geohash.encode_many([-90, 90], [-180, 180]), ["000000000", "zzzzzzzzz"])
+
+    def test_covering_ranges_contain_every_position_within_the_radius(self):
+        for latitude, longitude in ((46.52, 6.63), (0, 179.999), (-33.86, 151.2), (70, -20)):
+            with self.subTest(latitude=latitude, longitude=longitude):
+                ranges = geohash.covering_ranges(latitude, longitude, 1000)
+                # positions 1 km away in 8 directions
+                offsets = [(dy * 0.009, dx * 0.009 / math.cos(math.radians(latitude)))
+                           for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+                for dy, dx in offsets:
+                    position_geohash = geohash.encode(latitude + dy * 0.7, (longitude + dx * 0.7 + 180) % 360 - 180)
+                    self.assertTrue(any(lowest <= position_geohash <= highest for lowest, highest in ranges))
+
+    def test_no_ranges_for_distances_larger_than_any_cell(self):
+        self.assertEqual(geohash.covering_ranges(0, 0, 10000000), set())
+
+
+class TestNearbyPlaces(APIEndpointTestCase):
+    url = API_V1 + "meetings/places/nearby/"
+
+    def setUp(self):
+        super().setUp()
+        for name, latitude, longitude in (("near", 46.5201, 6.63), ("closest", 46.52, 6.6301), ("far", 46.6, 6.63)):
+            place = Place.objects.create(latitude=latitude, longitude=longitude, name=name)
+            Participant.objects.create(meeting=Meeting.objects.create(organiser=self.user), place=place, user=self.user)
+
+    def test_cannot_access_nearby_places_when_unauthenticated(self):
+        self.assertEqual(self.get(query_params=dict(lat=46.52, lng=6.63, radius=100)).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+    @authenticated
+    def test_nearby_places_are_ranked_by_distance(self):
+        response = self.get(query_params=dict(lat=46.52, lng=6.63, radius=1000))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([place["name"] for place in response.json()], ["closest", "near"])
+        self.assertAlmostEqual(response.json()[0]["distance"], 7.65, places=1)
+
+    @authenticated
+    def test_places_outside_the_radius_are_excluded(self):
+        self.assertEqual(
+            [place["name"] for place in self.get(query_params=dict(lat=46.52, lng=6.63, radius=9)).json()],
+            ["closest"]
+        )
+
+    @authenticated
+    def test_cannot_get_other_nearby_places(self):
+        Place.objects.create(latitude=46.52, longitude=6.63, name="other")
+
+        self.assertNotIn("other", [
+            place["name"] for place in self.get(query_params=dict(lat=46.52, lng=6.63, radius=1000)).json()
+        ])
+
+    @authenticated
+    def test_nearby_places_require_a_position_and_radius(self):
+        self.assert400WithError(self.get(query_params=dict(lat=46.52, lng=6.63)), "radius")
+        self.assert400WithError(self.get(query_params=dict(lat=100, lng=6.63, radius=10)), "lat")
+
+    @authenticated
+    def test_radius_is_limited(self):
+        self.assert400WithError(self.get(query_params=dict(lat=46.52, lng=6.63, radius=10 ** 6)), "radius")
+
+    @authenticated
+    def test_nearby_places_use_the_geohash_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get(query_params=dict(lat=46.52, lng=6.63, radius=1000))
+
+        self.assertIn('"geohash" >=', queries[-1]["sql"])
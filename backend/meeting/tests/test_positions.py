@@ -1,13 +1,25 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 from unittest.mock import ANY
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.db.models import Q
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
 
 from device.tests import create_device, MockFcmMessagesMixin
-from meeting.models import Meeting, Participant
+from meeting.meeting_point import distance
+from meeting.models import Meeting, Participant, Place, Position
+from meeting.positions import flush_pending_positions, is_within, saved_pushes
 from meeting.tests import create_meeting
-from test_utils import APIEndpointTestCase, API_V1, authenticated
+from stats.models import SavedPushesInDay
+from test_utils import APIEndpointTestCase, API_V1, authenticated, run_commit_hooks
 from user.models import Friendship
 
 __author__ = "Damien Rochat <rochat.damien@gmail.com>"
@@ -28,6 +40,7 @@ class TestPositionsEndpoint(MockFcmMessagesMixin, APIEndpointTestCase):
             Friendship(from_account=self.user, to_account=user, is_accepted=True).save()
 
         self.mocked_send_fcm_message.reset_mock()
+        cache.clear()
 
     def test_cannot_post_position_when_unauthenticated(self):
         self.assertEqual(self.post(dict()).status_code, status.HTTP_401_UNAUTHORIZED)
@@ -74,3 +87,491 @@ class TestPositionsEndpoint(MockFcmMessagesMixin, APIEndpointTestCase):
             badge=ANY,
         )
 
+
+@override_settings(POSITION_SETTINGS=dict(THROTTLE_WINDOW=60, MIN_DISTANCE=10))
+class TestPositionsThrottling(MockFcmMessagesMixin, APIEndpointTestCase):
+    url = API_V1 + "meetings/positions/"
+
+    number_of_other_users = 3
+
+    def setUp(self):
+        super().setUp()
+
+        for user in get_user_model().objects.all():
+            create_device(user)
+            Friendship(from_account=self.user, to_account=user, is_accepted=True).save()
+
+        self.meeting = create_meeting(self.user)
+        self.meeting.status = Meeting.STATUS_PROGRESS
+        self.meeting.save(update_fields=("status",))
+        # saved one by one to keep the counters of the meeting up to date
+        for participant in Participant.objects.filter(meeting=self.meeting):
+            participant.accepted = True
+            participant.save()
+
+        cache.clear()
+        saved_pushes.counts.clear()
+        self.mocked_send_fcm_bulk_message.reset_mock()
+
+    def post_position(self, latitude, longitude=0):
+        self.assertEqual(self.post(dict(latitude=latitude, longitude=longitude)).status_code, 201)
+
+    def expire_window(self):
+        cache.delete("position-window:{}:{}".format(self.meeting.id, self.user.id))
+
+    def test_distance(self):
+        self.assertAlmostEqual(distance(0, 0, 0.001, 0), 111.2, delta=0.1)
+        self.assertEqual(distance(46.5, 6.6, 46.5, 6.6), 0)
+
+    @authenticated
+    def test_positions_within_window_are_coalesced(self):
+        for i in range(5):
+            self.post_position(i / 100)
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 1)
+
+    @authenticated
+    def test_position_after_window_is_notified(self):
+        self.post_position(0)
+        self.expire_window()
+        self.post_position(0.01)
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 2)
+
+    @authenticated
+    def test_position_without_movement_is_not_notified(self):
+        self.post_position(0)
+        self.expire_window()
+        self.post_position(0.00005)
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 1)
+
+    @authenticated
+    @override_settings(POSITION_SETTINGS=dict(THROTTLE_WINDOW=0, MIN_DISTANCE=0))
+    def test_throttling_can_be_disabled(self):
+        for _ in range(3):
+            self.post_position(0)
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 3)
+
+    @authenticated
+    def test_saved_pushes_are_counted(self):
+        self.post_position(0)
+        self.post_position(0.01)
+        self.expire_window()
+        self.post_position(0.00005)
+
+        # counted in memory, until flushed
+        self.assertFalse(SavedPushesInDay.objects.exists())
+        saved_pushes.flush()
+
+        saved = SavedPushesInDay.objects.get()
+        self.assertEqual(saved.throttled, self.number_of_other_users)
+        self.assertEqual(saved.stationary, self.number_of_other_users)
+
+    @authenticated
+    def test_last_position_of_burst_is_notified_once_window_is_over(self):
+        for i in range(5):
+            self.post_position(i / 100)
+
+        self.assertEqual(flush_pending_positions(), 0)
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 1)
+
+        self.expire_window()
+        self.assertEqual(flush_pending_positions(), 1)
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 2)
+        self.assertEqual(
+            self.mocked_send_fcm_bulk_message.call_args[1]["data_message"],
+            {"type": "user-position-update", "meeting": self.meeting.id, "participant": self.user.id}
+        )
+        self.assertEqual(cache.get("position-notified:{}:{}".format(self.meeting.id, self.user.id)), (0.04, 0))
+        # a window began with the notification
+        self.post_position(0.05)
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 2)
+
+    @authenticated
+    def test_pending_position_is_replaced_by_next_notification(self):
+        self.post_position(0)
+        self.post_position(0.01)
+        self.expire_window()
+        self.post_position(0.02)
+
+        self.assertEqual(flush_pending_positions(), 0)
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 2)
+
+    @authenticated
+    def test_pending_position_is_dropped_when_back_to_notified_position(self):
+        self.post_position(0)
+        self.post_position(0.01)
+        self.post_position(0.00005)
+        self.expire_window()
+
+        self.assertEqual(flush_pending_positions(), 0)
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 1)
+
+    @authenticated
+    def test_scheduler_notifies_pending_positions(self):
+        self.post_position(0)
+        self.post_position(0.01)
+        self.expire_window()
+
+        output = StringIO()
+        call_command("schedule_meetings", once=True, stdout=output)
+
+        self.assertEqual(output.getvalue().splitlines(), ["Notified 1 pending positions"])
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 2)
+
+    @authenticated
+    def test_participant_not_accepted_is_not_notifying(self):
+        Participant.objects.filter(user=self.user).update(accepted=False)
+
+        self.post_position(0)
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 0)
+
+
+class TestPositionsStore(MockFcmMessagesMixin, APIEndpointTestCase):
+    url = API_V1 + "meetings/positions/"
+
+    number_of_other_users = 3
+
+    def setUp(self):
+        super().setUp()
+
+        for user in get_user_model().objects.all():
+            Friendship(from_account=self.user, to_account=user, is_accepted=True).save()
+
+        self.meeting = create_meeting(self.user)
+        self.meeting.status = Meeting.STATUS_PROGRESS
+        self.meeting.save(update_fields=("status",))
+        Participant.objects.filter(meeting=self.meeting).update(accepted=True)
+
+        cache.clear()
+
+    def add_positions(self, user, count):
+        now = timezone.now()
+        Position.objects.bulk_create(
+            Position.from_degrees(i, -i, meeting=self.meeting, user=user, time=now + timedelta(seconds=i))
+            for i in range(count)
+        )
+
+    @authenticated
+    def test_posted_position_is_kept_in_micro_degrees(self):
+        self.post(dict(latitude="46.778473", longitude="-6.641183"))
+
+        position = Position.objects.get()
+        self.assertEqual((position.meeting_id, position.user_id), (self.meeting.id, self.user.id))
+        self.assertEqual((position.latitude, position.longitude), (46778473, -6641183))
+        self.assertEqual(position.latitude_degrees, Decimal("46.778473"))
+
+    @authenticated
+    def test_position_is_not_kept_for_pending_meetings(self):
+        self.meeting.status = Meeting.STATUS_PENDING
+        self.meeting.save(update_fields=("status",))
+
+        self.post(dict(latitude=1, longitude=1))
+
+        self.assertFalse(Position.objects.exists())
+
+    def test_latest_position_per_participant_in_one_query(self):
+        for user in get_user_model().objects.all():
+            self.add_positions(user, user.id)
+        self.add_positions(self.user, 100)
+
+        with self.assertNumQueries(1):
+            positions = list(Position.objects.latest_per_participant(self.meeting.id).order_by("user_id"))
+
+        self.assertEqual(
+            [(position.user_id, position.latitude_degrees) for position in positions],
+            [(user.id, (100 if user == self.user else user.id) - 1) for user in get_user_model().objects.order_by("id")]
+        )
+
+    def test_latest_positions_are_per_meeting(self):
+        self.add_positions(self.user, 3)
+        self.meeting = create_meeting(self.user)
+        self.add_positions(self.user, 1)
+
+        self.assertEqual(Position.objects.latest_per_participant(self.meeting.id).get().latitude, 0)
+
+    @authenticated
+    def test_participants_get_latest_positions(self):
+        self.add_positions(self.user, 2)
+
+        response = self.get(url=API_V1 + "meetings/{}/positions/".format(self.meeting.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(position["user"], position["latitude"], position["longitude"]) for position in response.json()],
+            [(self.user.id, "1.000000", "-1.000000")]
+        )
+
+    @authenticated
+    def test_others_cannot_get_positions(self):
+        Participant.objects.filter(meeting=self.meeting, user=self.user).delete()
+
+        response = self.get(url=API_V1 + "meetings/{}/positions/".format(self.meeting.id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(POSITION_SETTINGS=dict(THROTTLE_WINDOW=60, MIN_DISTANCE=10, MAX_BATCH_SIZE=10))
+class TestPositionsBatch(MockFcmMessagesMixin, APIEndpointTestCase):
+    url = API_V1 + "meetings/positions/batch/"
+
+    number_of_other_users = 3
+
+    def setUp(self):
+        super().setUp()
+
+        for user in get_user_model().objects.all():
+            create_device(user)
+            Friendship(from_account=self.user, to_account=user, is_accepted=True).save()
+
+        self.meeting = create_meeting(self.user)
+        self.meeting.status = Meeting.STATUS_PROGRESS
+        self.meeting.save(update_fields=("status",))
+        Participant.objects.filter(meeting=self.meeting).update(accepted=True)
+
+        cache.clear()
+        self.mocked_send_fcm_bulk_message.reset_mock()
+
+    def fixes(self, count):
+        now = timezone.now()
+        return [
+            dict(latitude=i / 100, longitude=0, time=(now + timedelta(seconds=i)).isoformat()) for i in range(count)
+        ]
+
+    @authenticated
+    def test_batch_is_kept_in_a_single_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(dict(positions=self.fixes(10)), format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            len([query for query in queries if query["sql"].startswith('INSERT INTO "meeting_position"')]), 1
+        )
+        self.assertEqual(
+            list(Position.objects.order_by("time").values_list("latitude", flat=True)),
+            [i * 10000 for i in range(10)]
+        )
+
+    @authenticated
+    def test_batch_is_notified_once_per_meeting(self):
+        self.post(dict(positions=self.fixes(10)), format="json")
+
+        self.assertEqual(self.mocked_send_fcm_bulk_message.call_count, 1)
+
+    @authenticated
+    def test_batch_notifies_the_last_position(self):
+        self.post(dict(positions=self.fixes(10)), format="json")
+
+        self.assertEqual(
+            cache.get("position-notified:{}:{}".format(self.meeting.id, self.user.id)), (0.09, 0)
+        )
+
+    @authenticated
+    def test_unordered_batch_is_rejected(self):
+        response = self.post(dict(positions=list(reversed(self.fixes(2)))), format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Position.objects.exists())
+
+    @authenticated
+    def test_too_large_batch_is_rejected(self):
+        response = self.post(dict(positions=self.fixes(11)), format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @authenticated
+    def test_empty_batch_is_rejected(self):
+        response = self.post(dict(positions=[]), format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(POSITION_SETTINGS=dict(THROTTLE_WINDOW=0, MIN_DISTANCE=0))
+class TestPositionsCache(MockFcmMessagesMixin, APIEndpointTestCase):
+    url = API_V1 + "meetings/positions/"
+
+    number_of_other_users = 3
+
+    def setUp(self):
+        super().setUp()
+
+        for user in get_user_model().objects.all():
+            Friendship(from_account=self.user, to_account=user, is_accepted=True).save()
+
+        self.meeting = create_meeting(self.user)
+        self.meeting.status = Meeting.STATUS_PROGRESS
+        self.meeting.save(update_fields=("status",))
+        Participant.objects.filter(meeting=self.meeting).update(accepted=True)
+        self.positions_url = API_V1 + "meetings/{}/positions/".format(self.meeting.id)
+
+        cache.clear()
+
+    def get_positions(self, etag=None):
+        if etag is None:
+            return self.client.get(self.positions_url)
+        return self.client.get(self.positions_url, HTTP_IF_NONE_MATCH=etag)
+
+    @authenticated
+    def test_positions_are_read_from_the_cache(self):
+        self.post(dict(latitude=1, longitude=2))
+        self.get_positions()
+
+        # the version of the positions only
+        with self.assertNumQueries(1):
+            response = self.get_positions()
+
+        self.assertEqual(
+            [(position["user"], position["latitude"], position["longitude"]) for position in response.json()],
+            [(self.user.id, "1.000000", "2.000000")]
+        )
+
+    @authenticated
+    def test_positions_are_not_modified_until_someone_moves(self):
+        self.post(dict(latitude=1, longitude=2))
+        etag = self.get_positions()["ETag"]
+
+        self.assertEqual(self.get_positions(etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.post(dict(latitude=1, longitude=3))
+        response = self.get_positions(etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()[0]["longitude"], "3.000000")
+
+    @authenticated
+    def test_positions_are_evicted_when_meeting_is_over(self):
+        self.post(dict(latitude=1, longitude=2))
+        self.get_positions()
+        self.assertIsNotNone(cache.get("position-notified:{}:{}".format(self.meeting.id, self.user.id)))
+
+        self.meeting.status = Meeting.STATUS_ENDED
+        self.meeting.save()
+
+        self.assertIsNone(cache.get("position-latest:{}:{}".format(self.meeting.id, self.user.id)))
+        self.assertIsNone(cache.get("position-participants:{}".format(self.meeting.id)))
+        self.assertIsNone(cache.get("position-notified:{}:{}".format(self.meeting.id, self.user.id)))
+
+        response = self.get_positions()
+        self.assertFalse(response.has_header("ETag"))
+        self.assertEqual(len(response.json()), 1)
+
+    @authenticated
+    def test_others_cannot_get_cached_positions(self):
+        self.post(dict(latitude=1, longitude=2))
+        self.get_positions()
+        Participant.objects.filter(meeting=self.meeting, user=self.user).delete()
+        cache.set("position-participants:{}".format(self.meeting.id), set())
+
+        self.assertEqual(self.get_positions().status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestArrivalDetection(MockFcmMessagesMixin, APIEndpointTestCase):
+    url = API_V1 + "meetings/positions/"
+
+    number_of_other_users = 2
+
+    def setUp(self):
+        super().setUp()
+
+        for user in get_user_model().objects.all():
+            create_device(user)
+
+        self.place = Place.objects.create(latitude=Decimal("46.520000"), longitude=Decimal("6.630000"))
+        self.meeting = Meeting.objects.create(organiser=self.user, type=Meeting.TYPE_PLACE)
+        for user in get_user_model().objects.all():
+            Participant.objects.create(meeting=self.meeting, user=user, accepted=True, place=self.place)
+        self.meeting.status = Meeting.STATUS_PROGRESS
+        self.meeting.save(update_fields=("status",))
+
+        cache.clear()
+        run_commit_hooks()
+        self.mocked_send_fcm_bulk_message.reset_mock()
+
+    def has_arrived(self, user):
+        return Participant.objects.get(meeting=self.meeting, user=user).arrived
+
+    def test_positions_within_radius(self):
+        positions = [dict(latitude=46.53, longitude=6.63), dict(latitude=46.5203, longitude=6.6303)]
+
+        self.assertTrue(is_within(Decimal("46.52"), Decimal("6.63"), 50, positions))
+        self.assertFalse(is_within(Decimal("46.52"), Decimal("6.63"), 30, positions))
+        self.assertFalse(is_within(46.52, 6.63, 50, positions[:1]))
+
+    def test_positions_within_radius_across_the_antimeridian(self):
+        self.assertTrue(is_within(0, 179.9999, 50, [dict(latitude=0, longitude=-179.9999)]))
+        self.assertFalse(is_within(0, 179.9999, 50, [dict(latitude=0, longitude=179.99)]))
+
+    @authenticated
+    def test_participant_far_from_the_place_has_not_arrived(self):
+        self.post(dict(latitude=46.53, longitude=6.63))
+
+        self.assertFalse(self.has_arrived(self.user))
+
+    @authenticated
+    def test_participant_close_to_the_place_has_arrived(self):
+        self.post(dict(latitude=46.5002, longitude=6.63))
+        self.post(dict(latitude=46.5202, longitude=6.6302))
+        run_commit_hooks()
+
+        self.assertTrue(self.has_arrived(self.user))
+        self.assertEqual(
+            self.mocked_send_fcm_bulk_message.call_args[1]["data_message"],
+            {"type": "user-arrived-to-meeting", "meeting": self.meeting.id, "participant": self.user.id}
+        )
+
+    @authenticated
+    def test_participant_passing_by_in_a_batch_has_arrived(self):
+        now = timezone.now()
+        fixes = [
+            dict(latitude=latitude, longitude=6.63, time=(now + timedelta(seconds=i)).isoformat())
+            for i, latitude in enumerate((46.51, 46.5201, 46.53))
+        ]
+
+        self.post(dict(positions=fixes), url=self.url + "batch/", format="json")
+
+        self.assertTrue(self.has_arrived(self.user))
+
+    @authenticated
+    def test_meeting_ends_when_the_last_participant_arrives(self):
+        for participant in Participant.objects.filter(meeting=self.meeting).exclude(user=self.user):
+            participant.arrived = True
+            participant.save(update_fields=("arrived",))
+
+        self.post(dict(latitude=46.52, longitude=6.63))
+
+        self.meeting.refresh_from_db()
+        self.assertEqual(self.meeting.status, Meeting.STATUS_ENDED)
+
+    @authenticated
+    def test_participant_close_to_the_person_met_has_arrived(self):
+        other = get_user_model().objects.exclude(id=self.user.id).first()
+        Meeting.objects.filter(id=self.meeting.id).update(type=Meeting.TYPE_PERSON, on=other)
+        Participant.objects.filter(meeting=self.meeting).update(place=None)
+        Position.from_degrees(10, 20, meeting=self.meeting, user=other).save()
+
+        self.post(dict(latitude=46.52, longitude=6.63))
+        self.assertFalse(self.has_arrived(self.user))
+
+        self.post(dict(latitude="10.0002", longitude=20))
+        self.assertTrue(self.has_arrived(self.user))
+
+    @authenticated
+    def test_person_met_does_not_arrive_to_himself(self):
+        Meeting.objects.filter(id=self.meeting.id).update(type=Meeting.TYPE_PERSON, on=self.user)
+        Participant.objects.filter(meeting=self.meeting).update(place=None)
+
+        self.post(dict(latitude=46.52, longitude=6.63))
+
+        self.assertFalse(self.has_arrived(self.user))
+
+    @authenticated
+    def test_arrival_detection_can_be_disabled(self):
+        with override_settings(POSITION_SETTINGS=dict(ARRIVAL_RADIUS=0)):
+            self.post(dict(latitude=46.52, longitude=6.63))
+
+        self.assertFalse(self.has_arrived(self.user))
@@ -0,0 +1,116 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import ANY
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+
+from device.tests import create_device, MockFcmMessagesMixin
+from meeting.models import Meeting, MeetingEvent
+from meeting.scheduler import end_stale_meetings, start_due_meetings
+from meeting.tests import create_meeting
+from test_utils import APIEndpointTestCase, run_commit_hooks
+
+__author__ = "agent <agent@local>"
+
+
+@override_settings(SCHEDULER_SETTINGS=dict(MAX_DURATION=3600))
+class TestScheduler(MockFcmMessagesMixin, APIEndpointTestCase):
+    number_of_other_users = 2
+
+    def setUp(self):
+        super().setUp()
+        for user in get_user_model().objects.all():
+            create_device(user)
+        self.now = timezone.now()
+
+    def create_meeting(self, status, meeting_time=None, created=None):
+        meeting = create_meeting(self.user)
+        Meeting.objects.filter(id=meeting.id).update(
+            status=status, meeting_time=meeting_time, start_time=created or self.now
+        )
+        # the messages about the new meeting go out once it is committed
+        run_commit_hooks()
+        self.mocked_send_fcm_bulk_message.reset_mock()
+        return meeting
+
+    def test_due_meetings_are_started(self):
+        due = self.create_meeting(Meeting.STATUS_PENDING, meeting_time=self.now - timedelta(minutes=1))
+        self.create_meeting(Meeting.STATUS_PENDING, meeting_time=self.now + timedelta(minutes=1))
+        self.create_meeting(Meeting.STATUS_PENDING)
+        self.create_meeting(Meeting.STATUS_CANCELED, meeting_time=self.now - timedelta(minutes=1))
+
+        self.assertEqual(start_due_meetings(self.now), 1)
+
+        self.assertEqual(
+            list(Meeting.objects.filter(status=Meeting.STATUS_PROGRESS).values_list("id", flat=True)), [due.id]
+        )
+        self.assertEqual(
+            list(MeetingEvent.objects.values_list("meeting_id", "type")), [(due.id, "meeting-in-progress")]
+        )
+
+    def test_started_meetings_are_notified_once_committed(self):
+        meeting = self.create_meeting(Meeting.STATUS_PENDING, meeting_time=self.now)
+
+        start_due_meetings(self.now)
+        self.mocked_send_fcm_bulk_message.assert_not_called()
+        run_commit_hooks()
+
+        self.mocked_send_fcm_bulk_message.assert_called_once_with(
+            registration_ids=ANY,
+            message_title=ANY,
+            message_body=ANY,
+            message_icon=ANY,
+            data_message={"type": "meeting-in-progress", "meeting": meeting.id},
+            sound=ANY,
+            badge=ANY,
+        )
+        participants = meeting.participants.exclude(participant__accepted=False)
+        self.assertEqual(
+            sorted(self.mocked_send_fcm_bulk_message.call_args[1]["registration_ids"]),
+            sorted(user.get_device().registration_id for user in participants)
+        )
+
+    def test_stale_meetings_are_ended(self):
+        late = self.create_meeting(Meeting.STATUS_PROGRESS, meeting_time=self.now - timedelta(hours=2))
+        old = self.create_meeting(Meeting.STATUS_PROGRESS, created=self.now - timedelta(hours=2))
+        self.create_meeting(Meeting.STATUS_PROGRESS, meeting_time=self.now - timedelta(minutes=30),
+                            created=self.now - timedelta(hours=2))
+        self.create_meeting(Meeting.STATUS_PROGRESS, created=self.now - timedelta(minutes=30))
+        self.create_meeting(Meeting.STATUS_PENDING, meeting_time=self.now - timedelta(hours=2))
+
+        self.assertEqual(end_stale_meetings(self.now), 2)
+
+        ended = Meeting.objects.filter(status=Meeting.STATUS_ENDED).order_by("id")
+        self.assertEqual([meeting.id for meeting in ended], [late.id, old.id])
+        self.assertEqual({meeting.end_time for meeting in ended}, {self.now})
+
+        run_commit_hooks()
+        self.assertEqual(
+            {call[1]["data_message"]["meeting"] for call in self.mocked_send_fcm_bulk_message.call_args_list},
+            {late.id, old.id}
+        )
+
+    def test_meetings_are_changed_in_batches(self):
+        for _ in range(3):
+            self.create_meeting(Meeting.STATUS_PENDING, meeting_time=self.now)
+
+        self.assertEqual(start_due_meetings(self.now, batch_size=2), 2)
+        self.assertEqual(start_due_meetings(self.now, batch_size=2), 1)
+        self.assertEqual(start_due_meetings(self.now, batch_size=2), 0)
+
+    def test_command_starts_and_ends_meetings(self):
+        for _ in range(3):
+            self.create_meeting(Meeting.STATUS_PENDING, meeting_time=self.now - timedelta(minutes=1))
+        self.create_meeting(Meeting.STATUS_PROGRESS, created=self.now - timedelta(hours=2))
+
+        output = StringIO()
+        call_command("schedule_meetings", batch_size=2, once=True, stdout=output)
+
+        self.assertEqual(
+            output.getvalue().splitlines(), ["Started 2 and ended 1 meetings", "Started 1 and ended 0 meetings"]
+        )
+        self.assertEqual(Meeting.objects.filter(status=Meeting.STATUS_PROGRESS).count(), 3)
+        self.assertEqual(Meeting.objects.filter(status=Meeting.STATUS_ENDED).count(), 1)
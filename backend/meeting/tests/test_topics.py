@@ -0,0 +1,162 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from device.fcm import close_push_service
+from device.models import Device, OutboxMessage
+from device.stub import FCMStubServer
+from meeting.models import Meeting, Participant
+from test_utils import run_commit_hooks
+
+__author__ = "agent <agent@local>"
+
+
+class MeetingTopicsTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.server = FCMStubServer(capture=True).start()
+        self.fcm_settings = override_settings(FCM_SETTINGS=dict(
+            FCM_SERVER_KEY="key", FCM_END_POINT=self.server.url, FCM_IID_END_POINT=self.server.iid_url,
+            USE_TOPICS=True,
+        ))
+        self.fcm_settings.enable()
+        close_push_service()
+
+        self.users = [
+            get_user_model().objects.create_user(username="user-{}".format(i), email="user-{}@test.com".format(i))
+            for i in range(4)
+        ]
+        for user in self.users:
+            Device.objects.create(user=user, registration_id="token-{}".format(user.id))
+
+        self.meeting = Meeting.objects.create(organiser=self.users[0])
+        self.participants = [
+            Participant.objects.create(meeting=self.meeting, user=user, accepted=True if i == 0 else None)
+            for i, user in enumerate(self.users)
+        ]
+        self.organiser_token = "token-{}".format(self.users[0].id)
+        run_commit_hooks()
+        self.server.captured.clear()
+
+    def tearDown(self):
+        close_push_service()
+        self.fcm_settings.disable()
+        self.server.stop()
+        super().tearDown()
+
+    @property
+    def subscribers(self):
+        return self.server.topics.get(self.meeting.topic, set())
+
+    def accept(self, participant, accepted=True):
+        participant.accepted = accepted
+        participant.save()
+        run_commit_hooks()
+
+    def test_organiser_is_subscribed_when_meeting_is_created(self):
+        self.assertEqual(self.subscribers, {self.organiser_token})
+
+    def test_accepting_subscribes_device_to_meeting_topic(self):
+        self.accept(self.participants[1])
+
+        self.assertEqual(self.subscribers, {self.organiser_token, "token-{}".format(self.users[1].id)})
+
+    def test_events_are_published_once_to_the_topic(self):
+        for participant in self.participants[1:]:
+            self.accept(participant)
+        self.server.captured.clear()
+
+        participant = Participant.objects.get(id=self.participants[1].id)
+        participant.arrived = True
+        # savepoint and locked read of the participant, update, counters of the meeting, meeting, username, lock of the
+        # meeting, last event and event log, participants who did not answer, of whom there are none, end of meeting
+        # check and release of the savepoint
+        with self.assertNumQueries(12):
+            participant.save()
+        run_commit_hooks()
+
+        self.assertEqual([payload.get("to") for payload in self.server.captured], ["/topics/" + self.meeting.topic])
+
+    def test_participants_who_did_not_answer_are_sent_events_directly(self):
+        self.accept(self.participants[1])
+        self.server.captured.clear()
+
+        self.meeting.status = Meeting.STATUS_PROGRESS
+        self.meeting.save()
+        run_commit_hooks()
+
+        topics = [payload["to"] for payload in self.server.captured if "to" in payload]
+        self.assertEqual(topics, ["/topics/" + self.meeting.topic])
+        self.assertEqual(
+            [sorted(payload["registration_ids"]) for payload in self.server.captured if "registration_ids" in payload],
+            [sorted("token-{}".format(user.id) for user in self.users[2:])]
+        )
+
+    def test_canceling_participation_unsubscribes_device(self):
+        self.accept(self.participants[1])
+        self.accept(Participant.objects.get(id=self.participants[1].id), False)
+
+        self.assertEqual(self.subscribers, {self.organiser_token})
+
+    def test_refusing_does_not_subscribe(self):
+        self.accept(self.participants[1], False)
+
+        self.assertEqual(self.subscribers, {self.organiser_token})
+
+    def test_ending_meeting_unsubscribes_devices_after_notifying_them(self):
+        for participant in self.participants[1:]:
+            self.accept(participant)
+        self.server.captured.clear()
+
+        self.meeting.status = Meeting.STATUS_ENDED
+        self.meeting.save()
+        run_commit_hooks()
+
+        self.assertEqual(self.subscribers, set())
+        self.assertEqual(len(self.server.captured[0]["registration_ids"]), len(self.users))
+
+    def test_new_device_is_subscribed_to_accepted_meetings(self):
+        self.accept(self.participants[1])
+        Device.objects.filter(user=self.users[1]).delete()
+
+        Device.objects.create(user=self.users[1], registration_id="new-token")
+        run_commit_hooks()
+
+        self.assertEqual(self.subscribers, {self.organiser_token, "token-{}".format(self.users[1].id), "new-token"})
+
+    def test_topic_messages_go_through_the_outbox(self):
+        with self.settings(FCM_SETTINGS=dict(self.fcm_settings.options["FCM_SETTINGS"], USE_OUTBOX=True)):
+            self.accept(self.participants[1])
+
+            self.assertTrue(OutboxMessage.objects.filter(topic=self.meeting.topic).exists())
+
+            OutboxMessage.objects.dispatch(10)
+
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+        self.assertIn("/topics/" + self.meeting.topic, [payload.get("to") for payload in self.server.captured])
+
+    def test_subscriptions_are_not_changed_when_rolled_back(self):
+        class Rollback(Exception):
+            pass
+
+        with self.assertRaises(Rollback), transaction.atomic():
+            participant = Participant.objects.get(id=self.participants[1].id)
+            participant.accepted = True
+            participant.save()
+            raise Rollback()
+        run_commit_hooks()
+
+        self.assertEqual(self.subscribers, {self.organiser_token})
+
+    def test_subscriptions_go_through_the_outbox(self):
+        with self.settings(FCM_SETTINGS=dict(self.fcm_settings.options["FCM_SETTINGS"], USE_OUTBOX=True)):
+            self.accept(self.participants[1])
+
+            self.assertEqual(self.subscribers, {self.organiser_token})
+            self.assertTrue(OutboxMessage.objects.filter(subscription=OutboxMessage.SUBSCRIBE).exists())
+
+            OutboxMessage.objects.dispatch(10)
+
+        self.assertEqual(self.subscribers, {self.organiser_token, "token-{}".format(self.users[1].id)})
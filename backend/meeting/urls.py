@@ -3,8 +3,9 @@
 
 from django.conf.urls import url
 
-from meeting.views import MeetingListView, PlaceListView, PlaceDetailsView, ParticipantDetailsView, \
-    MeetingDetailsView,  PositionsView
+from meeting.views import MeetingListView, PlaceListView, NearbyPlaceListView, PlaceDetailsView, \
+    ParticipantDetailsView, MeetingDetailsView,  PositionsView, PositionsBatchView, MeetingPositionsView, \
+    MeetingEventsView
 
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com"
 
@@ -13,7 +14,11 @@ urlpatterns = [
     url(r"^$", MeetingListView.as_view()),
     url(r"^(?P<pk>[0-9]+)/$", MeetingDetailsView.as_view()),
     url(r"^places/$", PlaceListView.as_view()),
+    url(r"^places/nearby/$", NearbyPlaceListView.as_view()),
     url(r"^places/(?P<pk>[0-9]+)/$", PlaceDetailsView.as_view()),
     url(r"^(?P<pk>[0-9]+)/participants/$", ParticipantDetailsView.as_view()),
     url(r"^positions/$", PositionsView.as_view()),
+    url(r"^positions/batch/$", PositionsBatchView.as_view()),
+    url(r"^(?P<pk>[0-9]+)/positions/$", MeetingPositionsView.as_view()),
+    url(r"^(?P<pk>[0-9]+)/events/$", MeetingEventsView.as_view()),
 ]
@@ -1,16 +1,28 @@
 """This module defines the routes available in the `meeting` application."""
-from django.contrib.auth import get_user_model
-from django.db.models import Q
+import math
+from itertools import chain
+
+from django.conf import settings
+from django.http import Http404
+from django.utils import timezone
+from django.utils.http import parse_etags
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListCreateAPIView, ListAPIView, RetrieveUpdateAPIView, UpdateAPIView, \
     CreateAPIView, get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
 from auth.permissions import CanViewXorOwnMeeting, IsParticipantOwner
-from meeting.models import Meeting, Place, Participant
+from meeting.events import DEFAULT_BATCH_SIZE, DEFAULT_MAX_WAIT, follow_events, wait_for_events
+from meeting.models import ArchivedMeeting, ArchivedPlace, Meeting, MeetingEvent, Place, Participant
+from meeting.pagination import MeetingCursorPagination
+from meeting.positions import get_latest_positions, record_positions
+from meeting.renderers import EventStreamRenderer
 from meeting.serializers import MeetingSerializer, WriteMeetingSerializer, PlaceSerializer, ParticipantSerializer, \
-    MeetingUpdateSerializer, PositionSerializer
+    MeetingUpdateSerializer, PositionSerializer, ParticipantPositionSerializer, PositionBatchSerializer, \
+    MeetingEventSerializer, NearbyPlaceSerializer, NearbyQuerySerializer, MeetingFilterSerializer
 
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
 
@@ -76,6 +88,57 @@ class PlaceListView(ListAPIView):
         """Get all places for the registered user."""
         return Place.objects.filter(participant__user=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        """Get all places for the registered user, including those of archived meetings."""
+        places = list(self.get_queryset()) + list(ArchivedPlace.objects.filter(participant__user=request.user))
+        return Response(self.get_serializer(places, many=True).data)
+
+
+class NearbyPlaceListView(ListAPIView):
+    """
+    Returns the places known to the registered user around a position, the closest first.
+
+    This view requires users to be authenticated. It only supports GET requests, with the following query parameters:
+
+        - lat: latitude of the position, in degrees
+        - lng: longitude of the position, in degrees
+        - radius: distance around the position, in meters, at most 50 km
+
+    Places are first looked up with the index on their geohash, and only then is their exact distance computed.
+
+    This view supports multiple formats: JSon, XML, etc.
+
+    An example of data, in JSon, is:
+
+        [
+            {
+                "id": 1 (the unique id of the place)
+                "longitude": 0.151,  (with a maximum precision of 0.000001)
+                "latitude": 1.1132,  (with a maximum precision of 0.000001)
+                "name": "HEIG-VD",   (this may be null)
+                "distance": 152.3,   (the distance to the position, in meters)
+            },
+            ...
+        ]
+    """
+
+    serializer_class = NearbyPlaceSerializer
+
+    def list(self, request, *args, **kwargs):
+        """Get the places of the registered user within the distance of the position."""
+        query = NearbyQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        places = [
+            place
+            for queryset in (Place.objects, ArchivedPlace.objects)
+            for place in queryset.filter(participant__user=request.user).nearby(
+                query.validated_data["lat"], query.validated_data["lng"], query.validated_data["radius"]
+            )
+        ]
+        places.sort(key=lambda place: place.distance)
+        return Response(self.get_serializer(places, many=True).data)
+
 
 class PlaceDetailsView(RetrieveUpdateAPIView):
     """
@@ -185,21 +248,68 @@ class MeetingListView(ListCreateAPIView):
             }
 
     Please note that all dates must be given in UTC ISO full format.
+
+    Meetings are listed the most recently started first, and can be filtered with the following query parameters:
+
+        - status: only list meetings with this status, can be given several times
+        - started_after: only list meetings started at or after this time
+        - started_before: only list meetings started before this time
+
+    They are paginated when `page_size` or `cursor` is given, see `MeetingCursorPagination`.
     """
 
+    pagination_class = MeetingCursorPagination
+
     def get_queryset(self):
         """Get the queryset of all meetings related to the current user."""
-        return Meeting.objects.filter(participant__user=self.request.user)
+        return Meeting.objects.filter(participant__user=self.request.user).with_details(self.request.user)
+
+    def get_filters(self):
+        """Get the filters asked in the query parameters, see `MeetingFilterSerializer`."""
+        filters = MeetingFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        return filters.validated_data
+
+    def filter_queryset(self, queryset):
+        """
+        Filter meetings by status and start time, as asked in the query parameters.
+
+        :param queryset: QuerySet of the meetings of the user
+        :return: the filtered QuerySet, the most recently started meetings first
+        """
+        filters = self.get_filters()
+        if filters.get("status"):
+            queryset = queryset.filter(status__in=filters["status"])
+        if "started_after" in filters:
+            queryset = queryset.filter(start_time__gte=filters["started_after"])
+        if "started_before" in filters:
+            queryset = queryset.filter(start_time__lt=filters["started_before"])
+        return queryset.order_by(*MeetingCursorPagination.ordering)
 
     def list(self, request, *args, **kwargs):
         """
         List of meetings where the user is participant.
 
+        Archived meetings are listed along with the others, unless only meetings which are not over are asked for.
+
         :param request: the HTTP request done
         :return a 400 or 201 response depending on whether the data was correct or not.
         """
         self.serializer_class = MeetingSerializer
-        return ListCreateAPIView.list(self, request, *args, **kwargs)
+
+        querysets = [self.filter_queryset(self.get_queryset())]
+        statuses = self.get_filters().get("status")
+        if not statuses or statuses & {Meeting.STATUS_ENDED, Meeting.STATUS_CANCELED}:
+            querysets.append(self.filter_queryset(
+                ArchivedMeeting.objects.filter(participant__user=request.user).with_details(request.user)
+            ))
+
+        page = self.paginator.paginate_querysets(querysets, request)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+        meetings = sorted(chain.from_iterable(querysets), key=MeetingCursorPagination.position, reverse=True)
+        return Response(self.get_serializer(meetings, many=True).data)
 
     def create(self, request, *args, **kwargs):
         """
@@ -277,6 +387,18 @@ class MeetingDetailsView(RetrieveUpdateAPIView):
         """No filter."""
         return Meeting.objects
 
+    def get_object(self):
+        """Get the meeting, which is looked for in the archive as well when it is only read."""
+        try:
+            return super().get_object()
+        except Http404:
+            if self.request.method != "GET":
+                raise
+
+        meeting = get_object_or_404(ArchivedMeeting.objects.with_details(self.request.user), pk=self.kwargs["pk"])
+        self.check_object_permissions(self.request, meeting)
+        return meeting
+
     def retrieve(self, *args, **kwargs):
         """
         Override API retrieve method.
@@ -300,7 +422,8 @@ class PositionsView(CreateAPIView):
     """
     Allow to post a new position, related to the current logged in user.
 
-    The given position will be send to all the others participants.
+    The given position is kept for each meeting in progress the user accepted, and will be send to all the others
+    participants.
 
     This view requires the user to be authenticated.
 
@@ -325,31 +448,165 @@ class PositionsView(CreateAPIView):
         """
         Post a new position.
 
-        It will send the position to the participants of each meetings in progress,
-        where the user is active.
+        It will keep the position and send it to the participants of each meetings in progress,
+        where the user is active. Notifications are throttled, see `meeting.positions`.
 
         :param request: the HTTP request done
         :return a 400 or 201 response depending on whether the data was correct or not.
         """
         serializer = PositionSerializer(data=request.data)
         if serializer.is_valid():
+            record_positions(self.request.user, [dict(serializer.validated_data, time=timezone.now())])
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class PositionsBatchView(CreateAPIView):
+    """
+    Allow to post several positions at once, related to the current logged in user.
 
-            for meeting in Meeting.objects\
-                    .filter(Q(participant__user_id=self.request.user) & Q(status=Meeting.STATUS_PROGRESS))\
-                    .all():
+    This allows devices to send the positions they collected since their last upload in a single request. The positions
+    are handled as if they were posted one by one, see `PositionsView`, except that each meeting is only notified once,
+    of the last position.
 
-                participants = get_user_model().objects\
-                    .filter(Q(participant__meeting_id=meeting.id) & Q(participant__accepted=True))
+    This view requires the user to be authenticated.
+
+    This view supports multiple formats : JSon, XML, etc.
 
-                participant = participants.get(id=self.request.user.id)
-                other_participants = participants.filter(~Q(id=self.request.user.id)).all()
+    POST requests:
 
-                other_participants.send_message(
-                    title="New position",
-                    body="{} position changed".format(participant.username),
-                    data=dict(type="user-position-update", meeting=meeting.id, participant=participant.id),
-                    deferred=False,
-                )
+        The view expects the following parameters (example in JSon):
 
+            {
+                "positions": [  (ordered by time, at most `MAX_BATCH_SIZE` of `POSITION_SETTINGS`)
+                    {
+                        "latitude": 0.61,
+                        "longitude": 0.6,
+                        "time": "2016-12-14T19:32:13.792217Z",  (the time at which the position was taken)
+                    },
+                    ...
+                ]
+            }
+
+        - On success will return a 201 CREATED.
+        - On error will send a 400, 401 depending on the error, with a message explaining it.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def create(self, request, *args, **kwargs):
+        """
+        Post new positions.
+
+        :param request: the HTTP request done
+        :return a 400 or 201 response depending on whether the data was correct or not.
+        """
+        serializer = PositionBatchSerializer(data=request.data)
+        if serializer.is_valid():
+            record_positions(self.request.user, serializer.validated_data["positions"])
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MeetingPositionsView(ListAPIView):
+    """
+    Returns the last known position of each participant of a meeting.
+
+    This view requires the user to be authenticated and to participate in the meeting. It only supports GET requests.
+
+    This view supports multiple formats: JSon, XML, etc.
+
+    An example of data, in JSon, is:
+
+        [
+            {
+                "user": 2,  (the user id)
+                "latitude": "0.610000",  (the latitude of the participant)
+                "longitude": "0.600000",  (the longitude of the participant)
+                "time": "2016-12-14T19:32:13.792217Z",  (the time at which the position was posted)
+            },
+            ...
+        ]
+
+    Participants who never posted a position while the meeting was in progress are not listed.
+
+    While the meeting is in progress, positions are read from the cache and the response has an ETag. When it is given
+    back in an If-None-Match header and no participant moved since, a 304 NOT MODIFIED is returned instead.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    serializer_class = ParticipantPositionSerializer
+
+    def list(self, request, *args, **kwargs):
+        """Get the last position of every participant of the meeting, if the user participates in it."""
+        version, positions = get_latest_positions(int(self.kwargs["pk"]), request.user.id)
+
+        if version is None:
+            return Response(self.get_serializer(positions, many=True).data)
+
+        etag = '"{}-{}"'.format(self.kwargs["pk"], version)
+        if etag.strip('"') in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(self.get_serializer(positions, many=True).data, headers={"ETag": etag})
+
+
+class MeetingEventsView(ListAPIView):
+    """
+    Allows participants of a meeting to follow its events live, with long polling.
+
+    This view requires the user to be authenticated and to participate in the meeting. It only supports GET requests.
+
+    Requests wait until there are events newer than the one given, or until `wait` seconds elapsed (at most `MAX_WAIT`
+    of `EVENT_SETTINGS`), and then return the events, which is an empty list if none came. Participants who keep
+    sending requests are not sent push notifications about the meeting, see `meeting.events`.
+
+    The last event received is given either as the `after` query parameter, or in the Last-Event-ID header. All the
+    events of the meeting are returned when none is given, in batches of `BATCH_SIZE`.
+
+    This view supports multiple formats: JSon, XML, etc. and server-sent events (text/event-stream), in which case each
+    response is a stream of the events, ending with the request.
+
+    An example of data, in JSon, is:
+
+        [
+            {
+                "id": 12,  (the sequence number of the event in the meeting, giving their order)
+                "type": "user-accepted-meeting",  (the type of the event, as for push notifications)
+                "data": {  (the data of the event, as for push notifications)
+                    "type": "user-accepted-meeting",
+                    "meeting": 1,
+                    "participant": 2,
+                },
+                "time": "2016-12-14T19:32:13.792217Z",  (the time at which the event happened)
+            },
+            ...
+        ]
+    """
+
+    permission_classes = (IsAuthenticated,)
+    serializer_class = MeetingEventSerializer
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (EventStreamRenderer,)
+
+    def list(self, request, *args, **kwargs):
+        """Wait for the events of the meeting following the last one received."""
+        meeting = get_object_or_404(Meeting.objects.filter(participant__user=request.user), pk=self.kwargs["pk"])
+
+        event_settings = getattr(settings, "EVENT_SETTINGS", {})
+        max_wait = event_settings.get("MAX_WAIT", DEFAULT_MAX_WAIT)
+        try:
+            after = int(request.META.get("HTTP_LAST_EVENT_ID", request.query_params.get("after", 0)))
+            wait = float(request.query_params.get("wait", max_wait))
+        except ValueError:
+            raise ValidationError("The last event id and the time to wait must be numbers.")
+        if math.isnan(wait) or wait < 0:
+            raise ValidationError("The time to wait must be a positive number.")
+        wait = min(wait, max_wait)
+
+        follow_events(meeting.id, request.user.id, wait)
+        events = wait_for_events(
+            MeetingEvent.objects
+                        .filter(meeting_id=meeting.id, sequence__gt=after)
+                        .order_by("sequence")[:event_settings.get("BATCH_SIZE", DEFAULT_BATCH_SIZE)],
+            wait
+        )
+        return Response(self.get_serializer(events, many=True).data)
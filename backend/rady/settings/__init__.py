@@ -119,3 +119,26 @@ TEST_RUNNER = "rady.tests.RadyTestRunner"
 
 
 THUMBNAILS_SIZE = (150, 150)
+
+
+POSITION_SETTINGS = {
+    "THROTTLE_WINDOW": 15,
+    "MIN_DISTANCE": 10,
+    "MAX_BATCH_SIZE": 500,
+    "MEETING_POINT": "median",
+    "ARRIVAL_RADIUS": 50,
+    "STATS_FLUSH_INTERVAL": 60,
+}
+
+
+EVENT_SETTINGS = {
+    "MAX_WAIT": 25,
+    "POLL_INTERVAL": 1,
+    "BATCH_SIZE": 100,
+    "GRACE": 10,
+}
+
+
+SCHEDULER_SETTINGS = {
+    "MAX_DURATION": 6 * 60 * 60,
+}
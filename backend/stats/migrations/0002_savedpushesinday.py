@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 15:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavedPushesInDay',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('throttled', models.PositiveIntegerField(default=0)),
+                ('stationary', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.5 on 2026-10-18 15:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0002_savedpushesinday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushStatisticsInDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('type', models.CharField(blank=True, max_length=64)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('tokens', models.PositiveIntegerField(default=0)),
+                ('success', models.PositiveIntegerField(default=0)),
+                ('failure', models.PositiveIntegerField(default=0)),
+                ('deactivated', models.PositiveIntegerField(default=0)),
+                ('deferred', models.PositiveIntegerField(default=0)),
+                ('latency', models.FloatField(default=0)),
+                ('latency_histogram', jsonfield.fields.JSONField(default=list)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pushstatisticsinday',
+            unique_together=set([('day', 'type')]),
+        ),
+    ]
@@ -1,13 +1,118 @@
 """Contains all models from the `meeting` module."""
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
+from jsonfield import JSONField
 
 
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
 
 
+# upper bounds, in milliseconds, of the buckets of the push latency histograms, a last bucket holds slower requests
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def merge_histograms(*histograms):
+    """
+    Add latency histograms together.
+
+    :param histograms: lists of counts, one for each bucket of `LATENCY_BUCKETS` and one for slower requests
+    :return: the count of every bucket, over all histograms
+    """
+    merged = [0] * (len(LATENCY_BUCKETS) + 1)
+    for histogram in histograms:
+        for index, count in enumerate(histogram):
+            merged[index] += count
+    return merged
+
+
+def latency_percentile(histogram, percentile):
+    """
+    Estimate a percentile of the latency from an histogram.
+
+    :param histogram: count of every bucket of `LATENCY_BUCKETS`, and of slower requests
+    :param percentile: percentile to get, between 0 and 100
+    :return: the upper bound of the bucket holding the percentile, in milliseconds, None if there is no request. The
+             bound of the last bucket is given when the percentile is slower than it.
+    """
+    total = sum(histogram)
+    if total == 0:
+        return None
+
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, histogram):
+        seen += count
+        if seen >= total * percentile / 100:
+            return bound
+    return LATENCY_BUCKETS[-1]
+
+
 class UserActiveInMonth(models.Model):
     """This model contains information about users that logged in during a given month."""
 
     month = models.DateField(primary_key=True)
     users = models.PositiveIntegerField(default=0)
+
+
+class SavedPushesInDay(models.Model):
+    """This model contains the number of position notifications which were not sent during a given day."""
+
+    day = models.DateField(primary_key=True)
+    throttled = models.PositiveIntegerField(default=0)
+    stationary = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def record(cls, reason, pushes, day=None):
+        """
+        Count pushes which were not sent on a day.
+
+        :param reason: why pushes were not sent, either "throttled" or "stationary"
+        :param pushes: number of pushes saved
+        :param day: day on which the pushes were not sent, today by default
+        """
+        saved, _ = cls.objects.get_or_create(day=day or timezone.now().date())
+        setattr(saved, reason, F(reason) + pushes)
+        saved.save(update_fields=(reason,))
+
+
+class PushStatisticsInDay(models.Model):
+    """
+    This model contains metrics about the push notifications of a given type sent during a given day.
+
+    The type of a notification is the "type" of its data payload, such as "new-meeting" or "friend-request".
+    """
+
+    day = models.DateField()
+    type = models.CharField(max_length=64, blank=True)
+    requests = models.PositiveIntegerField(default=0)
+    tokens = models.PositiveIntegerField(default=0)
+    success = models.PositiveIntegerField(default=0)
+    failure = models.PositiveIntegerField(default=0)
+    deactivated = models.PositiveIntegerField(default=0)
+    deferred = models.PositiveIntegerField(default=0)
+    latency = models.FloatField(default=0)
+    latency_histogram = JSONField(default=list)
+
+    class Meta:
+        """Metaclass for the `PushStatisticsInDay` model."""
+
+        unique_together = ("day", "type")
+
+    @classmethod
+    def record(cls, message_type, latency_histogram, **counts):
+        """
+        Add metrics to the ones of today.
+
+        :param message_type: type of the notifications
+        :param latency_histogram: count of requests in every bucket of `LATENCY_BUCKETS`
+        :param counts: number of requests, tokens, success, failure, deactivated and deferred, and total latency
+        """
+        today = timezone.now().date()
+        with transaction.atomic():
+            cls.objects.get_or_create(day=today, type=message_type)
+            statistics = cls.objects.select_for_update().get(day=today, type=message_type)
+            for field, count in counts.items():
+                setattr(statistics, field, getattr(statistics, field) + count)
+            statistics.latency_histogram = merge_histograms(statistics.latency_histogram, latency_histogram)
+            statistics.save()
@@ -0,0 +1,93 @@
+from django.test import TestCase, override_settings
+
+from device.metrics import push_metrics, PushMetrics
+from device.tests import create_device, MockFcmMessagesMixin
+from stats.models import latency_percentile, PushStatisticsInDay
+from test_utils import APIEndpointTestCase, API_V1, authenticated
+
+
+class TestPushMetrics(TestCase):
+    def test_workers_metrics_are_added_together(self):
+        for _ in range(2):
+            metrics = PushMetrics()
+            metrics.record_request("new-meeting", tokens=3, latency=0.02)
+            metrics.record_outcome("new-meeting", success=2, failure=1)
+            metrics.flush()
+
+        statistics = PushStatisticsInDay.objects.get(type="new-meeting")
+        self.assertEqual((statistics.requests, statistics.tokens, statistics.success, statistics.failure), (2, 6, 4, 2))
+        self.assertEqual(latency_percentile(statistics.latency_histogram, 50), 25)
+
+    def test_flush_clears_recorded_metrics(self):
+        metrics = PushMetrics()
+        metrics.record_outcome("new-meeting", deferred=1)
+        metrics.flush()
+        metrics.flush()
+
+        self.assertEqual(PushStatisticsInDay.objects.get(type="new-meeting").deferred, 1)
+
+    @override_settings(FCM_SETTINGS=dict(METRICS_FLUSH_INTERVAL=0))
+    def test_metrics_are_not_written_in_a_transaction(self):
+        metrics = PushMetrics()
+        metrics.record_outcome("new-meeting", success=1)
+        metrics.maybe_flush()
+
+        self.assertFalse(PushStatisticsInDay.objects.exists())
+
+    def test_latency_percentile(self):
+        self.assertIsNone(latency_percentile([], 50))
+        self.assertEqual(latency_percentile([1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0], 50), 10)
+        self.assertEqual(latency_percentile([1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0], 99), 25)
+        self.assertEqual(latency_percentile([0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1], 99), 10000)
+
+
+class TestPushStatistics(MockFcmMessagesMixin, APIEndpointTestCase):
+    url = API_V1 + "statistics/pushes/"
+
+    def setUp(self):
+        super().setUp()
+        push_metrics.counters.clear()
+        push_metrics.histograms.clear()
+
+    @authenticated
+    def test_statistics_require_an_administrator(self):
+        self.assertEqual(self.get().status_code, 403)
+
+    @authenticated
+    def test_outcomes_are_counted_per_type(self):
+        self.user.is_staff = True
+        self.user.save()
+        device = create_device(self.user)
+
+        self.mocked_send_fcm_message.return_value = dict(success=1, results=[dict(message_id="1")])
+        device.send_message(title="title", data=dict(type="friend-request"))
+        self.mocked_send_fcm_message.return_value = dict(success=0, results=[dict(error="NotRegistered")])
+        device.send_message(title="title", data=dict(type="friend-request"))
+        device.send_message(title="title")
+        push_metrics.flush()
+
+        types = self.get().json()["types"]
+
+        self.assertEqual([statistics["type"] for statistics in types], ["", "friend-request"])
+        self.assertEqual(
+            {key: types[1][key] for key in ("requests", "tokens", "success", "failure", "deactivated", "deferred")},
+            dict(requests=2, tokens=2, success=1, failure=1, deactivated=1, deferred=1),
+        )
+        self.assertEqual(types[1]["tokens_per_request"], 1)
+        self.assertEqual(sum(bucket["count"] for bucket in types[1]["latency_histogram"]), 2)
+
+    @authenticated
+    def test_outcomes_are_counted_per_day(self):
+        self.user.is_staff = True
+        self.user.save()
+        device = create_device(self.user)
+
+        self.mocked_send_fcm_message.return_value = dict(success=1, results=[dict(message_id="1")])
+        device.send_message(title="title", data=dict(type="friend-request"))
+        device.send_message(title="title", data=dict(type="new-meeting"))
+        push_metrics.flush()
+
+        daily = self.get().json()["daily"]
+
+        self.assertEqual([day["number"] for day in daily["success"]], [2])
+        self.assertEqual([day["number"] for day in daily["failure"]], [0])
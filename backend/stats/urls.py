@@ -3,11 +3,12 @@
 
 from django.conf.urls import url
 
-from stats.views import StatisticsView
+from stats.views import PushStatisticsView, StatisticsView
 
 
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com"
 
 urlpatterns = [
     url(r"^$", StatisticsView.as_view()),
+    url(r"^pushes/$", PushStatisticsView.as_view()),
 ]
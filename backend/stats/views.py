@@ -2,7 +2,7 @@
 
 
 from decimal import Decimal
-from django.db.models import Count, FloatField
+from django.db.models import Count, FloatField, Sum
 from django.db.models import ExpressionWrapper
 from django.db.models import F
 from django.db.models.functions import TruncDay
@@ -11,13 +11,16 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from meeting.models import Meeting, Participant
-from stats.models import UserActiveInMonth
+from stats.models import latency_percentile, LATENCY_BUCKETS, merge_histograms, PushStatisticsInDay, \
+    SavedPushesInDay, UserActiveInMonth
 from user.models import User
 
 
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
 
 
+PUSH_OUTCOMES = ("requests", "tokens", "success", "failure", "deactivated", "deferred")
+
 meeting_per_users = ExpressionWrapper(
     Count("id", distinct=True) * Decimal("1.0") / Count("user", distinct=True),
     output_field=FloatField()
@@ -60,6 +63,14 @@ class StatisticsView(APIView):
                 },
                 ...
             ],
+            saved_pushes: [
+                {
+                    day: 2017-01-01 (an ECMA-262 formatted date),
+                    throttled: 10 (number of position pushes not sent as too close to the previous one),
+                    stationary: 10 (number of position pushes not sent as the user did not move enough),
+                },
+                ...
+            ],
             total_users: 10 (total number of users registered),
             total_meetings: 130 (total number of meetings done),
         }
@@ -85,6 +96,111 @@ class StatisticsView(APIView):
                                                     .annotate(day=F("month"))
                                                     .values("day", "number")
                                                     .all(),
+            saved_pushes=SavedPushesInDay.objects.values("day", "throttled", "stationary").all(),
             total_users=User.objects.count(),
             total_meetings=Meeting.objects.count(),
         ))
+
+
+class PushStatisticsView(APIView):
+    """
+    This view allows users to get metrics about the push notifications sent.
+
+    This view requires user to be an administrator to get access to it.
+
+    This view only supports GET requests.
+
+    It will return a 200 OK if the user has the right, with the payload described below.
+    It will return a 403 FORBIDDEN if the user is not administrator.
+
+    This view supports multiple formats: JSon, XML, etc.
+
+    Latencies are in milliseconds, percentiles being the upper bound of the histogram bucket in which they are.
+
+    An example response would be :
+        {
+            daily: {
+                requests: [
+                    {
+                        day: 2017-01-01 (an ECMA-262 formatted date),
+                        number: 10 (number of requests made to FCM this day),
+                    },
+                    ...
+                ],
+                tokens: [...] (number of devices targeted),
+                success: [...] (number of devices to which a push was delivered),
+                failure: [...] (number of devices to which a push could not be delivered),
+                deactivated: [...] (number of devices deactivated as FCM will never accept them again),
+                deferred: [...] (number of pushes kept to be sent later),
+            },
+            types: [
+                {
+                    type: "new-meeting" (type of the data payload of the pushes),
+                    requests: 10,
+                    tokens: 20,
+                    tokens_per_request: 2.0,
+                    success: 18,
+                    failure: 2,
+                    deactivated: 1,
+                    deferred: 1,
+                    latency_mean: 42.5,
+                    latency_p50: 50,
+                    latency_p99: 250,
+                    latency_histogram: [
+                        {
+                            le: 10 (upper bound of the bucket, null for the last one),
+                            count: 2 (number of requests in the bucket),
+                        },
+                        ...
+                    ],
+                },
+                ...
+            ],
+        }
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, *args, **kwargs):
+        """Get the push metrics, per day and per type of push."""
+        types = PushStatisticsInDay.objects.values("type").annotate(
+            latency=Sum("latency"), **{outcome: Sum(outcome) for outcome in PUSH_OUTCOMES}
+        ).order_by("type")
+
+        histograms = {}
+        for statistics in PushStatisticsInDay.objects.only("type", "latency_histogram"):
+            histograms[statistics.type] = merge_histograms(histograms.get(statistics.type, []),
+                                                           statistics.latency_histogram)
+
+        return Response(dict(
+            daily={
+                outcome: PushStatisticsInDay.objects
+                                            .values("day")
+                                            .annotate(number=Sum(outcome))
+                                            .order_by("day")
+                                            .all()
+                for outcome in PUSH_OUTCOMES
+            },
+            types=[self.describe(statistics, histograms[statistics["type"]]) for statistics in types],
+        ))
+
+    @staticmethod
+    def describe(statistics, histogram):
+        """
+        Add the latency metrics to the statistics of a type of push.
+
+        :param statistics: total of every outcome, and of the latency, for the type of push
+        :param histogram: latency histogram of the type of push
+        """
+        latency = statistics.pop("latency")
+        requests = statistics["requests"]
+        return dict(
+            statistics,
+            tokens_per_request=statistics["tokens"] / requests if requests else None,
+            latency_mean=latency / requests if requests else None,
+            latency_p50=latency_percentile(histogram, 50),
+            latency_p99=latency_percentile(histogram, 99),
+            latency_histogram=[
+                dict(le=bound, count=count) for bound, count in zip(LATENCY_BUCKETS + (None,), histogram)
+            ],
+        )
@@ -1,5 +1,6 @@
 from abc import abstractmethod
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from functools import wraps
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -30,6 +31,18 @@ def authenticated(f):
     return _decorator
 
 
+def run_commit_hooks():
+    """
+    Run the functions registered with `transaction.on_commit`.
+
+    Test cases run in a transaction which is never committed, this allows to check what happens once it would be.
+    """
+    connection = transaction.get_connection()
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
 class APIEndpointTestCase(APITestCase):
     format = "json"
     user = None
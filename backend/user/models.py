@@ -14,6 +14,7 @@ from django.db import models
 from django.db import transaction
 from popo_attribute_tracker.attribute_tracker import AttributeTrackerMixin
 
+from device.collector import get_collector
 from device.models import Device, DeferredMessage
 
 __author__ = "Benjamin Schubert <ben.c.schubert@gmail.com>"
@@ -79,8 +80,13 @@ class UserQuerySet(models.query.QuerySet):
         Utility to send a push message to the users.
 
         See Device.send_message for more information.
+        Within `collect_messages`, the message is only collected, see `device.collector`.
         """
-        Device.objects.filter(user__in=self.all()).send_message(**args)
+        collector = get_collector()
+        if collector is not None:
+            collector.add(self.values_list("id", flat=True), **args)
+        else:
+            Device.objects.filter(user__in=self.all()).send_message(**args)
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -145,7 +151,13 @@ class User(AbstractBaseUser, PermissionsMixin):
         Send a push message to the device of the user.
 
         See Device.send_message for more information.
+        Within `collect_messages`, the message is only collected, see `device.collector`.
         """
+        collector = get_collector()
+        if collector is not None:
+            collector.add([self.id], **args)
+            return
+
         device = self.get_device()
         if device is not None:
             device.send_message(**args)
@@ -154,13 +166,11 @@ class User(AbstractBaseUser, PermissionsMixin):
         """
         Try to send eventually pending push notifications to the current registered device.
 
-        Stop on first failed sent.
+        See Device.send_deferred_messages for more information.
         """
         device = self.get_device()
         if device is not None:
-            for message in DeferredMessage.objects.filter(user=self):
-                if device.send_deferred_message(message) is False:
-                    return
+            device.send_deferred_messages(DeferredMessage.objects.filter(user=self).pending())
 
 
 class Friendship(models.Model, AttributeTrackerMixin):
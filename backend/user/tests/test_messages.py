@@ -34,6 +34,7 @@ class MessagesTestCase(MockFcmMessagesMixin, APIEndpointTestCase):
             data_message={"type": "friend-request", "friendship": Friendship.objects.first().id},
             sound=ANY,
             badge=ANY,
+            collapse_key="friendship-{}-friend-request".format(Friendship.objects.first().id),
         )
 
     @authenticated
@@ -54,15 +55,16 @@ class MessagesTestCase(MockFcmMessagesMixin, APIEndpointTestCase):
             data_message={"type": "friend-request-accepted", "friendship": friendship.id},
             sound=ANY,
             badge=ANY,
+            collapse_key="friendship-{}-friend-request-accepted".format(friendship.id),
         )
 
     @authenticated
     def test_try_to_send_deferred_messages_on_device_registration(self):
-        self.mocked_send_fcm_message.return_value = dict(success=0)
+        self.mocked_send_fcm_message.return_value = dict(success=0, results=[dict(error="NotRegistered")])
 
         device = self.user.get_device()
-        device.send_message()
-        device.send_message()
+        device.send_message(title="first")
+        device.send_message(title="second")
 
         self.mocked_send_fcm_message.reset_mock()
         self.mocked_send_fcm_message.return_value = dict(success=1)
@@ -29,8 +29,26 @@ DATABASES = {
     }
 }
 
+# shared by all workers, create the table with `manage.py createcachetable`
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "rady_cache",
+        "OPTIONS": {
+            # a few entries per participant of the meetings in progress, see `meeting.positions`
+            "MAX_ENTRIES": 100000,
+        },
+    }
+}
+
 FCM_SETTINGS = {
-    "FCM_SERVER_KEY": "CENSORED"
+    "FCM_SERVER_KEY": "CENSORED",
+    "USE_OUTBOX": True,
+    "DEFERRED_MESSAGE_TTL": {
+        "default": 24 * 60 * 60,
+        "friend-request": 30 * 24 * 60 * 60,
+        "friend-request-accepted": 7 * 24 * 60 * 60,
+    },
 }
 
 
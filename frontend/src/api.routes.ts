@@ -10,4 +10,6 @@ export const ACCOUNT_URL = BASE_URL + "users/me/";
 
 export const STATS_URL = BASE_URL + "statistics/";
 
+export const PUSH_STATS_URL = STATS_URL + "pushes/";
+
 export const USERS_URL = BASE_URL + "admin/users/";
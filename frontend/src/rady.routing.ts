@@ -1,5 +1,6 @@
 import { Routes, RouterModule } from "@angular/router";
 import { StatsComponent } from "./stats/stats.component";
+import { PushStatsComponent } from "./stats/push-stats.component";
 import { LoginComponent } from "./auth/login.component";
 import { LogoutGuard, AdminGuard } from "./auth/guards/login.guard";
 import { UserComponent } from "./users/user.component";
@@ -22,6 +23,11 @@ const routes: Routes = [
                 path: "stats",
 
             },
+            {
+                canActivate: [AdminGuard],
+                component: PushStatsComponent,
+                path: "pushes",
+            },
             {
                 canActivate: [LogoutGuard],
                 component: LoginComponent,
@@ -0,0 +1,99 @@
+import { Component, ViewChild } from "@angular/core";
+import { PushStatisticsService } from "./push-stats.service";
+import { IPushStatistics, IChartData, DataContainer, getChartOptions } from "./stubs";
+import { ChartComponent } from "../utils/components/chart.component";
+
+
+/**
+ * Component to display metrics about the push notifications sent
+ */
+@Component({
+    styleUrls: ["./stats.scss"],
+    templateUrl: "./push-stats.html",
+})
+export class PushStatsComponent {
+    /**
+     * Data we want to display in our graph
+     */
+    public data: IChartData;
+
+    /**
+     * Defines options to send to the chart
+     */
+    // tslint:disable-next-line:no-any
+    public options: any;
+
+    // reference to the chart component
+    @ViewChild(ChartComponent) public chart: ChartComponent;
+
+    // outcomes of push notifications we display
+    private datasetLabels = {
+        deactivated: {
+            backgroundColor: "#e5a100",
+            borderColor: "#e5a100",
+            fill: false,
+            label: "Deactivated devices",
+        },
+        deferred: {
+            backgroundColor: "#0073e5",
+            borderColor: "#0073e5",
+            fill: false,
+            label: "Deferred pushes",
+        },
+        failure: {
+            backgroundColor: "#a94442",
+            borderColor: "#a94442",
+            fill: false,
+            label: "Failed pushes",
+        },
+        success: {
+            backgroundColor: "rgba(71, 188, 47, 0.91)",
+            borderColor: "rgba(71, 188, 47, 0.91)",
+            fill: false,
+            label: "Delivered pushes",
+        },
+    };
+
+    // defines the default precision to display in the graph
+    private defaultPrecision: string = DataContainer.DAY;
+
+    // wrapper that contains the data we want to display
+    private dataContainer: DataContainer;
+
+    constructor(public service: PushStatisticsService) {
+        this.dataContainer = new DataContainer(this.datasetLabels);
+        this.data = this.dataContainer.getData(this.defaultPrecision);
+        this.options = getChartOptions(this.defaultPrecision);
+
+        service.$.subscribe((stats: IPushStatistics) => {
+            if (stats === null) {
+                return;
+            }
+
+            this.dataContainer.updateData({
+                deactivated: stats.daily["deactivated"],
+                deferred: stats.daily["deferred"],
+                failure: stats.daily["failure"],
+                success: stats.daily["success"],
+            });
+            this.data = this.dataContainer.getData(this.defaultPrecision);
+        });
+    }
+
+    /**
+     * Show the metrics for the given precision
+     *
+     * @param precision for which to show metrics
+     */
+    public showStats(precision: string) {
+        this.data = this.dataContainer.getData(precision);
+        this.options = getChartOptions(precision);
+    }
+
+    /**
+     * Reset the chart zoom to its original value
+     */
+    public resetZoom() {
+        this.chart.resetZoom();
+    }
+}
@@ -0,0 +1,19 @@
+import { Observable } from "rxjs/Observable";
+import { Injectable } from "@angular/core";
+import { Http } from "@angular/http";
+import { IPushStatistics } from "./stubs";
+import { PUSH_STATS_URL } from "../api.routes";
+import { RestService } from "../base/rest.service";
+
+
+/**
+ * This is a service that allows to fetch metrics about push notifications
+ */
+@Injectable()
+export class PushStatisticsService extends RestService<IPushStatistics> {
+    constructor(http: Http) {
+        super(PUSH_STATS_URL, http);
+        let updateInterval = 1000 * 60; // Update every minute, as metrics are written by workers every minute
+        Observable.timer(updateInterval, updateInterval).subscribe(() => this.fetch());
+    }
+}
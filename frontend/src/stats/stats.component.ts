@@ -1,6 +1,6 @@
 import { Component, ViewChild } from "@angular/core";
 import { StatisticsService } from "./stats.service";
-import { IStatistics, IChartData, DataContainer } from "./stubs";
+import { IStatistics, IChartData, DataContainer, getChartOptions } from "./stubs";
 import { ChartComponent } from "../utils/components/chart.component";
 
 
@@ -57,7 +57,7 @@ export class StatsComponent {
     constructor(public service: StatisticsService) {
         this.dataContainer = new DataContainer(this.datasetLabels);
         this.data = this.dataContainer.getData(this.defaultPrecision);
-        this.options = this.getOptions(this.defaultPrecision);
+        this.options = getChartOptions(this.defaultPrecision);
 
         service.$.subscribe((stats: IStatistics) => {
             if (stats === null) {
@@ -80,7 +80,7 @@ export class StatsComponent {
      */
     public showStats(precision: string) {
         this.data = this.dataContainer.getData(precision);
-        this.options = this.getOptions(precision);
+        this.options = getChartOptions(precision);
     }
 
     /**
@@ -90,75 +90,4 @@ export class StatsComponent {
         this.chart.resetZoom();
     }
 
-    /**
-     * Get the options for the given precision.
-     *
-     * @param precision for which to get the options
-     */
-    private getOptions(precision: string) {
-        return {
-            legend: {
-                labels: {
-                    fontColor: "#abaeaf",
-                    fontSize: 18,
-                },
-            },
-            maintainAspectRatio: false,
-            responsive: true,
-            scales: {
-                xAxes: [{
-                    grdLines: {
-                        tickMarkLength: 15,
-                    },
-                    ticks: {
-                        autoSkip: true,
-                        fontColor: "#abaeaf",
-                        fontSize: 16,
-                    },
-                    time: {
-                        displayFormats: {
-                            "day": "YYYY-MMM-DD",
-                            "month": "YYYY-MMM",
-                            "year": "YYYY",
-                        },
-                        unit: precision,
-                        unitStepSize: 1,
-                    },
-                    type: "time",
-                }],
-                yAxes: [{
-                    gridLines: {
-                        tickMarkLength: 15,
-                    },
-                    ticks: {
-                        autoSkip: true,
-                        fontColor: "#abaeaf",
-                        fontSize: 16,
-                        min: 0,
-                        stepSize: 1,
-                    },
-                }],
-            },
-            tooltips: {
-                backgroundColor: "#232525",
-                bodyFontColor: "#abaeaf",
-                bodyFontSize: 15,
-                bodySpacing: 4,
-                titleFontColor: "#abaeaf",
-                titleFontSize: 18,
-                xPadding: 10,
-                yPadding: 10,
-            },
-            zoom: {
-                drag: true,
-                enabled: true,
-                limits: {
-                    max: 10,
-                    min: 0.5,
-                },
-                mode: "x",
-            },
-        };
-    }
-
 }
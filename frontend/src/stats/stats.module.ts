@@ -2,15 +2,17 @@ import { NgModule } from "@angular/core";
 import { StatsComponent } from "./stats.component";
 import { UtilsModule } from "../utils/utils.module";
 import { StatisticsService } from "./stats.service";
+import { PushStatsComponent } from "./push-stats.component";
+import { PushStatisticsService } from "./push-stats.service";
 
 
 /**
  * This module contains components to display statistics.
  */
 @NgModule({
-    declarations: [StatsComponent],
+    declarations: [StatsComponent, PushStatsComponent],
     imports: [UtilsModule],
-    providers: [StatisticsService],
+    providers: [StatisticsService, PushStatisticsService],
 })
 export class StatsModule {
 }
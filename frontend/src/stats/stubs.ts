@@ -9,6 +9,32 @@ export interface IStatistics {
     total_users: number;
 }
 
+/**
+ * Interface for the push notifications metrics we get from the server
+ */
+export interface IPushStatistics {
+    daily: IDailyStatContainer;
+    types: IPushTypeStatistics[];
+}
+
+/**
+ * Interface for the metrics about a type of push notifications, latencies are in milliseconds
+ */
+export interface IPushTypeStatistics {
+    type: string;
+    requests: number;
+    tokens: number;
+    tokens_per_request: number;
+    success: number;
+    failure: number;
+    deactivated: number;
+    deferred: number;
+    latency_mean: number;
+    latency_p50: number;
+    latency_p99: number;
+    latency_histogram: {le: number, count: number}[];
+}
+
 /**
  * Interface for statistics containers
  */
@@ -270,3 +296,76 @@ export class DataContainer {
     }
 
 }
+
+
+/**
+ * Get the options to give to a chart for the given precision.
+ *
+ * @param precision for which to get the options
+ */
+export function getChartOptions(precision: string) {
+    return {
+        legend: {
+            labels: {
+                fontColor: "#abaeaf",
+                fontSize: 18,
+            },
+        },
+        maintainAspectRatio: false,
+        responsive: true,
+        scales: {
+            xAxes: [{
+                grdLines: {
+                    tickMarkLength: 15,
+                },
+                ticks: {
+                    autoSkip: true,
+                    fontColor: "#abaeaf",
+                    fontSize: 16,
+                },
+                time: {
+                    displayFormats: {
+                        "day": "YYYY-MMM-DD",
+                        "month": "YYYY-MMM",
+                        "year": "YYYY",
+                    },
+                    unit: precision,
+                    unitStepSize: 1,
+                },
+                type: "time",
+            }],
+            yAxes: [{
+                gridLines: {
+                    tickMarkLength: 15,
+                },
+                ticks: {
+                    autoSkip: true,
+                    fontColor: "#abaeaf",
+                    fontSize: 16,
+                    min: 0,
+                    stepSize: 1,
+                },
+            }],
+        },
+        tooltips: {
+            backgroundColor: "#232525",
+            bodyFontColor: "#abaeaf",
+            bodyFontSize: 15,
+            bodySpacing: 4,
+            titleFontColor: "#abaeaf",
+            titleFontSize: 18,
+            xPadding: 10,
+            yPadding: 10,
+        },
+        zoom: {
+            drag: true,
+            enabled: true,
+            limits: {
+                max: 10,
+                min: 0.5,
+            },
+            mode: "x",
+        },
+    };
+}
+